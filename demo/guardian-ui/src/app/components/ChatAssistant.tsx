@@ -42,7 +42,7 @@ export default function ChatAssistant({ txData }: ChatAssistantProps) {
             const transactionContext = formatTransactionsForAI(txData);
             const flaggedAlerts = getFlaggedSummary(txData);
 
-            const res = await fetch("http://127.0.0.1:5000/chat", {
+            const res = await fetch("http://127.0.0.1:5000/chat/stream", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify({
@@ -51,9 +51,34 @@ export default function ChatAssistant({ txData }: ChatAssistantProps) {
                     model_result: flaggedAlerts
                 })
             });
+            if (!res.ok || !res.body) throw new Error(`Chat request failed: ${res.status}`);
 
-            const data = await res.json();
-            setMessages((prev) => [...prev, { role: "assistant", content: data.reply }]);
+            // STREAMING: show tokens as they arrive (Server-Sent Events, one JSON object per event)
+            setMessages((prev) => [...prev, { role: "assistant", content: "" }]);
+            setIsLoading(false);
+            const appendToReply = (text: string, replace = false) => {
+                setMessages((prev) => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, content: replace ? text : last.content + text }];
+                });
+            };
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const events = buffer.split("\n\n");
+                buffer = events.pop() ?? "";
+                for (const event of events) {
+                    if (!event.startsWith("data: ")) continue;
+                    const data = JSON.parse(event.slice(6));
+                    if (data.token) appendToReply(data.token);
+                    if (data.done && data.error) appendToReply(data.error, true);
+                }
+            }
 
         } catch (error) {
             setMessages((prev) => [...prev, { role: "assistant", content: "⚠️ Connection error. Please ensure the backend is running." }]);
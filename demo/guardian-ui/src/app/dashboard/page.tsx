@@ -29,26 +29,53 @@ export default function Dashboard() {
     };
 
     const [simIndex, setSimIndex] = useState(0);
-    const currentDateRef = useRef(new Date('2026-01-01T00:00:00'));
+    // Simulated clock. The bridge keeps this user's charge history across page loads,
+    // so the clock resumes after the last charge it has; starting over at the same
+    // date would send every charge out of order.
+    const currentDateRef = useRef<Date | null>(null);
+    const simEndRef = useRef<Date | null>(null);
+
+    useEffect(() => {
+        const start = new Date('2026-01-01T00:00:00Z');
+        fetch(`http://127.0.0.1:5000/history?user_id=${encodeURIComponent(userProfile.email)}`)
+            .then(res => res.json())
+            .then(history => {
+                const last = history.last_timestamp ? new Date(history.last_timestamp) : null;
+                if (last && last > start) start.setTime(last.getTime());
+            })
+            .catch(() => { /* bridge unreachable: the /analyze calls will fail too */ })
+            .finally(() => {
+                currentDateRef.current = start;
+                // Six simulated months per page load
+                const end = new Date(start);
+                end.setMonth(end.getMonth() + 6);
+                simEndRef.current = end;
+            });
+    }, []);
 
     // --- AUTOMATIC SIMULATION SCENARIOS ---
-    // FLAGGED FIRST for demo visibility, then safe ones
+    // Whether a charge is flagged comes from the bridge's verdict (model, guardrails
+    // or rules fallback); the override below only pins the first three for the demo
     const scenarios = [
-        { name: "Adobe Creative Cloud", amount: 79.99, cat: "Software", vector: [79.99, 25.0, 25.0, 30, 0, 1, 2] }, // FLAGGED - same price
-        { name: "McAfee Total Protection", amount: 149.99, cat: "Security", vector: [149.99, 20.0, 20.0, 365, 0, 1, 2] }, // FLAGGED - same price but AI detects pattern
-        { name: "QuickLoan Express", amount: 349.99, cat: "Finance", vector: [349.99, 25.0, 25.0, 30, 0, 1, 1] }, // FLAGGED
-        { name: "Netflix", amount: 22.99, cat: "Entertainment", vector: [22.99, 0.0, 0.0, 30, 0, 1, 3] }, // Safe
-        { name: "Spotify Family", amount: 16.99, cat: "Entertainment", vector: [16.99, 0.0, 0.0, 30, 0, 1, 3] }, // Safe
+        { name: "Adobe Creative Cloud", amount: 79.99, cat: "Software" }, // Pinned flagged (demo override)
+        { name: "McAfee Total Protection", amount: 149.99, cat: "Security" }, // Pinned flagged (demo override)
+        { name: "QuickLoan Express", amount: 349.99, cat: "Finance" }, // Pinned flagged (demo override)
+        { name: "Netflix", amount: 22.99, cat: "Entertainment" }, // Bridge verdict
+        { name: "Spotify Family", amount: 16.99, cat: "Entertainment" }, // Bridge verdict
     ];
 
     useEffect(() => {
         const interval = setInterval(async () => {
+            // Wait for the bridge's history before sending anything
+            if (!currentDateRef.current || !simEndRef.current) {
+                return;
+            }
+
             // Increment date FIRST (by 15 days)
             currentDateRef.current.setDate(currentDateRef.current.getDate() + 15);
 
-            // Stop simulation after June 2026
-            if (currentDateRef.current.getFullYear() > 2026 ||
-                (currentDateRef.current.getFullYear() === 2026 && currentDateRef.current.getMonth() > 5)) {
+            // Stop after six simulated months
+            if (currentDateRef.current > simEndRef.current) {
                 return;
             }
 
@@ -66,7 +93,16 @@ export default function Dashboard() {
                 const res = await fetch('http://127.0.0.1:5000/analyze', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ feature_vector: scenario.vector })
+                    // Send the raw charge; the bridge derives the features from this merchant's history
+                    body: JSON.stringify({
+                        transaction: {
+                            user_id: userProfile.email,
+                            merchant: scenario.name,
+                            amount: scenario.amount,
+                            timestamp: currentDateRef.current.toISOString(),
+                            category: scenario.cat
+                        }
+                    })
                 });
 
                 const aiResult = await res.json();
@@ -1,11 +1,21 @@
+import os
+import sys
 import pandas as pd
 from sklearn.metrics import confusion_matrix, accuracy_score, precision_score, recall_score, f1_score
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transaction_fraud_detection'))
+from txn_store import read_transactions
+
 def analyze_model_performance(report_path, transactions_path):
     # 1. Load the Data
     try:
         report_df = pd.read_csv(report_path)
-        transactions_df = pd.read_csv(transactions_path)
+        # Only the join keys and labels, and only for users that appear in the report
+        transactions_df = read_transactions(
+            transactions_path,
+            columns=['user_id', 'merchant', 'timestamp', 'pattern_label'],
+            filters=[('user_id', 'in', report_df['User'].unique().tolist())]
+        )
     except FileNotFoundError as e:
         print(f"Error: {e}")
         return
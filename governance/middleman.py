@@ -1,65 +1,296 @@
+import argparse
+import heapq
+import math
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Shared storage layer (Parquet copies of the transaction CSVs) lives with the pipeline code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'transaction_fraud_detection'))
+from txn_store import estimate_rows, iter_transactions, read_transactions
+from parallel_features import map_user_shards
+from features import FIRST_TXN, FREQUENCY_BUCKETS, IRREGULAR, frequency_buckets
+
+# Only what get_features_for_model() uses is read from disk
+RAW_COLUMNS = ['transaction_id', 'timestamp', 'user_id', 'merchant', 'amount', 'description', 'category']
+SPILL_SCHEMA = pa.schema([
+    ('transaction_id', pa.string()), ('timestamp', pa.timestamp('us')), ('user_id', pa.string()),
+    ('merchant', pa.string()), ('amount', pa.float64()), ('description', pa.string()), ('category', pa.string()),
+])
+USERS_SCHEMA = pa.schema([('user_id', pa.string())])
+
+# The governance model also knows yearly plans
+GOVERNANCE_FREQUENCY_BUCKETS = FREQUENCY_BUCKETS + [("Annually", 360, 370)]
+
+INCOME_BRACKETS = ['High', 'Low']
+INCOME_SEED = 42
+
+MODEL_INPUT_COLUMNS = [
+    'transaction_id', 
+    'description', 
+    'amount', 
+    'frequency_inferred', 
+    'price_change', 
+    'income_bracket', 
+    'category'
+]
+# Renamed to match Governance Sheet 
+GOVERNANCE_COLUMNS = [
+    'Transaction_ID', 'Description', 'Amount', 'Frequency', 
+    'Price_Change_Pct', 'Income_Bracket', 'Category'
+]
+
+
+def infer_freq(days):
+    if pd.isna(days): return FIRST_TXN
+    for label, low, high in GOVERNANCE_FREQUENCY_BUCKETS:
+        if low <= days <= high: return label
+    return IRREGULAR
+
+
+def add_model_features(df):
+    """
+    Sorted copy of raw transactions with price_change and frequency_inferred
+    per (user, merchant).
+    """
+    # 1. Sort by User and Merchant to find patterns
+    df = df.sort_values(by=['user_id', 'merchant', 'timestamp'])
+
+    # group by user+merchant to find price change %
+    df['prev_amount'] = df.groupby(['user_id', 'merchant'])['amount'].shift(1)
+    df['price_change'] = (df['amount'] - df['prev_amount']) / df['prev_amount']
+    
+    df['price_change'] = df['price_change'].fillna(0)
+    
+    # Calculate Frequency and map to monthly/weekly etc.
+    df['prev_date'] = df.groupby(['user_id', 'merchant'])['timestamp'].shift(1)
+    df['days_since_last'] = (df['timestamp'] - df['prev_date']).dt.days
+    df['frequency_inferred'] = frequency_buckets(df['days_since_last'], buckets=GOVERNANCE_FREQUENCY_BUCKETS)
+    return df
+
+
+def to_model_input(df):
+    model_input = df[MODEL_INPUT_COLUMNS].copy()
+    model_input.columns = GOVERNANCE_COLUMNS
+    return model_input
+
 
 class TransactionAnalyzer:
     def __init__(self, raw_data_path):
-        self.df = pd.read_csv(raw_data_path)
-        self.df['timestamp'] = pd.to_datetime(self.df['timestamp'])
+        # CSV or its txn_store.py Parquet copy; timestamps come back already parsed
+        self.df = read_transactions(raw_data_path, columns=RAW_COLUMNS)
         
-    def get_features_for_model(self):
+    def get_features_for_model(self, workers=None):
         """
         Transforms raw logs into the exact format the Governance Model expects.
+        workers > 1 spreads users over that many processes (same output).
         """
-        # 1. Sort by User and Merchant to find patterns
-        self.df = self.df.sort_values(by=['user_id', 'merchant', 'timestamp'])
-
-        # group by user+merchant to find price change %
-        self.df['prev_amount'] = self.df.groupby(['user_id', 'merchant'])['amount'].shift(1)
-        self.df['price_change'] = (self.df['amount'] - self.df['prev_amount']) / self.df['prev_amount']
-        
-        self.df['price_change'] = self.df['price_change'].fillna(0)
-        
-        # Calculate Frequency and map to monthly/weekly etc.
-        self.df['prev_date'] = self.df.groupby(['user_id', 'merchant'])['timestamp'].shift(1)
-        self.df['days_since_last'] = (self.df['timestamp'] - self.df['prev_date']).dt.days
-        self.df['frequency_inferred'] = self.df['days_since_last'].apply(self._infer_freq)
+        if workers and workers > 1:
+            self.df = map_user_shards(self.df, add_model_features, workers)
+        else:
+            self.df = add_model_features(self.df)
 
         #assigns income bracket to users. Would actually come from bank in real implementation
-        np.random.seed(42)
+        # (one draw per user in sorted user order, see StreamingTransactionAnalyzer)
+        np.random.seed(INCOME_SEED)
         users = self.df['user_id'].unique()
-        income_map = {u: np.random.choice(['High', 'Low']) for u in users}
+        income_map = {u: np.random.choice(INCOME_BRACKETS) for u in users}
         self.df['income_bracket'] = self.df['user_id'].map(income_map)
 
         # select columns for model input
-        model_input = self.df[[
-            'transaction_id', 
-            'description', 
-            'amount', 
-            'frequency_inferred', 
-            'price_change', 
-            'income_bracket', 
-            'category'
-        ]].copy()
-        
-        # Rename to match Governance Sheet 
-        model_input.columns = [
-            'Transaction_ID', 'Description', 'Amount', 'Frequency', 
-            'Price_Change_Pct', 'Income_Bracket', 'Category'
-        ]
-        
-        return model_input
+        return to_model_input(self.df)
 
     def _infer_freq(self, days):
-        if pd.isna(days): return "First_Txn"
-        if 25 <= days <= 35: return "Monthly"
-        if 6 <= days <= 8: return "Weekly"
-        if 360 <= days <= 370: return "Annually"
-        return "Irregular"
+        return infer_freq(days)
+
+
+class StreamingTransactionAnalyzer:
+    """
+    TransactionAnalyzer for inputs larger than RAM, writing the same rows.
+
+    1. The input is read in chunks and hash-partitioned on user_id into
+       Arrow spill files, so every (user, merchant) timeline lands whole
+       in one partition.
+    2. Each partition's sorted users are k-way merged to give every user
+       the income draw it gets in-memory (one seed-42 draw per user in
+       sorted order).
+    3. Partitions are featurized one at a time with the same feature logic
+       and appended to the output.
+
+    The partition count is picked so one partition's working set fits in
+    memory_budget_mb; peak memory follows that budget (plus one byte per
+    distinct user), not the input size. Rows come out grouped by partition;
+    within a partition they are in the in-memory (user, merchant, time) order.
+    """
+
+    # In-memory size of a featurized row relative to the raw row (new columns, sort copy)
+    WORKING_SET_FACTOR = 6
+    # Partitions per budget-sized slice of the input, headroom for uneven hashing
+    PARTITION_HEADROOM = 2
+
+    def __init__(self, raw_data_path, memory_budget_mb=512, spill_dir=None, partitions=None):
+        self.raw_data_path = raw_data_path
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+
+    def write_features_for_model(self, output_path):
+        """Stream the model input to output_path (CSV). Returns run stats."""
+        start = time.time()
+        workdir = tempfile.mkdtemp(prefix="middleman-spill-", dir=self.spill_dir)
+        try:
+            partitions, chunk_rows = self._plan()
+            rows_in = self._spill(workdir, partitions, chunk_rows)
+            users = self._assign_income(workdir, partitions)
+            rows_out = self._featurize(workdir, partitions, output_path)
+            spill_mb = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir)) / 1e6
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        stats = {
+            "rows_in": rows_in, "rows_out": rows_out, "users": users,
+            "partitions": partitions, "chunk_rows": chunk_rows, "spill_mb": round(spill_mb, 1),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "seconds": round(time.time() - start, 1),
+        }
+        print(f"Streamed {rows_in} rows through {partitions} partitions ({stats['spill_mb']} MB spilled) "
+              f"in {stats['seconds']}s, peak RSS {stats['peak_rss_mb']} MB.")
+        return stats
+
+    def _plan(self):
+        """(partition count, rows per input chunk) for the memory budget."""
+        sample = next(iter_transactions(self.raw_data_path, columns=RAW_COLUMNS, chunk_rows=10_000), None)
+        if sample is None or sample.empty:
+            return 1, 10_000
+        row_bytes = sample.memory_usage(deep=True).sum() / len(sample) * self.WORKING_SET_FACTOR
+        budget_rows = max(1_000, int(self.memory_budget / row_bytes))
+        partitions = self.partitions or max(1, math.ceil(estimate_rows(self.raw_data_path) / budget_rows)
+                                            * self.PARTITION_HEADROOM)
+        return partitions, budget_rows
+
+    @staticmethod
+    def _partition_of(user_ids, partitions):
+        # Stable across runs and processes (unlike hash())
+        return pd.util.hash_array(np.asarray(user_ids, dtype=object)) % np.uint64(partitions)
+
+    def _spill(self, workdir, partitions, chunk_rows):
+        writers = {}
+        rows = 0
+        try:
+            for chunk in iter_transactions(self.raw_data_path, columns=RAW_COLUMNS, chunk_rows=chunk_rows):
+                rows += len(chunk)
+                parts = self._partition_of(chunk['user_id'], partitions)
+                order = np.argsort(parts, kind='stable')  # keeps file order within each partition
+                bounds = np.searchsorted(parts[order], np.arange(partitions + 1))
+                for p in range(partitions):
+                    if bounds[p] == bounds[p + 1]:
+                        continue
+                    part = pa.Table.from_pandas(chunk.iloc[order[bounds[p]:bounds[p + 1]]],
+                                                schema=SPILL_SCHEMA, preserve_index=False)
+                    if p not in writers:
+                        writers[p] = pa.ipc.new_file(self._spill_path(workdir, p), SPILL_SCHEMA)
+                    writers[p].write_table(part)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        return rows
+
+    def _read_spill(self, workdir, p, columns=None):
+        path = self._spill_path(workdir, p)
+        if not os.path.exists(path):
+            return pa.table({name: pa.array([], type=SPILL_SCHEMA.field(name).type)
+                             for name in (columns or SPILL_SCHEMA.names)})
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.select(columns) if columns else table
+
+    def _assign_income(self, workdir, partitions):
+        """Write each partition's sorted users with their income draw; returns the user count."""
+        for p in range(partitions):
+            users = pc.unique(self._read_spill(workdir, p, ['user_id']).column('user_id')).sort()
+            with pa.ipc.new_file(self._users_path(workdir, p), USERS_SCHEMA) as writer:
+                writer.write_table(pa.table({'user_id': users}, schema=USERS_SCHEMA), max_chunksize=65536)
+
+        def sorted_users(p):
+            with pa.memory_map(self._users_path(workdir, p)) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    for user in reader.get_batch(i).column(0).to_pylist():
+                        yield user, p
+
+        # Global sorted order across partitions = the in-memory draw order
+        rng = np.random.RandomState(INCOME_SEED)
+        draws = np.empty(0, dtype=np.uint8)
+        codes = {p: bytearray() for p in range(partitions)}
+        users = 0
+        for _, p in heapq.merge(*(sorted_users(p) for p in range(partitions))):
+            if users % 65536 == 0:
+                draws = rng.choice(len(INCOME_BRACKETS), size=65536).astype(np.uint8)
+            codes[p].append(draws[users % 65536])
+            users += 1
+        for p, code in codes.items():
+            with open(self._income_path(workdir, p), 'wb') as f:
+                f.write(code)
+        return users
+
+    def _featurize(self, workdir, partitions, output_path):
+        rows = 0
+        header = True
+        for p in range(partitions):
+            table = self._read_spill(workdir, p)
+            if table.num_rows == 0:
+                continue
+            if table.nbytes * self.WORKING_SET_FACTOR > self.memory_budget:
+                print(f"Warning: partition {p} ({table.num_rows} rows) is over the memory budget.")
+            df = add_model_features(table.to_pandas())
+            with pa.memory_map(self._users_path(workdir, p)) as source:
+                users = pa.ipc.open_file(source).read_all().column('user_id').to_pandas()
+            with open(self._income_path(workdir, p), 'rb') as f:
+                income = np.array(INCOME_BRACKETS, dtype=object)[np.frombuffer(f.read(), dtype=np.uint8)]
+            df['income_bracket'] = df['user_id'].map(pd.Series(income, index=users))
+            to_model_input(df).to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+            header = False
+            rows += len(df)
+        if header:
+            pd.DataFrame(columns=GOVERNANCE_COLUMNS).to_csv(output_path, index=False)
+        return rows
+
+    @staticmethod
+    def _spill_path(workdir, p):
+        return os.path.join(workdir, f"part-{p:05d}.arrow")
+
+    @staticmethod
+    def _users_path(workdir, p):
+        return os.path.join(workdir, f"users-{p:05d}.arrow")
+
+    @staticmethod
+    def _income_path(workdir, p):
+        return os.path.join(workdir, f"income-{p:05d}.bin")
+
 
 # --- TEST BLOCK ---
 if __name__ == "__main__":
-    analyzer = TransactionAnalyzer('mock_transactions.csv')
-    clean_data = analyzer.get_features_for_model()
-    
-    #output data to new csv. This is the data to feed to granite
-    clean_data.to_csv('live_model_input.csv', index=False)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Turn raw transactions into Governance Model input")
+    parser.add_argument("input_file", nargs="?", default="mock_transactions.csv")
+    parser.add_argument("--output", default="live_model_input.csv")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Out-of-core mode for inputs larger than RAM (chunked read, on-disk partitions)")
+    parser.add_argument("--memory-mb", type=int, default=512, help="Memory budget for --streaming")
+    parser.add_argument("--spill-dir", default=None, help="Where --streaming keeps its partitions (default: temp dir)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for the in-memory mode (0 = all cores)")
+    args = parser.parse_args()
+
+    if args.streaming:
+        StreamingTransactionAnalyzer(args.input_file, args.memory_mb, args.spill_dir).write_features_for_model(args.output)
+    else:
+        analyzer = TransactionAnalyzer(args.input_file)
+        clean_data = analyzer.get_features_for_model(workers=args.workers or os.cpu_count())
+        
+        #output data to new csv. This is the data to feed to granite
+        clean_data.to_csv(args.output, index=False)
\ No newline at end of file
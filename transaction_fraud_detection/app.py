@@ -1,7 +1,16 @@
 import os
+import json
 import requests
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
+from iam_auth import IAMTokenManager, fetch_iam_token
+from resilience import CircuitBreaker, CircuitOpenError, Resilience, RetryBudget, TransientError
+from features import FIRST_TXN_DAYS
+from guardrails import GuardrailEngine, row_from_vector
+from feature_store import FeatureStateStore, to_feature_vector
+from chat_context import ChatCache, ContextCompactor
+from micro_batcher import MicroBatcher
+from chat_stream import DEFAULT_LOCAL_CHAT_MODEL, LocalChatModel, StreamStats, UnauthorizedError, stream_reply, watsonx_pieces
 
 app = Flask(__name__)
 CORS(app)
@@ -17,19 +26,90 @@ PROJECT_ID = "edc17a57-148c-4ece-af8b-afa06143f283"
 BASE_URL = "https://ca-tor.ml.cloud.ibm.com"
 SCORING_URL = " https://ca-tor.ml.cloud.ibm.com/ml/v4/deployments/2becd16b-4ea0-4365-abe8-7413a9adc139/predictions"
 
-# --- 2. AUTHENTICATION ---
-def get_iam_token(api_key):
-    """Exchange API key for IAM bearer token."""
-    url = "https://iam.cloud.ibm.com/identity/token"
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    data = f"apikey={api_key}&grant_type=urn:ibm:params:oauth:grant-type:apikey"
+# --- 2. TIMEOUTS, RETRIES AND CIRCUIT BREAKERS ---
+# Every upstream call has a connect and a read timeout. Connection errors,
+# timeouts, 429s and 5xx are retried with jittered backoff, but only while
+# the retry budget (a fraction of recent calls) lasts. A breaker per
+# upstream opens on a high error rate or too many slow calls; while the
+# scoring breaker is open /analyze answers from the local rules instead.
+CONNECT_TIMEOUT = float(os.environ.get("SENTINEL_CONNECT_TIMEOUT", "5"))
+IAM_TIMEOUT = float(os.environ.get("SENTINEL_IAM_TIMEOUT", "10"))
+SCORING_TIMEOUT = float(os.environ.get("SENTINEL_SCORING_TIMEOUT", "15"))
+CHAT_TIMEOUT = float(os.environ.get("SENTINEL_CHAT_TIMEOUT", "60"))
+RETRY_ATTEMPTS = int(os.environ.get("SENTINEL_RETRY_ATTEMPTS", "3"))
+RETRY_BUDGET = float(os.environ.get("SENTINEL_RETRY_BUDGET", "0.2"))
+BREAKER_ERROR_RATE = float(os.environ.get("SENTINEL_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_MS = float(os.environ.get("SENTINEL_BREAKER_SLOW_MS", "3000"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("SENTINEL_BREAKER_OPEN_SECONDS", "30"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_resilience(name):
+    return Resilience(
+        name,
+        breaker=CircuitBreaker(error_rate=BREAKER_ERROR_RATE, slow_ms=BREAKER_SLOW_MS,
+                               open_seconds=BREAKER_OPEN_SECONDS),
+        budget=RetryBudget(ratio=RETRY_BUDGET),
+        attempts=RETRY_ATTEMPTS,
+    )
+
+iam_resilience = make_resilience("iam")
+scoring_resilience = make_resilience("scoring")
+
+
+def post_once(url, timeout, **kwargs):
+    """One requests.post; failures worth retrying are raised as TransientError."""
     try:
-        response = requests.post(url, headers=headers, data=data)
-        response.raise_for_status()
-        return response.json()["access_token"]
-    except Exception as e:
-        print(f"Error getting IAM token: {e}")
+        response = requests.post(url, timeout=(CONNECT_TIMEOUT, timeout), **kwargs)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise TransientError(f"{url.split('?')[0]}: {e!r}")
+    if response.status_code in RETRY_STATUSES:
+        raise TransientError(f"{url.split('?')[0]}: HTTP {response.status_code} {response.text[:200]}")
+    return response
+
+
+def fetch_iam_token_resilient(api_key):
+    def fetch():
+        try:
+            return fetch_iam_token(api_key, timeout=(CONNECT_TIMEOUT, IAM_TIMEOUT))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise TransientError(f"IAM: {e!r}")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in RETRY_STATUSES:
+                raise TransientError(f"IAM: {e}")
+            raise
+    return iam_resilience.call(fetch)
+
+
+# --- 2b. AUTHENTICATION ---
+# IAM tokens are valid for an hour, so cache them per API key instead of
+# paying an extra round trip to iam.cloud.ibm.com on every request.
+token_manager = IAMTokenManager(fetch=fetch_iam_token_resilient)
+
+def get_iam_token(api_key):
+    """Return a cached (auto-refreshing) IAM bearer token for the API key."""
+    return token_manager.get_token(api_key)
+
+def refresh_iam_token(api_key):
+    """Drop the cached token after the upstream rejected it (401) and fetch a new one."""
+    print("Watsonx answered 401; refreshing the IAM token and retrying once.")
+    token_manager.invalidate(api_key)
+    return get_iam_token(api_key)
+
+def send_with_token(api_key, send):
+    """
+    Return send(token) for the API key's IAM token, or None if there is no token.
+    A 401 (revoked token or rotated key) gets one retry with a fresh token.
+    """
+    token = get_iam_token(api_key)
+    if not token:
         return None
+    response = send(token)
+    if response.status_code == 401:
+        token = refresh_iam_token(api_key)
+        if token:
+            response = send(token)
+    return response
 
 # --- 3. THE BRAIN (CHAT VERSION) ---
 PROMPT_TEMPLATE = """You are Sentinel, a financial assistant for GuardianAI.
@@ -51,69 +131,147 @@ User question: {user_input}
 
 Answer:"""
 
-def get_watson_response(user_input, transactions, model_result):
-    # 1. Get Token
-    token = get_iam_token(CHAT_API_KEY)
-    if not token:
-        return "System Error: Could not authenticate with Watsonx."
+# Repeat questions over unchanged dashboard data are answered from memory for this long
+CHAT_CACHE_TTL = int(os.environ.get("SENTINEL_CHAT_CACHE_TTL", "300"))
+CHAT_CACHE_SIZE = int(os.environ.get("SENTINEL_CHAT_CACHE_SIZE", "1024"))
+# Send only the months/merchants the question is about ("0" sends the full context)
+CHAT_COMPACT_CONTEXT = os.environ.get("SENTINEL_CHAT_COMPACT", "1") != "0"
 
-    # 2. Prepare Payload
-    url = f"{BASE_URL}/ml/v1/text/generation?version=2023-05-29"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json",
-        "Accept": "application/json"
-    }
+CHAT_MODEL_ID = "meta-llama/llama-3-1-8b-instruct"  # Faster 8B model for quick responses
+CHAT_MAX_NEW_TOKENS = 100  # Reduced further for concise responses
+CHAT_STOP_SEQUENCES = ["User question:", "User:", "\n\n", "TRANSACTION", "Answer:"]
 
-    full_prompt = PROMPT_TEMPLATE.format(
+# Where chat replies come from:
+#   watsonx - CHAT_MODEL_ID on watsonx.ai text generation (default)
+#   local   - a local Granite instruct model (offline), see SENTINEL_CHAT_LOCAL_MODEL
+CHAT_BACKEND = os.environ.get("SENTINEL_CHAT_BACKEND", "watsonx")
+LOCAL_CHAT_MODEL = os.environ.get("SENTINEL_CHAT_LOCAL_MODEL", DEFAULT_LOCAL_CHAT_MODEL)
+
+chat_cache = ChatCache(ttl=CHAT_CACHE_TTL, max_entries=CHAT_CACHE_SIZE)
+context_compactor = ContextCompactor()
+local_chat = LocalChatModel(LOCAL_CHAT_MODEL)
+stream_stats = StreamStats()
+
+def build_chat_prompt(user_input, transactions, model_result):
+    if CHAT_COMPACT_CONTEXT:
+        transactions, model_result = context_compactor.compact(user_input, transactions, model_result)
+
+    return PROMPT_TEMPLATE.format(
         user_input=user_input,
         transactions=transactions,
         model_result=model_result
     )
 
+def chat_request(token, full_prompt):
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "Content-Type": "application/json",
+        "Accept": "application/json"
+    }
     body = {
-        "model_id": "meta-llama/llama-3-1-8b-instruct",  # Faster 8B model for quick responses
+        "model_id": CHAT_MODEL_ID,
         "input": full_prompt,
         "parameters": {
             "decoding_method": "greedy",
-            "max_new_tokens": 100,  # Reduced further for concise responses
-            "stop_sequences": ["User question:", "User:", "\n\n", "TRANSACTION", "Answer:"]
+            "max_new_tokens": CHAT_MAX_NEW_TOKENS,
+            "stop_sequences": CHAT_STOP_SEQUENCES
         },
         "project_id": PROJECT_ID
     }
+    return headers, body
+
+def get_watson_response(user_input, transactions, model_result):
+    if CHAT_BACKEND == "local":
+        done = list(stream_chat(user_input, transactions, model_result))[-1]
+        return done.get("error") or done["reply"]
 
-    # 3. Call API
+    # 1. Prepare Payload
+    url = f"{BASE_URL}/ml/v1/text/generation?version=2023-05-29"
+    full_prompt = build_chat_prompt(user_input, transactions, model_result)
+
+    def send(token):
+        headers, body = chat_request(token, full_prompt)
+        return requests.post(url, headers=headers, json=body, timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT))
+
+    # 2. Call API (with a cached token, refreshed once on 401)
     try:
-        response = requests.post(url, headers=headers, json=body)
+        response = send_with_token(CHAT_API_KEY, send)
+        if response is None:
+            return "System Error: Could not authenticate with Watsonx."
         if response.status_code != 200:
             print(f"API Error {response.status_code}: {response.text}")
             return "System Error: Watsonx API request failed."
         
-        result = response.json()
-        return result['results'][0]['generated_text'].strip()
+        return parse_chat_response(response)
 
     except Exception as e:
         print(f"Error calling Watsonx: {e}")
         return "System Error: Failed to generate response."
 
+def parse_chat_response(response):
+    result = response.json()
+    return result['results'][0]['generated_text'].strip()
+
+def stream_chat(user_input, transactions, model_result):
+    """
+    Chat reply as events: {"token": text} while generating, then a final
+    {"done": True, "reply", "ttft_ms", "total_ms", "tokens"} (plus "error" on failure).
+    """
+    full_prompt = build_chat_prompt(user_input, transactions, model_result)
+    if CHAT_BACKEND == "local":
+        pieces = local_chat.pieces(full_prompt, CHAT_MAX_NEW_TOKENS)
+    else:
+        token = get_iam_token(CHAT_API_KEY)
+        if not token:
+            yield {"done": True, "reply": "", "ttft_ms": None, "total_ms": 0, "tokens": 0,
+                   "error": "System Error: Could not authenticate with Watsonx."}
+            return
+        pieces = watsonx_chat_pieces(token, full_prompt)
+    yield from stream_reply(pieces, CHAT_STOP_SEQUENCES, stats=stream_stats)
+
+def watsonx_chat_pieces(token, full_prompt):
+    """watsonx_pieces() for the chat model; a 401 refreshes the IAM token and retries once."""
+    url = f"{BASE_URL}/ml/v1/text/generation_stream?version=2023-05-29"
+    try:
+        yield from watsonx_pieces(requests, url, *chat_request(token, full_prompt),
+                                  timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT))
+        return
+    except UnauthorizedError:
+        # Raised before any text, so nothing has reached the client yet
+        token = refresh_iam_token(CHAT_API_KEY)
+        if not token:
+            raise
+    yield from watsonx_pieces(requests, url, *chat_request(token, full_prompt),
+                              timeout=(CONNECT_TIMEOUT, CHAT_TIMEOUT))
+
 # --- 4. THE BRAIN (SCORING VERSION) ---
-def analyze_transaction(transaction_data):
-    # Unpack the data so we can check it
-    # Format: [Amount, Price_Change_Pct, Total_Change, Days_Diff, Quick_Charge, Freq, Cat]
-    price_change = transaction_data[1]
-    days_diff = transaction_data[3]
-    is_quick = transaction_data[4]
-    
-    # 1. GET THE SCORE FROM WATSON
-    token = get_iam_token(SCORING_API_KEY)
-    
-    # --- THE FIX IS HERE ---
-    # We must explicitly list the column names so Watson knows what the values are.
-    # Also need to add ?version= query param and ensure proper data types
-    scoring_url_with_version = f"{SCORING_URL}?version=2023-05-29"
-    
+# Format: [Amount, Price_Change_Pct, Total_Change, Days_Diff, Quick_Charge, Freq, Cat]
+SCORING_FIELDS = ['amount', 'price_change_pct', 'total_change_pct', 'days_diff', 'is_quick_charge', 'frequency', 'category']
+FLAG_THRESHOLD = 0.40
+
+# Rows per predictions call for /analyze/batch (watsonx accepts many rows per request)
+BATCH_CHUNK_SIZE = int(os.environ.get("SENTINEL_BATCH_CHUNK_SIZE", "500"))
+
+# Where scores come from:
+#   remote                     - watsonx deployment at SCORING_URL (default)
+#   local                      - in-process copy of the same Random Forest (export_local_model.py)
+#   local-with-remote-fallback - local model, watsonx if it is missing or fails
+SCORING_BACKEND = os.environ.get("SENTINEL_SCORING_BACKEND", "remote")
+LOCAL_MODEL_PATH = os.environ.get("SENTINEL_LOCAL_MODEL", "veteran_rf.joblib")
+SCORING_BACKENDS = ("remote", "local", "local-with-remote-fallback")
+
+
+class ScoringError(Exception):
+    """Raised when watsonx cannot score a request; `explanation` is safe to show the user."""
+
+    def __init__(self, message, explanation="Error analyzing transaction"):
+        super().__init__(message)
+        self.explanation = explanation
+
+
+def _typed_values(transaction_data):
     # Ensure proper data types for all values
-    typed_values = [
+    return [
         float(transaction_data[0]),  # amount
         float(transaction_data[1]),  # price_change_pct
         float(transaction_data[2]),  # total_change_pct
@@ -122,71 +280,290 @@ def analyze_transaction(transaction_data):
         str(transaction_data[5]),    # frequency
         str(transaction_data[6])     # category
     ]
-    
+
+
+def _extract_fraud_prob(values):
+    # Structure is typically: values = [prediction, [prob_0, prob_1]]
+    # The probability might be at index [1] as a list [prob_class_0, prob_class_1]
+    # We want the probability of class 1 (flagged)
+    if isinstance(values[1], list):
+        return values[1][1]  # Get prob_class_1 from [prob_0, prob_1]
+    return values[1]  # Direct probability value
+
+
+def load_local_scorer():
+    if SCORING_BACKEND not in SCORING_BACKENDS:
+        raise ValueError(f"SENTINEL_SCORING_BACKEND must be one of {SCORING_BACKENDS}, got {SCORING_BACKEND!r}")
+    if SCORING_BACKEND == "remote":
+        return None
+    try:
+        from local_scorer import LocalScorer
+        return LocalScorer.load(LOCAL_MODEL_PATH)
+    except Exception as e:
+        if SCORING_BACKEND == "local":
+            raise
+        print(f"Warning: local model unavailable ({e}). Scoring with watsonx only.")
+        return None
+
+local_scorer = load_local_scorer()
+
+
+def score_rows(rows):
+    """Fraud probabilities for many feature vectors, in row order, from the configured backend."""
+    if local_scorer is not None:
+        try:
+            return local_scorer.score_rows(rows)
+        except Exception as e:
+            if SCORING_BACKEND == "local":
+                raise ScoringError(f"Local scoring failed: {e}")
+            print(f"Local scoring failed ({e}); falling back to watsonx.")
+    return score_rows_remote(rows)
+
+
+def score_rows_remote(rows):
+    """Score many feature vectors with ONE watsonx predictions call. Returns fraud probabilities in row order."""
+    def send(token):
+        url, payload, headers = scoring_request(token, rows)
+        return scoring_resilience.call(post_once, url, SCORING_TIMEOUT, json=payload, headers=headers)
+
+    try:
+        response = send_with_token(SCORING_API_KEY, send)
+    except CircuitOpenError:
+        raise ScoringError("Scoring circuit open.", "Scoring service unavailable.")
+    except TransientError as e:
+        raise ScoringError(f"Watsonx request failed: {e}", "Scoring service unavailable.")
+    if response is None:
+        raise ScoringError("Could not authenticate with Watsonx.")
+    if response.status_code != 200:
+        raise ScoringError(f"Watsonx Error Response: {response.text}")
+    return parse_predictions(response, len(rows))
+
+
+def scoring_request(token, rows):
+    """URL, JSON payload and headers for one watsonx predictions call."""
+    # We must explicitly list the column names so Watson knows what the values are.
+    # Also need to add ?version= query param and ensure proper data types
+    scoring_url_with_version = f"{SCORING_URL.strip()}?version=2023-05-29"
     payload = {
         "input_data": [{
-            "fields": ['amount', 'price_change_pct', 'total_change_pct', 'days_diff', 'is_quick_charge', 'frequency', 'category'],
-            "values": [typed_values]
+            "fields": SCORING_FIELDS,
+            "values": [_typed_values(row) for row in rows]
         }]
     }
-    
-    # Send the request
-    response = requests.post(
-        scoring_url_with_version, 
-        json=payload, 
-        headers={"Authorization": "Bearer " + token}
-    )
-    
-    # Check if the request failed
-    if response.status_code != 200:
-        print(f"Watsonx Error Response: {response.text}")
-        return {"risk_score": 0, "is_flagged": False, "explanation": "Error analyzing transaction"}
+    return scoring_url_with_version, payload, {"Authorization": "Bearer " + token}
+
 
-    # Get fraud probability (e.g., 0.85)
+def parse_predictions(response, n_rows):
+    """Fraud probabilities from a successful predictions response (requests or httpx)."""
     try:
         result_json = response.json()
-        print(f"Watsonx Response: {result_json}")  # Debug log
-        
-        # Extract the values - structure is typically: values = [[prediction, [prob_0, prob_1]]]
-        values = result_json['predictions'][0]['values'][0]
-        
-        # The probability might be at index [1] as a list [prob_class_0, prob_class_1]
-        # We want the probability of class 1 (flagged)
-        if isinstance(values[1], list):
-            fraud_prob = values[1][1]  # Get prob_class_1 from [prob_0, prob_1]
-        else:
-            fraud_prob = values[1]  # Direct probability value
-            
-    except (KeyError, IndexError, TypeError) as e:
-        print(f"Error parsing response: {e}")
-        # Fallback if the response format is unexpected
-        return {"risk_score": 0, "is_flagged": False, "explanation": "Unexpected response format from Watson."}
-    
-    # 2. GENERATE THE "WHY" (The Logic Wrapper)
+        predictions = result_json['predictions'][0]['values']
+        print(f"Watsonx Response: {len(predictions)} predictions")  # Debug log
+        if len(predictions) != n_rows:
+            raise IndexError(f"expected {n_rows} predictions, got {len(predictions)}")
+        return [_extract_fraud_prob(values) for values in predictions]
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        raise ScoringError(f"Error parsing response: {e}", "Unexpected response format from Watson.")
+
+
+# Concurrent single-vector /analyze calls are coalesced into one multi-row
+# scoring call: wait up to MICROBATCH_WAIT_MS for up to MICROBATCH_MAX rows.
+# SENTINEL_MICROBATCH_MAX=1 scores every request on its own.
+MICROBATCH_MAX = int(os.environ.get("SENTINEL_MICROBATCH_MAX", "64"))
+MICROBATCH_WAIT_MS = float(os.environ.get("SENTINEL_MICROBATCH_WAIT_MS", "2"))
+
+
+def scoring_key(transaction_data):
+    """Identical vectors (after type coercion) share one score."""
+    return tuple(_typed_values(transaction_data))
+
+
+micro_batcher = MicroBatcher(
+    score_rows, max_batch=MICROBATCH_MAX, max_wait_ms=MICROBATCH_WAIT_MS, key=scoring_key
+) if MICROBATCH_MAX > 1 else None
+
+
+# Same Double Billing / Zombie rules as the offline Veteran report, so both agree
+guardrail_engine = GuardrailEngine()
+
+
+# Every /analyze verdict says which path produced it in "source":
+#   model     - fraud probability from the scoring model
+#   guardrail - a Double Billing / Zombie guardrail, whatever the model says
+#   rules     - scoring unavailable (breaker open or call failed); the
+#               price surge / zombie / rapid-fire rules decide on their own
+RULES_RISK_SCORE = 0.75
+# price_change_pct is a fraction (0.20 = +20%); at or above this a charge is a "Price Surge"
+PRICE_SURGE_PCT = 0.20
+
+
+def guardrail_verdict(transaction_data, context=None):
+    # Guardrails take priority over the AI score, first matching rule wins
+    rule = guardrail_engine.evaluate(row_from_vector(transaction_data, context))
+    if rule is None:
+        return None
+    return {"risk_score": rule.risk_score, "is_flagged": True, "explanation": rule.reason, "source": "guardrail"}
+
+
+def big3_reasons(transaction_data):
+    """Which of the "Big 3" triggers (zombie, price surge, rapid-fire) a feature vector hits."""
     reasons = []
-    
+    # days_diff is FIRST_TXN_DAYS for a (user, merchant)'s first charge, which is no zombie
+    if 60 <= transaction_data[3] < FIRST_TXN_DAYS:
+        reasons.append("Zombie Billing (Inactive for 60+ days)")
+    if transaction_data[1] >= PRICE_SURGE_PCT:
+        reasons.append(f"Price Surge ({transaction_data[1] * 100:.0f}% increase detected)")
+    if transaction_data[4]:
+        reasons.append("Rapid-Fire Charge (Too fast)")
+    return reasons
+
+
+def rules_verdict(transaction_data, context=None, fallback_reason=None):
+    """The /analyze response without a model score, from the guardrails and the "Big 3" triggers."""
+    verdict = guardrail_verdict(transaction_data, context)
+    if verdict is None:
+        reasons = big3_reasons(transaction_data)
+        verdict = {
+            "risk_score": RULES_RISK_SCORE if reasons else 0,
+            "is_flagged": bool(reasons),
+            "explanation": " + ".join(reasons) if reasons else "Transaction looks safe.",
+            "source": "rules",
+        }
+    if fallback_reason:
+        verdict["fallback_reason"] = fallback_reason
+    return verdict
+
+
+def explain_score(transaction_data, fraud_prob, context=None):
+    """
+    Turn a fraud probability into the /analyze response for one feature vector.
+    `context` can carry engineered fields the vector lacks (e.g. relationship_days).
+    """
+    verdict = guardrail_verdict(transaction_data, context)
+    if verdict is not None:
+        return verdict
+
+    price_change = transaction_data[1]
+
+    # GENERATE THE "WHY" (The Logic Wrapper)
+    reasons = []
+
     # LOCAL OVERRIDE: Flag if price change is 20% or more, regardless of AI score
     # This ensures our demo scenarios work correctly
-    is_flagged = fraud_prob > 0.40 or price_change >= 20.0
-    
+    is_flagged = fraud_prob > FLAG_THRESHOLD or price_change >= PRICE_SURGE_PCT
+
     if is_flagged:
         # Check the "Big 3" Triggers
-        if days_diff >= 60:
-            reasons.append("Zombie Billing (Inactive for 60+ days)")
-        
-        if price_change >= 20.0:
-            reasons.append(f"Price Surge ({price_change}% increase detected)")
-            
-        if is_quick:
-            reasons.append("Rapid-Fire Charge (Too fast)")
-            
+        reasons = big3_reasons(transaction_data)
+
         if not reasons:
             reasons.append("Suspicious Pattern (General Anomaly)")
 
     return {
         "risk_score": fraud_prob,
-        "is_flagged": fraud_prob > 0.40,
-        "explanation": " + ".join(reasons) if reasons else "Transaction looks safe."
+        "is_flagged": is_flagged,
+        "explanation": " + ".join(reasons) if reasons else "Transaction looks safe.",
+        "source": "model"
+    }
+
+
+def analyze_transaction(transaction_data, context=None):
+    # 1. GET THE SCORE FROM WATSON
+    try:
+        if micro_batcher is not None:
+            fraud_prob = micro_batcher.score(transaction_data)
+        else:
+            fraud_prob = score_rows([transaction_data])[0]
+    except ScoringError as e:
+        print(f"{e} Falling back to rules.")
+        return rules_verdict(transaction_data, context, e.explanation)
+
+    # 2. GENERATE THE "WHY"
+    return explain_score(transaction_data, fraud_prob, context)
+
+
+# --- 4b. SERVER-SIDE FEATURES ---
+# Per-(user, merchant) history lives here so clients can send raw transactions
+# instead of re-implementing engineer_features() themselves.
+FEATURE_STORE_PATH = os.environ.get("SENTINEL_FEATURE_STORE", "feature_state.db")
+RAW_TRANSACTION_FIELDS = ['user_id', 'merchant', 'amount', 'timestamp', 'category']
+feature_store = FeatureStateStore(FEATURE_STORE_PATH)
+
+
+def analyze_raw_transaction(transaction, record=True):
+    """
+    Derive the feature vector from stored history, then score it like /analyze.
+    With record=False the transaction is scored but not added to the history.
+    """
+    if record:
+        features = feature_store.observe(transaction)
+    else:
+        features = feature_store.features_for(transaction)
+    vector = to_feature_vector(features, transaction['category'])
+    context = {
+        "same_amount": features["same_amount"],
+        "relationship_days": features["relationship_days"],
+    }
+    result = analyze_transaction(vector, context)
+    result["feature_vector"] = vector
+    return result
+
+
+def user_history(user_id):
+    """What the feature store holds for a user, so clients can keep sending charges in time order."""
+    last = feature_store.last_timestamp(user_id)
+    return {"user_id": user_id, "last_timestamp": last.isoformat() + "Z" if last else None}
+
+
+def analyze_batch(feature_vectors, chunk_size=BATCH_CHUNK_SIZE):
+    """
+    Score many feature vectors, chunk_size rows per watsonx call.
+    Results come back in input order; a failed chunk only fails its own rows.
+    """
+    results = []
+    chunks = []
+    for start in range(0, len(feature_vectors), chunk_size):
+        chunk = feature_vectors[start:start + chunk_size]
+        report = {"chunk": len(chunks), "start": start, "size": len(chunk), "ok": True}
+        try:
+            probs = score_rows(chunk)
+            results.extend(explain_score(vector, prob) for vector, prob in zip(chunk, probs))
+        except ScoringError as e:
+            print(f"Batch chunk {report['chunk']} failed: {e}")
+            report["ok"] = False
+            report["error"] = e.explanation
+            results.extend(rules_verdict(vector, fallback_reason=e.explanation) for vector in chunk)
+        chunks.append(report)
+
+    return {
+        "results": results,
+        "chunks": chunks,
+        "failed_chunks": sum(1 for c in chunks if not c["ok"])
+    }
+
+
+def validate_batch_request(feature_vectors, chunk_size):
+    """Error message for a bad /analyze/batch body, or None."""
+    if not feature_vectors or not isinstance(feature_vectors, list):
+        return "No feature_vectors provided"
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        return "chunk_size must be a positive integer"
+    for i, vector in enumerate(feature_vectors):
+        try:
+            _typed_values(vector)
+        except (TypeError, ValueError, IndexError):
+            return f"feature_vectors[{i}] is not a valid 7-field feature vector"
+    return None
+
+
+def collect_stats():
+    return {
+        "iam_tokens": token_manager.stats(),
+        "chat_cache": chat_cache.stats(),
+        "chat_context": context_compactor.stats(),
+        "chat_stream": stream_stats.stats(),
+        "micro_batcher": micro_batcher.stats() if micro_batcher is not None else None,
+        "resilience": {"iam": iam_resilience.stats(), "scoring": scoring_resilience.stats()}
     }
 
 
@@ -199,24 +576,101 @@ def chat():
     tx_data = data.get('transactions', "No transactions provided.")
     risk_data = data.get('model_result', "No alerts.")
     
-    response_text = get_watson_response(user_msg, tx_data, risk_data)
+    cache_key = chat_cache.key(user_msg, tx_data, risk_data)
+    response_text = chat_cache.get(cache_key)
+    if response_text is None:
+        response_text = get_watson_response(user_msg, tx_data, risk_data)
+        if not response_text.startswith("System Error"):
+            chat_cache.put(cache_key, response_text)
     return jsonify({"reply": response_text})
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """/chat as Server-Sent Events: one `data: {json}` event per token, then a summary event."""
+    print("Received streaming chat request...")
+    data = request.json
+    user_msg = data.get('message')
+    tx_data = data.get('transactions', "No transactions provided.")
+    risk_data = data.get('model_result', "No alerts.")
+    cache_key = chat_cache.key(user_msg, tx_data, risk_data)
+    cached = chat_cache.get(cache_key)
+
+    def events():
+        if cached is not None:
+            yield {"token": cached}
+            yield {"done": True, "reply": cached, "ttft_ms": 0.0, "total_ms": 0.0, "tokens": 0, "cached": True}
+            return
+        for event in stream_chat(user_msg, tx_data, risk_data):
+            if event.get("done") and not event.get("error"):
+                chat_cache.put(cache_key, event["reply"])
+            yield event
+
+    def sse():
+        for event in events():
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(sse()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     print("Received analysis request...")
     data = request.json
     # Expected format: {"feature_vector": [19.99, 0.0, 0.0, 30, 0, 1, 3]}
+    # or a raw transaction: {"transaction": {"user_id": ..., "merchant": ..., "amount": ..., "timestamp": ..., "category": ...}}
+    transaction = data.get('transaction')
+    if transaction is not None:
+        missing = [f for f in RAW_TRANSACTION_FIELDS if f not in transaction]
+        if missing:
+            return jsonify({"error": f"transaction is missing fields: {', '.join(missing)}"}), 400
+        try:
+            result = analyze_raw_transaction(transaction, record=data.get('record', True))
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid transaction: {e}"}), 400
+        return jsonify(result)
+
     feature_vector = data.get('feature_vector')
     
     if not feature_vector:
-        return jsonify({"error": "No feature_vector provided"}), 400
+        return jsonify({"error": "No feature_vector or transaction provided"}), 400
         
     result = analyze_transaction(feature_vector)
     return jsonify(result)
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch_route():
+    print("Received batch analysis request...")
+    data = request.json or {}
+    # Expected format: {"feature_vectors": [[19.99, 0.0, 0.0, 30, 0, "Monthly", "Software"], ...], "chunk_size": 500}
+    feature_vectors = data.get('feature_vectors')
+    chunk_size = data.get('chunk_size', BATCH_CHUNK_SIZE)
+
+    error = validate_batch_request(feature_vectors, chunk_size)
+    if error:
+        return jsonify({"error": error}), 400
+
+    result = analyze_batch(feature_vectors, chunk_size)
+    return jsonify(result)
+
+@app.route('/history', methods=['GET'])
+def history():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({"error": "user_id is required"}), 400
+    return jsonify(user_history(user_id))
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(collect_stats())
+
 if __name__ == '__main__':
     print("🚀 Sentinel Bridge running on port 5000")
+    print(f"   Scoring backend: {SCORING_BACKEND}")
+    print(f"   Chat backend: {CHAT_BACKEND}")
     print("   Endpoint: http://localhost:5000/chat")
+    print("   Endpoint: http://localhost:5000/chat/stream")
     print("   Endpoint: http://localhost:5000/analyze")
+    print("   Endpoint: http://localhost:5000/analyze/batch")
+    print("   Endpoint: http://localhost:5000/history")
+    print("   Endpoint: http://localhost:5000/stats")
     app.run(port=5000)
@@ -0,0 +1,419 @@
+# Async (ASGI) serving mode for the Sentinel bridge.
+#
+# Same routes and JSON contract as app.py, but upstream watsonx calls go
+# through one shared keep-alive httpx connection pool instead of a blocking
+# requests.post per call, so one process can hold hundreds of requests in
+# flight. Scoring, guardrails, feature state and chat caching come from app.py.
+#
+# Run with:  python app_async.py   (or: uvicorn app_async:app --port 5000)
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+import app as bridge
+from app import ScoringError
+from chat_stream import ReplyStream, sse_data, sse_pieces
+from micro_batcher import AsyncMicroBatcher
+from resilience import CircuitOpenError, TransientError
+
+# --- 1. CONNECTION POOL AND LIMITS ---
+HTTP_MAX_CONNECTIONS = int(os.environ.get("SENTINEL_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("SENTINEL_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("SENTINEL_HTTP_KEEPALIVE_EXPIRY", "30"))
+# Timeouts, retries and breakers are app.py's (SENTINEL_*_TIMEOUT etc.)
+CONNECT_TIMEOUT = bridge.CONNECT_TIMEOUT
+# Per-upstream: (read timeout seconds, max concurrent calls)
+SCORING_TIMEOUT = bridge.SCORING_TIMEOUT
+SCORING_CONCURRENCY = int(os.environ.get("SENTINEL_SCORING_CONCURRENCY", "64"))
+CHAT_TIMEOUT = bridge.CHAT_TIMEOUT
+CHAT_CONCURRENCY = int(os.environ.get("SENTINEL_CHAT_CONCURRENCY", "32"))
+
+
+class Upstream:
+    """
+    One upstream service: its timeout and a semaphore bounding concurrent
+    calls. Requests beyond the bound wait their turn instead of opening ever
+    more connections to watsonx.
+    """
+
+    def __init__(self, name, read_timeout, concurrency):
+        self.name = name
+        self.timeout = httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.wait_ms = 0.0
+
+    @asynccontextmanager
+    async def slot(self):
+        queued = time.monotonic()
+        async with self.semaphore:
+            self.wait_ms += (time.monotonic() - queued) * 1000
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                yield
+            except httpx.TimeoutException:
+                self.timeouts += 1
+                self.errors += 1
+                raise
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self.wait_ms / self.calls, 2) if self.calls else 0.0,
+        }
+
+
+scoring_upstream = Upstream("scoring", SCORING_TIMEOUT, SCORING_CONCURRENCY)
+chat_upstream = Upstream("chat", CHAT_TIMEOUT, CHAT_CONCURRENCY)
+client = None
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global client
+    client = httpx.AsyncClient(limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    ))
+    try:
+        yield
+    finally:
+        if micro_batcher is not None:
+            await micro_batcher.close()
+        await client.aclose()
+
+
+async def get_iam_token(api_key):
+    # Almost always a cache hit; a refresh blocks on iam.cloud.ibm.com, so keep it off the loop
+    return await run_in_threadpool(bridge.get_iam_token, api_key)
+
+
+async def refresh_iam_token(api_key):
+    return await run_in_threadpool(bridge.refresh_iam_token, api_key)
+
+
+async def send_with_token(api_key, send):
+    """app.send_with_token() for an async send(token): one retry with a fresh token on 401."""
+    token = await get_iam_token(api_key)
+    if not token:
+        return None
+    response = await send(token)
+    if response.status_code == 401:
+        token = await refresh_iam_token(api_key)
+        if token:
+            response = await send(token)
+    return response
+
+
+# --- 2. SCORING ---
+async def score_rows_remote(rows):
+    async def send(token):
+        url, payload, headers = bridge.scoring_request(token, rows)
+        return await bridge.scoring_resilience.acall(post_once, url, payload, headers)
+
+    async def post_once(url, payload, headers):
+        try:
+            async with scoring_upstream.slot():
+                response = await client.post(url, json=payload, headers=headers, timeout=scoring_upstream.timeout)
+        except httpx.HTTPError as e:
+            raise TransientError(f"Watsonx request failed: {e!r}")
+        if response.status_code in bridge.RETRY_STATUSES:
+            raise TransientError(f"Watsonx HTTP {response.status_code}: {response.text[:200]}")
+        return response
+
+    try:
+        response = await send_with_token(bridge.SCORING_API_KEY, send)
+    except CircuitOpenError:
+        raise ScoringError("Scoring circuit open.", "Scoring service unavailable.")
+    except TransientError as e:
+        raise ScoringError(str(e), "Scoring service unavailable.")
+    if response is None:
+        raise ScoringError("Could not authenticate with Watsonx.")
+    if response.status_code != 200:
+        raise ScoringError(f"Watsonx Error Response: {response.text}")
+    return bridge.parse_predictions(response, len(rows))
+
+
+async def score_rows(rows):
+    """app.score_rows() without blocking the event loop."""
+    if bridge.local_scorer is not None:
+        try:
+            return await run_in_threadpool(bridge.local_scorer.score_rows, rows)
+        except Exception as e:
+            if bridge.SCORING_BACKEND == "local":
+                raise ScoringError(f"Local scoring failed: {e}")
+            print(f"Local scoring failed ({e}); falling back to watsonx.")
+    return await score_rows_remote(rows)
+
+
+micro_batcher = AsyncMicroBatcher(
+    score_rows, max_batch=bridge.MICROBATCH_MAX, max_wait_ms=bridge.MICROBATCH_WAIT_MS, key=bridge.scoring_key
+) if bridge.MICROBATCH_MAX > 1 else None
+
+
+async def analyze_transaction(transaction_data, context=None):
+    try:
+        if micro_batcher is not None:
+            fraud_prob = await micro_batcher.score(transaction_data)
+        else:
+            fraud_prob = (await score_rows([transaction_data]))[0]
+    except ScoringError as e:
+        print(f"{e} Falling back to rules.")
+        return bridge.rules_verdict(transaction_data, context, e.explanation)
+    return bridge.explain_score(transaction_data, fraud_prob, context)
+
+
+async def analyze_raw_transaction(transaction, record=True):
+    store = bridge.feature_store
+    features = await run_in_threadpool(store.observe if record else store.features_for, transaction)
+    vector = bridge.to_feature_vector(features, transaction['category'])
+    context = {
+        "same_amount": features["same_amount"],
+        "relationship_days": features["relationship_days"],
+    }
+    result = await analyze_transaction(vector, context)
+    result["feature_vector"] = vector
+    return result
+
+
+async def analyze_batch(feature_vectors, chunk_size):
+    """app.analyze_batch(), with the chunks scored concurrently."""
+    starts = list(range(0, len(feature_vectors), chunk_size))
+    chunks = [feature_vectors[start:start + chunk_size] for start in starts]
+    outcomes = await asyncio.gather(*(score_rows(chunk) for chunk in chunks), return_exceptions=True)
+
+    results = []
+    reports = []
+    for i, (start, chunk, outcome) in enumerate(zip(starts, chunks, outcomes)):
+        report = {"chunk": i, "start": start, "size": len(chunk), "ok": True}
+        if isinstance(outcome, ScoringError):
+            print(f"Batch chunk {i} failed: {outcome}")
+            report["ok"] = False
+            report["error"] = outcome.explanation
+            results.extend(bridge.rules_verdict(vector, fallback_reason=outcome.explanation) for vector in chunk)
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results.extend(bridge.explain_score(vector, prob) for vector, prob in zip(chunk, outcome))
+        reports.append(report)
+
+    return {
+        "results": results,
+        "chunks": reports,
+        "failed_chunks": sum(1 for c in reports if not c["ok"])
+    }
+
+
+# --- 3. CHAT ---
+async def get_watson_response(user_input, transactions, model_result):
+    if bridge.CHAT_BACKEND == "local":
+        return await run_in_threadpool(bridge.get_watson_response, user_input, transactions, model_result)
+
+    url = f"{bridge.BASE_URL}/ml/v1/text/generation?version=2023-05-29"
+    full_prompt = bridge.build_chat_prompt(user_input, transactions, model_result)
+
+    async def send(token):
+        headers, body = bridge.chat_request(token, full_prompt)
+        async with chat_upstream.slot():
+            return await client.post(url, headers=headers, json=body, timeout=chat_upstream.timeout)
+
+    try:
+        response = await send_with_token(bridge.CHAT_API_KEY, send)
+        if response is None:
+            return "System Error: Could not authenticate with Watsonx."
+        if response.status_code != 200:
+            print(f"API Error {response.status_code}: {response.text}")
+            return "System Error: Watsonx API request failed."
+        return bridge.parse_chat_response(response)
+    except Exception as e:
+        print(f"Error calling Watsonx: {e!r}")
+        return "System Error: Failed to generate response."
+
+
+async def stream_chat(user_input, transactions, model_result):
+    """Async app.stream_chat(): the same token and summary events."""
+    if bridge.CHAT_BACKEND == "local":
+        async for event in iterate_in_threadpool(bridge.stream_chat(user_input, transactions, model_result)):
+            yield event
+        return
+
+    token = await get_iam_token(bridge.CHAT_API_KEY)
+    if not token:
+        yield {"done": True, "reply": "", "ttft_ms": None, "total_ms": 0, "tokens": 0,
+               "error": "System Error: Could not authenticate with Watsonx."}
+        return
+    url = f"{bridge.BASE_URL}/ml/v1/text/generation_stream?version=2023-05-29"
+    full_prompt = bridge.build_chat_prompt(user_input, transactions, model_result)
+
+    stream = ReplyStream(bridge.CHAT_STOP_SEQUENCES, bridge.stream_stats)
+    error = None
+    try:
+        for retry in (False, True):
+            headers, body = bridge.chat_request(token, full_prompt)
+            headers["Accept"] = "text/event-stream"
+            async with chat_upstream.slot():
+                async with client.stream("POST", url, headers=headers, json=body,
+                                         timeout=chat_upstream.timeout) as response:
+                    unauthorized = response.status_code == 401 and not retry
+                    if response.status_code != 200 and not unauthorized:
+                        raise RuntimeError(f"API Error {response.status_code}: {(await response.aread())!r}")
+                    if not unauthorized:
+                        async for line in response.aiter_lines():
+                            for text, count in sse_pieces([sse_data(line)]):
+                                for event in stream.feed(text, count):
+                                    yield event
+                            if stream.stopped:
+                                # Leaving the block closes the connection and stops generation upstream
+                                break
+            if not unauthorized:
+                break
+            # Nothing was streamed yet: retry once with a fresh token
+            token = await refresh_iam_token(bridge.CHAT_API_KEY)
+            if not token:
+                raise RuntimeError("API Error 401 and no fresh IAM token")
+    except Exception as e:
+        print(f"Error streaming chat reply: {e!r}")
+        error = "System Error: Failed to generate response."
+    for event in stream.finish(error):
+        yield event
+
+
+# --- 4. THE WEB SERVER ---
+def _chat_fields(data):
+    return (
+        data.get('message'),
+        data.get('transactions', "No transactions provided."),
+        data.get('model_result', "No alerts."),
+    )
+
+
+async def chat(request):
+    print("Received chat request...")
+    user_msg, tx_data, risk_data = _chat_fields(await request.json())
+    cache_key = bridge.chat_cache.key(user_msg, tx_data, risk_data)
+    response_text = bridge.chat_cache.get(cache_key)
+    if response_text is None:
+        response_text = await get_watson_response(user_msg, tx_data, risk_data)
+        if not response_text.startswith("System Error"):
+            bridge.chat_cache.put(cache_key, response_text)
+    return JSONResponse({"reply": response_text})
+
+
+async def chat_stream(request):
+    print("Received streaming chat request...")
+    user_msg, tx_data, risk_data = _chat_fields(await request.json())
+    cache_key = bridge.chat_cache.key(user_msg, tx_data, risk_data)
+    cached = bridge.chat_cache.get(cache_key)
+
+    async def sse():
+        if cached is not None:
+            events = [
+                {"token": cached},
+                {"done": True, "reply": cached, "ttft_ms": 0.0, "total_ms": 0.0, "tokens": 0, "cached": True},
+            ]
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+            return
+        async for event in stream_chat(user_msg, tx_data, risk_data):
+            if event.get("done") and not event.get("error"):
+                bridge.chat_cache.put(cache_key, event["reply"])
+            yield f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def analyze(request):
+    print("Received analysis request...")
+    data = await request.json()
+    transaction = data.get('transaction')
+    if transaction is not None:
+        missing = [f for f in bridge.RAW_TRANSACTION_FIELDS if f not in transaction]
+        if missing:
+            return JSONResponse({"error": f"transaction is missing fields: {', '.join(missing)}"}, status_code=400)
+        try:
+            result = await analyze_raw_transaction(transaction, record=data.get('record', True))
+        except (TypeError, ValueError) as e:
+            return JSONResponse({"error": f"Invalid transaction: {e}"}, status_code=400)
+        return JSONResponse(result)
+
+    feature_vector = data.get('feature_vector')
+    if not feature_vector:
+        return JSONResponse({"error": "No feature_vector or transaction provided"}, status_code=400)
+    return JSONResponse(await analyze_transaction(feature_vector))
+
+
+async def analyze_batch_route(request):
+    print("Received batch analysis request...")
+    data = await request.json() or {}
+    feature_vectors = data.get('feature_vectors')
+    chunk_size = data.get('chunk_size', bridge.BATCH_CHUNK_SIZE)
+    error = bridge.validate_batch_request(feature_vectors, chunk_size)
+    if error:
+        return JSONResponse({"error": error}, status_code=400)
+    return JSONResponse(await analyze_batch(feature_vectors, chunk_size))
+
+
+async def history(request):
+    user_id = request.query_params.get('user_id')
+    if not user_id:
+        return JSONResponse({"error": "user_id is required"}, status_code=400)
+    return JSONResponse(await run_in_threadpool(bridge.user_history, user_id))
+
+
+async def stats(request):
+    result = bridge.collect_stats()
+    # The Flask-side batcher is idle here; report this server's own
+    result["micro_batcher"] = micro_batcher.stats() if micro_batcher is not None else None
+    result["upstreams"] = {u.name: u.stats() for u in (scoring_upstream, chat_upstream)}
+    result["http_pool"] = {"max_connections": HTTP_MAX_CONNECTIONS, "max_keepalive": HTTP_MAX_KEEPALIVE}
+    return JSONResponse(result)
+
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/analyze', analyze, methods=['POST']),
+        Route('/analyze/batch', analyze_batch_route, methods=['POST']),
+        Route('/history', history, methods=['GET']),
+        Route('/stats', stats, methods=['GET']),
+    ],
+    # Same open CORS policy as flask_cors.CORS(app)
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    print("🚀 Sentinel Bridge (async) running on port 5000")
+    print(f"   Scoring backend: {bridge.SCORING_BACKEND}")
+    print(f"   Chat backend: {bridge.CHAT_BACKEND}")
+    print(f"   Upstream pool: {HTTP_MAX_CONNECTIONS} connections, {HTTP_MAX_KEEPALIVE} keep-alive")
+    uvicorn.run(app, host="127.0.0.1", port=5000, log_level="warning")
@@ -0,0 +1,109 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import engineer_features
+from parallel_features import map_user_shards
+
+# Merchant, category, description, base monthly price
+MERCHANTS = [
+    ("StreamFlix", "Entertainment", "Streaming Plan", 15.49),
+    ("ViewMax", "Entertainment", "Monthly Sub", 12.99),
+    ("TuneBox", "Entertainment", "Music Plan", 10.99),
+    ("GymBody", "Health", "Monthly Gym", 29.99),
+    ("ZombieGym", "Health", "Monthly Gym", 24.99),
+    ("CloudSafe", "Software", "Storage Plan", 9.99),
+    ("StealthNet", "Software", "VPN Service", 11.99),
+    ("NewsDaily", "News", "Digital Edition", 7.99),
+    ("MealKit", "Food", "Weekly Box", 59.99),
+    ("Corner Cafe", "Dining", "Coffee", 4.75),
+    ("MegaMart", "Shopping", "Groceries", 82.10),
+    ("QuickRide", "Transport", "Ride", 18.40),
+]
+
+
+def synthetic_transactions(rows, users=None, seed=42):
+    """`rows` raw transactions shaped like mock_transactions.csv, about 100 per user by default."""
+    rng = np.random.default_rng(seed)
+    users = users or max(1, rows // 100)
+    user_names = np.array([f"user_{i}" for i in range(users)], dtype=object)
+    merchant = rng.integers(len(MERCHANTS), size=rows)
+    names, categories, descriptions, prices = (np.array(col, dtype=object) for col in zip(*MERCHANTS))
+    # Mostly the base price, with the occasional hike
+    amount = prices.astype(float)[merchant] * np.where(rng.random(rows) < 0.05, rng.uniform(1.1, 1.5, rows), 1.0)
+    seconds = rng.integers(0, 2 * 365 * 86400, size=rows)
+    return pd.DataFrame({
+        "transaction_id": np.char.add("tx", np.arange(rows).astype(str)).astype(object),
+        "timestamp": pd.Timestamp("2023-01-01") + pd.to_timedelta(seconds, unit="s"),
+        "user_id": user_names[rng.integers(users, size=rows)],
+        "merchant": names[merchant],
+        "amount": amount.round(2),
+        "description": descriptions[merchant],
+        "category": categories[merchant],
+    })
+
+
+def middleman_features(df):
+    # Imported here so the features benchmark does not need the governance folder
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "governance"))
+    from middleman import add_model_features
+    return add_model_features(df)
+
+
+TARGETS = {"features": engineer_features, "middleman": middleman_features}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel feature engineering from 1 to N cores")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Synthetic dataset size (default 10M)")
+    parser.add_argument("--users", type=int, default=None, help="Distinct users (default rows / 100)")
+    parser.add_argument("--workers", default=None,
+                        help="Comma-separated worker counts (default 1,2,4,... up to the core count)")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="features",
+                        help="features.engineer_features() or middleman.add_model_features()")
+    parser.add_argument("--no-check", action="store_true", help="Skip comparing parallel output with the serial run")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    if args.workers:
+        counts = [int(w) for w in args.workers.split(",")]
+    else:
+        counts = [1]
+        while counts[-1] * 2 <= cores:
+            counts.append(counts[-1] * 2)
+        if counts[-1] != cores:
+            counts.append(cores)
+    fn = TARGETS[args.target]
+
+    start = time.time()
+    df = synthetic_transactions(args.rows, args.users)
+    print(f"Generated {len(df):,} rows for {df['user_id'].nunique():,} users in {time.time() - start:.1f}s "
+          f"({df.memory_usage(deep=True).sum() / 1e9:.2f} GB). {cores} cores available.")
+
+    serial = None
+    baseline = None
+    print(f"{'workers':>8} | {'seconds':>8} | {'rows/s':>12} | {'speedup':>7}")
+    for workers in counts:
+        start = time.time()
+        result = fn(df) if workers == 1 else map_user_shards(df, fn, workers)
+        elapsed = time.time() - start
+        baseline = baseline or (elapsed if workers == 1 else None)
+        speedup = f"{baseline / elapsed:.2f}x" if baseline else "-"
+        print(f"{workers:>8} | {elapsed:>8.2f} | {len(df) / elapsed:>12,.0f} | {speedup:>7}")
+        if args.no_check:
+            continue
+        if serial is None:
+            serial = result if workers == 1 else fn(df)
+        elif workers > 1:
+            pd.testing.assert_frame_equal(serial, result)
+        del result
+    if not args.no_check:
+        print("Parallel output identical to the serial run.")
+
+
+if __name__ == "__main__":
+    main()
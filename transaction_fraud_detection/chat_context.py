@@ -0,0 +1,167 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# One line of the dashboard's formatTransactionsForAI() output:
+#   - 2025-01-09  $22.99  Netflix  [OK]
+TRANSACTION_LINE = re.compile(r"^- (\d{4})-(\d{2})-\d{2}\s+\$[\d,.]+\s+(.+?)\s+\[(OK|FLAGGED[^\]]*)\]\s*$")
+# One line of getFlaggedSummary(): "- Merchant: text"
+ALERT_LINE = re.compile(r"^- (.+?): ")
+
+MONTHS = {
+    name: i + 1
+    for i, names in enumerate([
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"),
+        ("may",), ("june", "jun"), ("july", "jul"), ("august", "aug"),
+        ("september", "sep", "sept"), ("october", "oct"), ("november", "nov"), ("december", "dec"),
+    ])
+    for name in names
+}
+ALERT_WORDS = ("flag", "alert", "predatory", "suspicious", "scam", "fraud", "risk", "warning")
+NO_ALERTS = "No alerts."
+
+
+def normalize_question(question):
+    """Case, spacing and trailing punctuation do not change the answer."""
+    return re.sub(r"\s+", " ", (question or "").lower()).strip().rstrip("?!. ")
+
+
+def context_hash(transactions, model_result):
+    return hashlib.sha256(f"{transactions}\0{model_result}".encode()).hexdigest()
+
+
+class ChatCache:
+    """
+    TTL + LRU cache of /chat replies keyed by (normalized question, context hash).
+
+    The dashboard re-asks the same questions over the same data; within
+    `ttl` seconds those are answered without another text generation call.
+    """
+
+    def __init__(self, ttl=300, max_entries=1024, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._expired = 0
+
+    def key(self, question, transactions, model_result):
+        return (normalize_question(question), context_hash(transactions, model_result))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self._expired += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, reply):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (reply, self._clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "expired": self._expired,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+def _mentions(question, merchant):
+    """Merchant named in the question, by full name or its brand (first word)."""
+    name = merchant.lower()
+    if name in question:
+        return True
+    brand = re.findall(r"[a-z0-9+]+", name)[:1]
+    return bool(brand) and len(brand[0]) >= 4 and re.search(rf"\b{re.escape(brand[0])}s?\b", question) is not None
+
+
+class ContextCompactor:
+    """
+    Shrinks the /chat context to what the question is about.
+
+    A question that names merchants keeps their full history (so price
+    comparisons still work); one about alerts keeps the flagged merchants;
+    otherwise one that names months keeps the transactions in those months.
+    Only alerts for the kept merchants are sent. Anything else, or context
+    not in the dashboard's line format, is passed through unchanged.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._compacted = 0
+        self._chars_in = 0
+        self._chars_out = 0
+
+    def compact(self, question, transactions, model_result):
+        result = self._compact(normalize_question(question), transactions, model_result)
+        with self._lock:
+            self._calls += 1
+            self._compacted += result != (transactions, model_result)
+            self._chars_in += len(transactions) + len(model_result)
+            self._chars_out += len(result[0]) + len(result[1])
+        return result
+
+    def _compact(self, question, transactions, model_result):
+        lines = transactions.splitlines()
+        parsed = [TRANSACTION_LINE.match(line) for line in lines]
+        if not lines or not all(parsed):
+            return transactions, model_result
+
+        years = set(re.findall(r"\b(20\d\d)\b", question))
+        months = {MONTHS[w] for w in re.findall(r"[a-z]+", question) if w in MONTHS}
+        # "may" is also a verb; only count it next to a year or another month
+        if months == {5} and not years and not re.search(r"\bin may\b", question):
+            months = set()
+        merchants = {m.group(3) for m in parsed if _mentions(question, m.group(3))}
+        if not merchants and any(word in question for word in ALERT_WORDS):
+            merchants = {m.group(3) for m in parsed if m.group(4) != "OK"}
+
+        if merchants:
+            keep = [m.group(3) in merchants for m in parsed]
+        elif months:
+            keep = [int(m.group(2)) in months and (not years or m.group(1) in years) for m in parsed]
+        else:
+            return transactions, model_result
+        kept = [line for line, k in zip(lines, keep) if k]
+        if not kept:
+            return transactions, model_result
+        kept_merchants = {m.group(3) for m, k in zip(parsed, keep) if k}
+
+        alerts = model_result
+        alert_lines = model_result.splitlines()
+        if model_result != NO_ALERTS and all(ALERT_LINE.match(a) for a in alert_lines):
+            alerts = "\n".join(a for a in alert_lines if ALERT_LINE.match(a).group(1) in kept_merchants) or NO_ALERTS
+        return "\n".join(kept), alerts
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self._calls,
+                "compacted": self._compacted,
+                "chars_in": self._chars_in,
+                "chars_out": self._chars_out,
+                "saved_pct": round(100 * (1 - self._chars_out / self._chars_in), 1) if self._chars_in else 0.0,
+            }
@@ -0,0 +1,262 @@
+import json
+import threading
+import time
+
+DEFAULT_LOCAL_CHAT_MODEL = "ibm-granite/granite-3.1-3b-a800m-instruct"
+
+
+class StopSequenceFilter:
+    """
+    Cuts a token stream at the first stop sequence.
+
+    Text that could be the start of a stop sequence is held back until the
+    next piece shows whether it is one, so nothing past the stop is emitted.
+    """
+
+    def __init__(self, stop_sequences):
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.stopped = False
+        self._held = ""
+
+    def feed(self, text):
+        if self.stopped:
+            return ""
+        buffer = self._held + text
+        cut = min((i for i in (buffer.find(s) for s in self.stop_sequences) if i != -1), default=-1)
+        if cut != -1:
+            self.stopped = True
+            self._held = ""
+            return buffer[:cut]
+        # Longest tail of the buffer that is a prefix of some stop sequence
+        hold = 0
+        for stop in self.stop_sequences:
+            for n in range(min(len(stop) - 1, len(buffer)), hold, -1):
+                if buffer.endswith(stop[:n]):
+                    hold = n
+                    break
+        self._held = buffer[len(buffer) - hold:] if hold else ""
+        return buffer[:len(buffer) - hold]
+
+    def flush(self):
+        held, self._held = self._held, ""
+        return "" if self.stopped else held
+
+
+class StreamStats:
+    """Time-to-first-token and token counts across streamed chat replies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._ttft_ms = []
+        self._total_ms = 0.0
+        self._tokens = 0
+
+    def record(self, ttft_ms, total_ms, tokens):
+        with self._lock:
+            self._requests += 1
+            if ttft_ms is not None:
+                self._ttft_ms.append(ttft_ms)
+                del self._ttft_ms[:-1000]
+            self._total_ms += total_ms
+            self._tokens += tokens
+
+    def stats(self):
+        with self._lock:
+            ttft = sorted(self._ttft_ms)
+            return {
+                "requests": self._requests,
+                "ttft_ms_p50": round(ttft[len(ttft) // 2], 1) if ttft else None,
+                "ttft_ms_p95": round(ttft[int(len(ttft) * 0.95)], 1) if ttft else None,
+                "avg_total_ms": round(self._total_ms / self._requests, 1) if self._requests else None,
+                "tokens": self._tokens,
+                "tokens_per_s": round(self._tokens / (self._total_ms / 1000), 1) if self._total_ms else 0.0,
+            }
+
+
+class ReplyStream:
+    """
+    Turns generated (text, token_count) pieces into chat events:
+    {"token": text} as text arrives, then one {"done": True, ...} summary
+    with the full reply, time to first token and total tokens. Shared by
+    the threaded (Flask) and async servers.
+    """
+
+    def __init__(self, stop_sequences, stats=None):
+        self.start = time.time()
+        self.stats = stats
+        self.ttft_ms = None
+        self.tokens = 0
+        self.reply = []
+        self._stop = StopSequenceFilter(stop_sequences)
+
+    @property
+    def stopped(self):
+        return self._stop.stopped
+
+    def feed(self, text, count):
+        self.tokens = count if count is not None else self.tokens + 1
+        out = self._stop.feed(text)
+        if not self.reply:
+            # Like the non-streaming reply, which is .strip()ped
+            out = out.lstrip()
+        if not out:
+            return []
+        if self.ttft_ms is None:
+            self.ttft_ms = (time.time() - self.start) * 1000
+        self.reply.append(out)
+        return [{"token": out}]
+
+    def finish(self, error=None):
+        events = []
+        tail = self._stop.flush().rstrip()
+        if tail and not error:
+            self.reply.append(tail)
+            events.append({"token": tail})
+
+        total_ms = (time.time() - self.start) * 1000
+        if self.stats is not None:
+            self.stats.record(self.ttft_ms, total_ms, self.tokens)
+        print(f"Chat stream: {self.tokens} tokens, first token {self.ttft_ms or 0:.0f}ms, total {total_ms:.0f}ms")
+        done = {
+            "done": True,
+            "reply": "".join(self.reply).rstrip(),
+            "ttft_ms": round(self.ttft_ms, 1) if self.ttft_ms is not None else None,
+            "total_ms": round(total_ms, 1),
+            "tokens": self.tokens,
+        }
+        if error:
+            done["error"] = error
+        events.append(done)
+        return events
+
+
+def stream_reply(pieces, stop_sequences, stats=None):
+    """Chat events (see ReplyStream) for a generator of (text, token_count) pieces."""
+    stream = ReplyStream(stop_sequences, stats)
+    error = None
+    try:
+        for text, count in pieces:
+            yield from stream.feed(text, count)
+            if stream.stopped:
+                break
+    except Exception as e:
+        print(f"Error streaming chat reply: {e}")
+        error = "System Error: Failed to generate response."
+    finally:
+        if hasattr(pieces, "close"):
+            pieces.close()
+    yield from stream.finish(error)
+
+
+def sse_pieces(payloads):
+    """(text, generated_token_count) from the data payloads of a watsonx generation_stream."""
+    for payload in payloads:
+        if not payload or payload == "[DONE]":
+            continue
+        result = json.loads(payload).get("results", [{}])[0]
+        yield result.get("generated_text", ""), result.get("generated_token_count")
+
+
+def sse_data(line):
+    """Payload of an SSE `data:` line, or None for any other line."""
+    if line and line.startswith("data:"):
+        return line[len("data:"):].strip()
+    return None
+
+
+class UnauthorizedError(RuntimeError):
+    """The upstream answered 401: the bearer token was revoked or its API key rotated."""
+
+
+def watsonx_pieces(session, url, headers, body, timeout):
+    """
+    (text, generated_token_count) from the watsonx text/generation_stream SSE endpoint.
+    Closing the generator closes the connection, which stops generation upstream.
+    A 401 raises UnauthorizedError before anything is yielded.
+    """
+    response = session.post(url, headers=dict(headers, Accept="text/event-stream"),
+                            json=body, stream=True, timeout=timeout)
+    try:
+        if response.status_code == 401:
+            raise UnauthorizedError(f"API Error 401: {response.text}")
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error {response.status_code}: {response.text}")
+        lines = response.iter_lines(decode_unicode=True)
+        yield from sse_pieces(sse_data(line) for line in lines)
+    finally:
+        response.close()
+
+
+class LocalChatModel:
+    """
+    Offline chat generation with a local Granite instruct model, streamed
+    token by token. Loaded on first use; one generation runs at a time.
+    """
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path or DEFAULT_LOCAL_CHAT_MODEL
+        self._model = None
+        self._tokenizer = None
+        self._load_lock = threading.Lock()
+        self._generate_lock = threading.Lock()
+
+    def _load(self):
+        with self._load_lock:
+            if self._model is None:
+                from transformers import AutoModelForCausalLM, AutoTokenizer
+                start = time.time()
+                print(f"Loading local chat model: {self.model_path}")
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_path)
+                self._model = AutoModelForCausalLM.from_pretrained(
+                    self.model_path, device_map="cpu", dtype="auto"
+                )
+                self._model.eval()
+                print(f"Local chat model ready in {time.time() - start:.1f}s")
+
+    def pieces(self, prompt, max_new_tokens):
+        """(text, token_count) as the model generates; closing the generator stops generation."""
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        self._load()
+        tokenizer = self._tokenizer
+        cancelled = threading.Event()
+        counted = [0]
+
+        class CountingStreamer(TextIteratorStreamer):
+            def put(self, value):
+                if not self.next_tokens_are_prompt:
+                    counted[0] += value.numel()
+                super().put(value)
+
+        class Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return cancelled.is_set()
+
+        streamer = CountingStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = tokenizer(prompt, return_tensors="pt")
+
+        def generate():
+            with self._generate_lock, torch.no_grad():
+                try:
+                    self._model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        do_sample=False,
+                        pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([Cancelled()]),
+                    )
+                except Exception as e:
+                    print(f"Error in local chat generation: {e}")
+                    streamer.end()
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                yield text, counted[0]
+        finally:
+            # Stop sequence hit or client gone: let generate() finish at the next step
+            cancelled.set()
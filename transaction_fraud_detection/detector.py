@@ -1,55 +1,212 @@
 import os
-import json
+import copy
+import ctypes
+import gc
+import time
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
 from peft import PeftModel
+from prompts import build_prompt, prompt_prefix, json_closed, parse_response
+from verdict_cache import fingerprint
+
+DEFAULT_BASE_MODEL_ID = "ibm-granite/granite-3.1-3b-a800m-instruct"
+DEFAULT_ADAPTER_PATH = "predatory-patterns-lora"
+MAX_NEW_TOKENS = 200
+# What each quantize mode covers, in the verdict cache key (int8 once left the MoE experts in float)
+QUANTIZE_IDENTITY = {"int8": "int8:linear+experts"}
+
+
+def model_identity(base_model_id=None, adapter_path=None, merged_path=None, quantize=None):
+    """Everything that decides what the detector answers, for keying the verdict cache."""
+    if merged_path:
+        weights = f"merged:{fingerprint(merged_path)}"
+    else:
+        adapter = fingerprint(adapter_path or DEFAULT_ADAPTER_PATH) or "none"
+        weights = f"{base_model_id or DEFAULT_BASE_MODEL_ID}+adapter:{adapter}"
+    return f"{weights}|{QUANTIZE_IDENTITY.get(quantize, quantize) or 'full'}|greedy:{MAX_NEW_TOKENS}"
+
+
+def resident_memory_mb():
+    """Current resident set size of this process in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class LinearExperts(torch.nn.Module):
+    """
+    A MoE experts block (GraniteMoeExperts: 3D gate_up_proj / down_proj
+    parameters) as one float32 nn.Linear per expert, so quantize_dynamic()
+    can turn the experts into int8 like any other Linear. Same forward.
+    """
+
+    def __init__(self, experts):
+        super().__init__()
+        self.num_experts = experts.num_experts
+        self.act_fn = experts.act_fn
+        self.gate_up = torch.nn.ModuleList()
+        self.down = torch.nn.ModuleList()
+        for gate_up, down in zip(experts.gate_up_proj.data, experts.down_proj.data):
+            self.gate_up.append(self._linear(gate_up))
+            self.down.append(self._linear(down))
+
+    @staticmethod
+    def _linear(weight):
+        linear = torch.nn.Linear(weight.shape[1], weight.shape[0], bias=False)
+        linear.weight = torch.nn.Parameter(weight.float(), requires_grad=False)
+        return linear
+
+    def forward(self, hidden_states, top_k_index, top_k_weights):
+        final_hidden_states = torch.zeros_like(hidden_states)
+        for expert_idx in top_k_index.unique().tolist():
+            if expert_idx >= self.num_experts:
+                continue
+            token_idx, top_k_pos = torch.where(top_k_index == expert_idx)
+            gate, up = self.gate_up[expert_idx](hidden_states[token_idx]).chunk(2, dim=-1)
+            current = self.down[expert_idx](self.act_fn(gate) * up)
+            current = current * top_k_weights[token_idx, top_k_pos, None]
+            final_hidden_states.index_add_(0, token_idx, current.to(final_hidden_states.dtype))
+        return final_hidden_states
+
+
+def _is_experts_block(module):
+    return (isinstance(getattr(module, "gate_up_proj", None), torch.nn.Parameter)
+            and getattr(module, "gate_up_proj").dim() == 3 and hasattr(module, "down_proj"))
+
+
+def release_freed_memory():
+    """Return freed heap pages to the OS (glibc), e.g. the float32 copies quantization drops."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def quantize_int8(model):
+    """
+    Dynamic int8 quantization (weights int8, activations quantized on the fly)
+    of every Linear layer and of the MoE experts, which hold most of Granite
+    MoE's weights as 3D parameters that quantize_dynamic() does not see on
+    its own. The int8 weights are private to the process: they replace the
+    memory-mapped float weights rather than share them.
+    """
+    # In place and one experts block at a time, so only one layer's experts
+    # are ever held as float32 on top of the loaded weights
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if _is_experts_block(child):
+                experts = LinearExperts(child)
+                torch.ao.quantization.quantize_dynamic(experts, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+                setattr(parent, name, experts)
+    # Dynamic int8 kernels take float32 activations, so a bf16 (merged) model's
+    # remaining layers - embeddings, norms, attention, router - go to float32
+    model.float()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class JsonClosedCriteria(StoppingCriteria):
+    """Per-row stop: a row is finished as soon as its answer JSON closes."""
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return torch.tensor([json_closed(t) for t in texts], dtype=torch.bool, device=input_ids.device)
+
+
+def _common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
 
 class PatternDetector:
-    def __init__(self, base_model_id=None, adapter_path=None):
-        self.base_model_id = base_model_id or "ibm-granite/granite-3.1-3b-a800m-instruct"
-        self.adapter_path = adapter_path or "predatory-patterns-lora"
-        
-        print(f"Loading base model: {self.base_model_id}")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.base_model_id)
+    def __init__(self, base_model_id=None, adapter_path=None, merged_path=None, quantize=None):
+        """
+        merged_path: load a checkpoint written by export_merged_model.py (adapter
+            already folded into the weights) instead of base model + PeftModel.
+            Its safetensors are memory-mapped, so worker processes share pages
+            (unless quantized).
+        quantize: "int8" applies dynamic int8 quantization (Linear layers and MoE
+            experts, see quantize_int8()) after loading; the quantized weights
+            are per-process copies, not shared pages.
+        """
+        self.base_model_id = base_model_id or DEFAULT_BASE_MODEL_ID
+        self.adapter_path = adapter_path or DEFAULT_ADAPTER_PATH
+        self.merged_path = merged_path
+        self.quantize = quantize
         
+        start = time.time()
         device = "cpu"
-        print(f"Using device: {device}")
-        
-        self.base_model = AutoModelForCausalLM.from_pretrained(
-            self.base_model_id,
-            device_map=device,
-            torch_dtype=torch.float32
-        )
-        
-        if os.path.exists(self.adapter_path):
-            print(f"Loading adapter from {self.adapter_path}")
-            self.model = PeftModel.from_pretrained(self.base_model, self.adapter_path)
-        else:
-            print(f"Warning: Adapter {self.adapter_path} not found. Using base model only.")
+
+        if merged_path:
+            print(f"Loading merged model: {merged_path}")
+            self.tokenizer = AutoTokenizer.from_pretrained(merged_path)
+            print(f"Using device: {device}")
+            self.base_model = AutoModelForCausalLM.from_pretrained(
+                merged_path,
+                device_map=device,
+                dtype="auto"
+            )
             self.model = self.base_model
+        else:
+            print(f"Loading base model: {self.base_model_id}")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.base_model_id)
+            
+            print(f"Using device: {device}")
+            
+            self.base_model = AutoModelForCausalLM.from_pretrained(
+                self.base_model_id,
+                device_map=device,
+                dtype=torch.float32
+            )
+            
+            if os.path.exists(self.adapter_path):
+                print(f"Loading adapter from {self.adapter_path}")
+                self.model = PeftModel.from_pretrained(self.base_model, self.adapter_path)
+            else:
+                print(f"Warning: Adapter {self.adapter_path} not found. Using base model only.")
+                self.model = self.base_model
+
+        if quantize == "int8":
+            print("Applying dynamic int8 quantization...")
+            self.model = quantize_int8(self.model)
+            release_freed_memory()
+        elif quantize:
+            raise ValueError(f"Unsupported quantize mode: {quantize}")
+        self.model.eval()
+
+        self.load_stats = {
+            "load_seconds": round(time.time() - start, 2),
+            "rss_mb": round(resident_memory_mb(), 1)
+        }
+        print(f"Model ready in {self.load_stats['load_seconds']}s, resident memory {self.load_stats['rss_mb']} MB")
+
+        # Batched generation pads on the left so every row ends where generation starts
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.tokenizer.padding_side = "left"
+        self._prefix = None
 
     def _build_prompt(self, transactions_context):
-        # Format as input sample for the model
-        clean_txns = []
-        for t in transactions_context:
-            clean_txns.append({
-                "date": str(t.get("timestamp"))[:10],
-                "amt": t.get("amount"),
-                "desc": t.get("description")
-            })
-            
-        system_prompt = "You are a financial pattern detection AI."
-        instruction = "Analyze the transaction history for predatory patterns. Return JSON: {is_predatory, pattern_type, reason}."
-        
-        return f"""<|system|>
-{system_prompt}
-<|user|>
-{instruction}
+        return build_prompt(transactions_context)
 
-CONTEXT:
-{json.dumps(clean_txns)}
-<|assistant|>
-"""
+    def _prompt_prefix(self):
+        return prompt_prefix()
 
     def analyze_sequence(self, transactions):
         prompt = self._build_prompt(transactions)
@@ -68,26 +225,95 @@ CONTEXT:
         # Extract the assistant's response
         # The output contains the full prompt + generation. 
         # We need to parse after <|assistant|> or just get the last part.
-        try:
-            # Heuristic: split by assistant banner if present in decoded text (it might disappear in skip_special_tokens)
-            # Granite Instruct usually keeps structure if trained well.
-            # Let's try to find the standard JSON structure.
-            response_part = output_text.split("CONTEXT:")[-1] # fallback
-            if "<|assistant|>" in output_text:
-                response_part = output_text.split("<|assistant|>")[-1]
-            
-            # Find first { and last }
-            start = response_part.find("{")
-            end = response_part.rfind("}") + 1
-            if start != -1 and end != -1:
-                json_str = response_part[start:end]
-                return json.loads(json_str)
-            else:
-                return {"is_predatory": False, "pattern_type": "ParseError", "reason": "No JSON found"}
-                
-        except Exception as e:
-            return {
-                "is_predatory": False, 
-                "pattern_type": "Error", 
-                "reason": str(e)
-            }
+        # Heuristic: split by assistant banner if present in decoded text (it might disappear in skip_special_tokens)
+        # Granite Instruct usually keeps structure if trained well.
+        # Let's try to find the standard JSON structure.
+        response_part = output_text.split("CONTEXT:")[-1] # fallback
+        if "<|assistant|>" in output_text:
+            response_part = output_text.split("<|assistant|>")[-1]
+        return parse_response(response_part)
+
+    def analyze_batch(self, sequences, batch_size=8):
+        """
+        analyze_sequence() for many transaction histories at once.
+
+        Prompts are sorted by length and generated batch_size at a time, so
+        rows in a batch need little padding. The shared system/instruction
+        prefix is encoded once and its KV cache reused for every batch, and
+        each row stops as soon as its JSON answer closes. Results come back
+        in input order.
+        """
+        prompts = [self._build_prompt(seq) for seq in sequences]
+        encoded = [self.tokenizer(p)["input_ids"] for p in prompts]
+        order = sorted(range(len(prompts)), key=lambda i: len(encoded[i]))
+
+        results = [None] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            for i, result in zip(idx, self._generate_batch([encoded[i] for i in idx])):
+                results[i] = result
+        return results
+
+    def _prefix_state(self):
+        """Token ids and KV cache for the shared prompt prefix (computed once)."""
+        if self._prefix is None:
+            prefix_ids = self.tokenizer(self._prompt_prefix())["input_ids"]
+            cache = None
+            try:
+                from transformers import DynamicCache
+                with torch.no_grad():
+                    out = self.model(
+                        input_ids=torch.tensor([prefix_ids], device=self.model.device),
+                        past_key_values=DynamicCache(),
+                        use_cache=True
+                    )
+                cache = out.past_key_values
+                if not (hasattr(cache, "crop") and hasattr(cache, "batch_repeat_interleave")):
+                    cache = None
+            except Exception as e:
+                print(f"Warning: prefix caching unavailable ({e}); encoding full prompts.")
+            self._prefix = (prefix_ids, cache)
+        return self._prefix
+
+    def _generate_batch(self, batch_ids):
+        pad_id = self.tokenizer.pad_token_id
+        prefix_ids, prefix_cache = self._prefix_state()
+        # Tokens shared by every row: normally the whole prefix, unless the
+        # tokenizer merged its last token with the start of the context.
+        shared = min(_common_prefix_length(ids, prefix_ids) for ids in batch_ids)
+
+        generate_kwargs = {}
+        if prefix_cache is not None and shared > 0:
+            # [shared prefix][left padding][row suffix]: the cached prefix keeps
+            # positions 0..shared-1 and the attention mask hides the padding.
+            suffixes = [ids[shared:] for ids in batch_ids]
+            width = max(len(s) for s in suffixes)
+            rows = [prefix_ids[:shared] + [pad_id] * (width - len(s)) + s for s in suffixes]
+            mask = [[1] * shared + [0] * (width - len(s)) + [1] * len(s) for s in suffixes]
+            cache = copy.deepcopy(prefix_cache)
+            if shared < len(prefix_ids):
+                cache.crop(shared - len(prefix_ids))
+            cache.batch_repeat_interleave(len(batch_ids))
+            generate_kwargs["past_key_values"] = cache
+        else:
+            width = max(len(ids) for ids in batch_ids)
+            rows = [[pad_id] * (width - len(ids)) + ids for ids in batch_ids]
+            mask = [[0] * (width - len(ids)) + [1] * len(ids) for ids in batch_ids]
+
+        input_ids = torch.tensor(rows, device=self.model.device)
+        attention_mask = torch.tensor(mask, device=self.model.device)
+        prompt_length = input_ids.shape[1]
+
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=MAX_NEW_TOKENS,
+                do_sample=False,
+                pad_token_id=pad_id,
+                stopping_criteria=StoppingCriteriaList([JsonClosedCriteria(self.tokenizer, prompt_length)]),
+                **generate_kwargs
+            )
+
+        texts = self.tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+        return [parse_response(text) for text in texts]
@@ -0,0 +1,45 @@
+import argparse
+import pandas as pd
+import joblib
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import OneHotEncoder
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from features import FEATURES, CATEGORICAL_FEATURES, NUMERIC_FEATURES, engineer_features
+
+
+def build_pipeline():
+    # Same pipeline as the "Train Random Forest" step in SentinelPlaybook.ipynb,
+    # which is what gets deployed to watsonx.
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('cat', OneHotEncoder(handle_unknown='ignore'), CATEGORICAL_FEATURES),
+            ('num', 'passthrough', NUMERIC_FEATURES)
+        ])
+
+    return Pipeline(steps=[
+        ('preprocessor', preprocessor),
+        ('classifier', RandomForestClassifier(n_estimators=100, max_depth=8, min_samples_leaf=5, random_state=42))
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the Veteran Random Forest and save it for local scoring")
+    parser.add_argument("input_file", nargs="?", default="mock_transactions.csv", help="Raw transactions CSV to train on")
+    parser.add_argument("--output", default="veteran_rf.joblib", help="Where to write the serialized pipeline")
+    args = parser.parse_args()
+
+    print(f"Loading data from {args.input_file}...")
+    df_train = engineer_features(pd.read_csv(args.input_file))
+    df_train['target'] = df_train['pattern_label'] != 'normal'
+
+    print("Training Random Forest...")
+    model = build_pipeline()
+    model.fit(df_train[FEATURES], df_train['target'])
+
+    joblib.dump(model, args.output)
+    print(f"SUCCESS! Pipeline saved to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
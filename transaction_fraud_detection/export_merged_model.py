@@ -0,0 +1,47 @@
+import argparse
+import json
+import os
+import time
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+from peft import PeftModel
+from detector import resident_memory_mb
+
+DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold the LoRA adapter into the base weights for fast CPU loading")
+    parser.add_argument("--base-model", default="ibm-granite/granite-3.1-3b-a800m-instruct", help="Base model id or path")
+    parser.add_argument("--adapter", default="predatory-patterns-lora", help="LoRA adapter directory")
+    parser.add_argument("--output", default="predatory-patterns-merged", help="Where to write the merged checkpoint")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="bfloat16",
+                        help="Weight dtype to save (bfloat16 halves size and RAM)")
+    args = parser.parse_args()
+
+    start = time.time()
+    print(f"Loading base model: {args.base_model}")
+    tokenizer = AutoTokenizer.from_pretrained(args.base_model)
+    model = AutoModelForCausalLM.from_pretrained(args.base_model, device_map="cpu", dtype=torch.float32)
+
+    print(f"Merging adapter from {args.adapter}")
+    model = PeftModel.from_pretrained(model, args.adapter).merge_and_unload()
+    model = model.to(DTYPES[args.dtype])
+
+    # safetensors so PatternDetector(merged_path=...) can memory-map the weights
+    model.save_pretrained(args.output, safe_serialization=True)
+    tokenizer.save_pretrained(args.output)
+    with open(os.path.join(args.output, "sentinel_export.json"), "w") as f:
+        json.dump({
+            "base_model": args.base_model,
+            "adapter": os.path.abspath(args.adapter),
+            "dtype": args.dtype
+        }, f, indent=2)
+
+    print(f"Saved merged {args.dtype} model to {args.output} in {time.time() - start:.1f}s "
+          f"(resident memory {resident_memory_mb():.0f} MB).")
+    print(f"Load it with PatternDetector(merged_path='{args.output}'), optionally quantize='int8'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import argparse
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from features import FEATURES, FIRST_TXN_DAYS, QUICK_CHARGE_DAYS, infer_freq
+
+EPOCH = datetime(1970, 1, 1)
+MICROS_PER_DAY = 86_400_000_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS merchant_state (
+    user_id TEXT NOT NULL,
+    merchant TEXT NOT NULL,
+    first_ts INTEGER NOT NULL,
+    first_amount REAL NOT NULL,
+    last_ts INTEGER NOT NULL,
+    last_amount REAL NOT NULL,
+    txn_count INTEGER NOT NULL,
+    PRIMARY KEY (user_id, merchant)
+) WITHOUT ROWID
+"""
+
+
+def to_micros(ts):
+    """Naive-UTC microseconds since epoch for a datetime, pandas Timestamp or ISO string."""
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(micros):
+    """Inverse of to_micros(): naive-UTC datetime."""
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class MerchantState:
+    __slots__ = ("first_ts", "first_amount", "last_ts", "last_amount", "txn_count")
+
+    def __init__(self, first_ts, first_amount, last_ts, last_amount, txn_count):
+        self.first_ts = first_ts
+        self.first_amount = first_amount
+        self.last_ts = last_ts
+        self.last_amount = last_amount
+        self.txn_count = txn_count
+
+
+def compute_features(amount, ts, state):
+    """
+    Engineered features for one transaction given the (user, merchant) state
+    before it. Same semantics as features.engineer_features(), in O(1), for
+    transactions in timestamp order; one older than the state's last charge
+    can never look like a quick or same-amount repeat.
+    """
+    amount = float(amount)
+    if state is None:
+        days_diff = float(FIRST_TXN_DAYS)
+        relationship_days = 0
+        prev_amount = None
+        first_amount = amount
+        price_change_pct = 0.0
+        same_amount = False
+    else:
+        # Floor division matches pandas' Timedelta.days
+        days_diff = float((ts - state.last_ts) // MICROS_PER_DAY)
+        relationship_days = (ts - state.first_ts) // MICROS_PER_DAY
+        prev_amount = state.last_amount
+        first_amount = state.first_amount
+        price_change_pct = (amount - prev_amount) / prev_amount if prev_amount else 0.0
+        same_amount = abs(amount - prev_amount) < 0.01
+
+    # A late (or replayed) charge is older than the state it is compared with:
+    # its gap and price change relative to a newer charge mean nothing, so it
+    # is clamped to a zero gap and kept out of the gap/repeat rules
+    late = state is not None and ts < state.last_ts
+    if late:
+        days_diff = max(0.0, days_diff)
+        relationship_days = max(0, relationship_days)
+        price_change_pct = 0.0
+        same_amount = False
+
+    total_change_pct = (amount - first_amount) / first_amount if first_amount > 0 else 0.0
+    return {
+        "amount": amount,
+        "price_change_pct": price_change_pct,
+        "total_change_pct": total_change_pct,
+        "days_diff": days_diff,
+        "is_quick_charge": days_diff <= QUICK_CHARGE_DAYS and not late,
+        "frequency": infer_freq(days_diff),
+        "prev_amount": prev_amount,
+        "first_amount": first_amount,
+        "same_amount": same_amount,
+        "relationship_days": relationship_days,
+    }
+
+
+def to_feature_vector(features, category):
+    """The 7-field model vector (FEATURES order) from compute_features() output."""
+    row = dict(features, category=category)
+    return [row[name] for name in FEATURES]
+
+
+def _advance(state, amount, ts):
+    if state is None:
+        return MerchantState(ts, amount, ts, amount, 1)
+    # Late arrivals are scored against the latest state but do not rewind it
+    if ts >= state.last_ts:
+        state.last_ts = ts
+        state.last_amount = amount
+    state.txn_count += 1
+    return state
+
+
+class FeatureStateStore:
+    """
+    Per-(user_id, merchant) running state persisted in SQLite.
+
+    Keeps first/last timestamp and amount for each pair, which is all the
+    feature engineering needs, so scoring a new transaction is one primary-key
+    lookup instead of re-sorting and re-grouping the whole history.
+    Transactions should be observed in timestamp order per pair.
+    """
+
+    def __init__(self, path="feature_state.db"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_state(self, user_id, merchant):
+        with self._lock:
+            return self._load(user_id, merchant)
+
+    def last_timestamp(self, user_id):
+        """Naive-UTC datetime of the user's latest recorded charge (any merchant), or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(last_ts) FROM merchant_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return from_micros(row[0]) if row[0] is not None else None
+
+    def features_for(self, txn):
+        """Features for a transaction without recording it."""
+        ts = to_micros(txn["timestamp"])
+        return compute_features(txn["amount"], ts, self.get_state(txn["user_id"], txn["merchant"]))
+
+    def observe(self, txn):
+        """Compute features for a transaction and record it as the pair's latest charge."""
+        return self.observe_many([txn])[0]
+
+    def observe_many(self, txns):
+        """observe() for many transactions (in timestamp order) in one SQLite transaction."""
+        results = []
+        touched = {}
+        with self._lock:
+            for txn in txns:
+                key = (txn["user_id"], txn["merchant"])
+                state = touched[key] if key in touched else self._load(*key)
+                ts = to_micros(txn["timestamp"])
+                amount = float(txn["amount"])
+                results.append(compute_features(amount, ts, state))
+                touched[key] = _advance(state, amount, ts)
+            self._save(touched)
+        return results
+
+    def stats(self):
+        with self._lock:
+            pairs = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(txn_count), 0) FROM merchant_state").fetchone()
+        return {"pairs": pairs[0], "transactions": pairs[1]}
+
+    def _load(self, user_id, merchant):
+        row = self._conn.execute(
+            "SELECT first_ts, first_amount, last_ts, last_amount, txn_count FROM merchant_state "
+            "WHERE user_id = ? AND merchant = ?",
+            (user_id, merchant),
+        ).fetchone()
+        return MerchantState(*row) if row else None
+
+    def _save(self, states):
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO merchant_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (user, merchant, s.first_ts, s.first_amount, s.last_ts, s.last_amount, s.txn_count)
+                    for (user, merchant), s in states.items()
+                ],
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Replay transactions through the feature state store")
+    parser.add_argument("input_file", help="Raw transactions CSV (transaction_id, timestamp, user_id, merchant, amount, category, ...)")
+    parser.add_argument("--db", default="feature_state.db", help="SQLite state file (created if missing)")
+    parser.add_argument("--output", help="Optional CSV of per-transaction features")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="Rows per read/commit")
+    args = parser.parse_args()
+
+    store = FeatureStateStore(args.db)
+    print(f"Replaying {args.input_file} into {args.db}...")
+    start = time.time()
+    total = 0
+    header = True
+
+    # The store needs time order; the generators already write files sorted by timestamp
+    df = pd.read_csv(args.input_file, parse_dates=["timestamp"]).sort_values("timestamp", kind="stable")
+    for begin in range(0, len(df), args.chunksize):
+        chunk = df.iloc[begin:begin + args.chunksize]
+        records = chunk[["user_id", "merchant", "amount", "timestamp"]].to_dict("records")
+        features = store.observe_many(records)
+        total += len(chunk)
+        if args.output:
+            out = pd.DataFrame(features, index=chunk.index)
+            out.insert(0, "transaction_id", chunk["transaction_id"])
+            out["category"] = chunk["category"]
+            out.to_csv(args.output, mode="w" if header else "a", header=header, index=False)
+            header = False
+
+    elapsed = time.time() - start
+    print(f"Processed {total} transactions in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f}/s).")
+    print(f"State: {store.stats()}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
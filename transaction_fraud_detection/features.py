@@ -0,0 +1,153 @@
+import bisect
+
+import pandas as pd
+import numpy as np
+
+# Feature vector the Random Forest (and the watsonx deployment) is trained on.
+# Format: [Amount, Price_Change_Pct, Total_Change, Days_Diff, Quick_Charge, Freq, Cat]
+FEATURES = ['amount', 'price_change_pct', 'total_change_pct', 'days_diff', 'is_quick_charge', 'frequency', 'category']
+CATEGORICAL_FEATURES = ['frequency', 'category']
+NUMERIC_FEATURES = ['amount', 'price_change_pct', 'total_change_pct', 'days_diff']
+
+# days_diff placeholder for the first transaction of a (user, merchant) pair
+FIRST_TXN_DAYS = 999
+QUICK_CHARGE_DAYS = 5
+
+# Billing frequency by days since the previous charge: (label, min days, max days),
+# both ends inclusive, first match wins. Anything else is Irregular.
+FREQUENCY_BUCKETS = [("Monthly", 25, 35), ("Weekly", 6, 8)]
+FIRST_TXN = "First_Txn"
+IRREGULAR = "Irregular"
+
+# A (user, merchant) pair is recurring when it has at least this many gaps,
+# its median gap falls in a FREQUENCY_BUCKETS bucket, and the gaps' stddev is
+# within RECURRING_MAX_CV of that median.
+RECURRING_MIN_GAPS = 2
+RECURRING_MAX_CV = 0.25
+
+
+def infer_freq(d, buckets=FREQUENCY_BUCKETS):
+    """Single-value frequency_buckets(), for the per-transaction scoring path."""
+    if d == FIRST_TXN_DAYS: return FIRST_TXN
+    for label, low, high in buckets:
+        if low <= d <= high: return label
+    return IRREGULAR
+
+
+def frequency_buckets(days, first_txn=None, buckets=FREQUENCY_BUCKETS):
+    """
+    Frequency label per row of the `days` Series, binned in one pass instead of
+    calling infer_freq() per row. `first_txn` marks rows with no previous
+    charge (default: where days is NaN).
+    """
+    values = days.to_numpy(dtype=float, na_value=np.nan)
+    if first_txn is None:
+        first_txn = np.isnan(values)
+    conditions = [np.asarray(first_txn, dtype=bool)]
+    conditions += [(values >= low) & (values <= high) for _, low, high in buckets]
+    # Select integer codes and take the labels, much cheaper than selecting strings
+    labels = np.array([FIRST_TXN] + [label for label, _, _ in buckets] + [IRREGULAR], dtype=object)
+    codes = np.select(conditions, np.arange(len(conditions)), len(conditions))
+    return pd.Series(labels[codes], index=days.index)
+
+
+def _expanding_median(values, groups):
+    """Median of each row's group's non-NaN values up to and including that row (NaN before any)."""
+    order = np.argsort(groups, kind='stable')
+    ordered = values[order].tolist()
+    sorted_groups = groups[order]
+    bounds = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]).tolist() + [len(ordered)]
+    medians = [np.nan] * len(ordered)
+    insort = bisect.insort
+    # One sorted window per group, grown a value at a time: far cheaper than
+    # groupby().expanding().median()
+    for start, stop in zip(bounds, bounds[1:]):
+        window = []
+        for i in range(start, stop):
+            if ordered[i] == ordered[i]:
+                insort(window, ordered[i])
+            n = len(window)
+            if n:
+                half = n // 2
+                medians[i] = window[half] if n % 2 else (window[half - 1] + window[half]) / 2
+    result = np.empty(len(ordered))
+    result[order] = medians
+    return result
+
+
+def add_cadence_features(df, gaps, buckets=FREQUENCY_BUCKETS):
+    """
+    Per-(user, merchant) cadence columns from `gaps`, the days since the
+    previous charge (NaN on the first one): median and stddev of the gaps,
+    the median's frequency bucket (First_Txn before any gap), and whether the
+    merchant bills on a consistent recurring schedule.
+
+    Point in time: each row only sees the gaps up to and including its own,
+    never later charges, so the columns are safe as per-transaction features.
+    Rows must be in time order within each (user, merchant), as
+    engineer_features() leaves them.
+    """
+    groups = df.groupby(['user_id', 'merchant'], sort=False).ngroup().to_numpy()
+    values = gaps.to_numpy(dtype=float, na_value=np.nan)
+    seen = ~np.isnan(values)
+    filled = np.where(seen, values, 0.0)
+
+    # Running count / sum / sum of squares give the sample stddev without a window
+    running = pd.DataFrame({'n': seen.astype(float), 'sum': filled, 'sq': filled * filled}).groupby(groups).cumsum()
+    n = running['n'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (running['sq'].to_numpy() - running['sum'].to_numpy() ** 2 / n) / (n - 1)
+    std = np.where(n >= 2, np.sqrt(np.clip(var, 0, None)), np.nan)
+
+    median = pd.Series(_expanding_median(values, groups), index=df.index)
+    df['cadence_median_days'] = median
+    df['cadence_std_days'] = std
+    df['cadence'] = frequency_buckets(median, buckets=buckets)
+    df['is_recurring'] = (
+        (n >= RECURRING_MIN_GAPS)
+        & df['cadence'].isin([label for label, _, _ in buckets]).to_numpy()
+        & (std <= RECURRING_MAX_CV * median.to_numpy())
+    )
+    return df
+
+
+def engineer_features(raw_df):
+    """
+    Same feature engineering as the SentinelPlaybook notebook: one row per
+    transaction, with deltas against the previous charge from the same merchant.
+    """
+    df = raw_df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values(by=['user_id', 'merchant', 'timestamp'])
+
+    # Time Deltas
+    df['prev_date'] = df.groupby(['user_id', 'merchant'])['timestamp'].shift(1)
+    df['days_diff'] = (df['timestamp'] - df['prev_date']).dt.days.fillna(FIRST_TXN_DAYS)
+
+    # Loyalty
+    df['first_date'] = df.groupby(['user_id', 'merchant'])['timestamp'].transform('min')
+    df['relationship_days'] = (df['timestamp'] - df['first_date']).dt.days
+
+    # Amount Deltas
+    df['prev_amount'] = df.groupby(['user_id', 'merchant'])['amount'].shift(1)
+    df['first_amount'] = df.groupby(['user_id', 'merchant'])['amount'].transform('first')
+    df['same_amount'] = (df['amount'] - df['prev_amount']).abs() < 0.01
+
+    # Price Changes
+    df['price_change_pct'] = ((df['amount'] - df['prev_amount']) / df['prev_amount']).fillna(0)
+    df['total_change_pct'] = np.where(
+        df['first_amount'] > 0,
+        (df['amount'] - df['first_amount']) / df['first_amount'],
+        0
+    )
+
+    # Quick Charge
+    df['is_quick_charge'] = df['days_diff'] <= QUICK_CHARGE_DAYS
+
+    # Infer Frequency
+    df['frequency'] = frequency_buckets(df['days_diff'], first_txn=df['days_diff'] == FIRST_TXN_DAYS)
+
+    # Cadence of the whole (user, merchant) history
+    add_cadence_features(df, df['days_diff'].where(df['prev_date'].notna()))
+
+    return df
@@ -0,0 +1,114 @@
+import numpy as np
+from features import FEATURES, FIRST_TXN_DAYS
+
+# --- CONFIGURATION (same values as the Veteran report in SentinelPlaybook.ipynb) ---
+# STRICT SAFE LIST: everyday categories where a same-amount repeat is normal
+DB_SAFE_CATEGORIES = ['Dining', 'Groceries', 'Transport']
+
+# VETERAN LOYALTY
+# Only trust users who have been subscribed for > 1 Year.
+# Everyone else gets flagged if they have a zombie charge.
+LOYALTY_DAYS = 365
+ZOMBIE_GAP_DAYS = 60
+
+
+class Rule:
+    """
+    A guardrail over engineered features.
+
+    `when` receives a mapping of column name -> numpy array (a whole DataFrame
+    or a single transaction) and returns a boolean mask, so one definition
+    serves both the offline report and the online /analyze path.
+    """
+
+    def __init__(self, name, when, risk_score, reason):
+        self.name = name
+        self.when = when
+        self.risk_score = risk_score
+        self.reason = reason
+
+    def mask(self, cols):
+        return np.asarray(self.when(cols), dtype=bool)
+
+
+def _double_billing(c):
+    return c['is_quick_charge'] & c['same_amount'] & ~np.isin(c['category'], DB_SAFE_CATEGORIES)
+
+
+def _zombie(c):
+    # A trusted veteran (relationship > LOYALTY_DAYS) pausing and resuming is a safe pause
+    return (
+        (c['days_diff'] > ZOMBIE_GAP_DAYS) & (c['days_diff'] < FIRST_TXN_DAYS)
+        & c['same_amount'] & (c['relationship_days'] <= LOYALTY_DAYS)
+    )
+
+
+# Priority order: the first matching rule wins.
+VETERAN_RULES = [
+    # Rule 1: STRICT Double Billing
+    Rule("double_billing", _double_billing, 0.99, "Guardrail: Double Billing Detected"),
+    # Rule 2: VETERAN Zombie Detection (Gap > 60 days)
+    Rule("zombie", _zombie, 0.95, "Guardrail: Zombie Charge Detected"),
+]
+
+RULE_COLUMNS = ['is_quick_charge', 'same_amount', 'category', 'days_diff', 'relationship_days']
+
+
+class GuardrailEngine:
+    def __init__(self, rules=None):
+        self.rules = VETERAN_RULES if rules is None else rules
+
+    def match(self, cols):
+        """Index of the first matching rule for every row (-1 where none matches)."""
+        hit = None
+        for i, rule in enumerate(self.rules):
+            mask = rule.mask(cols)
+            if hit is None:
+                hit = np.full(mask.shape, -1)
+            hit = np.where((hit == -1) & mask, i, hit)
+        return hit
+
+    def apply(self, df, score_col='ai_risk_score', verdict_col='final_verdict', reason_col='reason'):
+        """Overwrite score/verdict/reason in place for every row a rule catches."""
+        cols = {name: df[name].to_numpy() for name in RULE_COLUMNS}
+        hit = self.match(cols)
+        for i, rule in enumerate(self.rules):
+            caught = hit == i
+            if caught.any():
+                df.loc[caught, score_col] = rule.risk_score
+                df.loc[caught, verdict_col] = True
+                df.loc[caught, reason_col] = rule.reason
+        return df
+
+    def evaluate(self, row):
+        """First rule matching a single transaction (dict of engineered features), or None."""
+        cols = {name: np.asarray([row[name]]) for name in RULE_COLUMNS}
+        hit = self.match(cols)[0]
+        return self.rules[hit] if hit >= 0 else None
+
+
+def row_from_vector(feature_vector, context=None):
+    """
+    Engineered-feature dict for one /analyze feature vector.
+
+    A bare vector has no previous amount or relationship length, so same_amount
+    is recovered from price_change_pct and relationship_days defaults to 0
+    (not a veteran). Pass `context` to supply the real values when known.
+    """
+    row = dict(zip(FEATURES, feature_vector))
+    amount = float(row['amount'])
+    pct = float(row['price_change_pct'])
+    days_diff = float(row['days_diff'])
+    row['days_diff'] = days_diff
+    row['is_quick_charge'] = bool(row['is_quick_charge'])
+
+    same_amount = False
+    if days_diff != FIRST_TXN_DAYS and pct != -1:
+        # Charges are in cents; rounding makes the comparison match the engineered column
+        prev_amount = round(amount / (1 + pct), 2)
+        same_amount = abs(amount - prev_amount) < 0.01
+    row['same_amount'] = same_amount
+    row['relationship_days'] = 0
+    if context:
+        row.update(context)
+    return row
@@ -0,0 +1,116 @@
+import threading
+import time
+import requests
+
+IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+
+# Refresh a token once this fraction of its lifetime has passed
+# (IBM Cloud tokens live 60 minutes, so refreshing starts after ~48).
+REFRESH_FRACTION = 0.8
+# Never trust a token closer than this to its expiry, even if it is still "valid".
+EXPIRY_MARGIN_SECONDS = 60
+
+
+def fetch_iam_token(api_key, timeout=None):
+    """Exchange API key for IAM bearer token. Returns (token, expires_in_seconds)."""
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    data = f"apikey={api_key}&grant_type=urn:ibm:params:oauth:grant-type:apikey"
+    response = requests.post(IAM_URL, headers=headers, data=data, timeout=timeout)
+    response.raise_for_status()
+    payload = response.json()
+    return payload["access_token"], int(payload.get("expires_in", 3600))
+
+
+class _CachedToken:
+    def __init__(self, token, expires_in, now):
+        self.token = token
+        self.expires_at = now + expires_in - EXPIRY_MARGIN_SECONDS
+        self.refresh_at = now + expires_in * REFRESH_FRACTION
+
+
+class IAMTokenManager:
+    """
+    Caches IAM bearer tokens per API key.
+
+    A cached token is served until REFRESH_FRACTION of its lifetime has passed;
+    after that the caller still gets the cached token while a single background
+    thread fetches a new one. Only when the token is missing or about to expire
+    does a caller block on the IAM round trip. At most one refresh per API key
+    runs at any time; concurrent callers wait for it instead of starting their own.
+    """
+
+    def __init__(self, fetch=fetch_iam_token, clock=time.time):
+        self._fetch = fetch
+        self._clock = clock
+        self._tokens = {}
+        self._key_locks = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def get_token(self, api_key):
+        """Return a valid bearer token for api_key, or None if IAM is unreachable."""
+        now = self._clock()
+        with self._lock:
+            entry = self._tokens.get(api_key)
+            if entry is not None and now < entry.expires_at:
+                self.hits += 1
+                if now >= entry.refresh_at and api_key not in self._refreshing:
+                    self._refreshing.add(api_key)
+                    threading.Thread(
+                        target=self._background_refresh, args=(api_key,), daemon=True
+                    ).start()
+                return entry.token
+            self.misses += 1
+            key_lock = self._key_locks.setdefault(api_key, threading.Lock())
+
+        # Blocking path: the first caller refreshes, the rest wait on the key lock
+        # and pick up its result.
+        with key_lock:
+            with self._lock:
+                entry = self._tokens.get(api_key)
+                if entry is not None and self._clock() < entry.expires_at:
+                    return entry.token
+            return self._refresh(api_key)
+
+    def invalidate(self, api_key):
+        """Drop a cached token, e.g. after the upstream answers 401."""
+        with self._lock:
+            self._tokens.pop(api_key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "cached_keys": len(self._tokens),
+            }
+
+    def _refresh(self, api_key):
+        try:
+            token, expires_in = self._fetch(api_key)
+        except Exception as e:
+            print(f"Error getting IAM token: {e}")
+            with self._lock:
+                self.failures += 1
+            return None
+        with self._lock:
+            self._tokens[api_key] = _CachedToken(token, expires_in, self._clock())
+            self.refreshes += 1
+        return token
+
+    def _background_refresh(self, api_key):
+        key_lock = self._key_locks[api_key]
+        try:
+            with key_lock:
+                self._refresh(api_key)
+        finally:
+            with self._lock:
+                self._refreshing.discard(api_key)
@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+FILL_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+DELAY_BUCKETS_MS = [0.1, 0.5, 1, 2, 5, 10, 20, 50]
+
+
+class Histogram:
+    """Counts per upper bound ("<=bound"), plus an overflow bucket."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def snapshot(self):
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.n,
+            "mean": round(self.total / self.n, 3) if self.n else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class _BatchStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self.fill = Histogram(FILL_BUCKETS)
+        self.delay_ms = Histogram(DELAY_BUCKETS_MS)
+
+    def record_batch(self, size, delays_ms):
+        with self._lock:
+            self.batches += 1
+            self.fill.observe(size)
+            for delay in delays_ms:
+                self.delay_ms.observe(delay)
+
+    def record_request(self, deduplicated):
+        with self._lock:
+            self.requests += 1
+            self.deduplicated += deduplicated
+
+    def snapshot(self, max_batch, max_wait_ms):
+        with self._lock:
+            return {
+                "max_batch": max_batch,
+                "max_wait_ms": max_wait_ms,
+                "requests": self.requests,
+                "deduplicated": self.deduplicated,
+                "batches": self.batches,
+                "batch_fill": self.fill.snapshot(),
+                "queue_delay_ms": self.delay_ms.snapshot(),
+            }
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row scoring requests into multi-row calls.
+
+    submit(row) returns a Future for that row's score. A collector thread
+    takes the first waiting row, gathers more for up to max_wait_ms or
+    until max_batch rows, and hands the batch to score_fn(rows) on a small
+    pool. Rows with the same key() while a call for that key is still
+    pending share one result. Batching adapts to load: a lone request on an
+    idle queue is dispatched immediately, and while every pool slot is busy
+    requests keep queueing, so the next batch is as full as the backlog.
+    """
+
+    def __init__(self, score_fn, max_batch=64, max_wait_ms=2.0, key=tuple, max_concurrent_batches=4):
+        self.score_fn = score_fn
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.key = key
+        self._queue = queue.SimpleQueue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_fill = 1
+        self._slots = threading.Semaphore(max_concurrent_batches)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_batches, thread_name_prefix="microbatch")
+        self._stats = _BatchStats()
+        self._thread = threading.Thread(target=self._collect, name="microbatch-collector", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        key = self.key(row)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                self._stats.record_request(True)
+                return future
+            future = Future()
+            self._pending[key] = future
+        self._stats.record_request(False)
+        self._queue.put((key, row, time.monotonic()))
+        return future
+
+    def score(self, row):
+        """Blocking single-row score through the batcher."""
+        return self.submit(row).result()
+
+    def _collect(self):
+        while True:
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            # Only wait for company when the last batch had some
+            if self._last_fill > 1 or not self._queue.empty():
+                deadline = time.monotonic() + self.max_wait_ms / 1000
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._last_fill = len(batch)
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        started = time.monotonic()
+        self._stats.record_batch(len(batch), [(started - queued) * 1000 for _, _, queued in batch])
+        keys = [key for key, _, _ in batch]
+        with self._lock:
+            futures = [self._pending.pop(key) for key in keys]
+        try:
+            scores = self.score_fn([row for _, row, _ in batch])
+        except BaseException as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for future, score in zip(futures, scores):
+            future.set_result(score)
+
+    def stats(self):
+        return self._stats.snapshot(self.max_batch, self.max_wait_ms)
+
+
+class AsyncMicroBatcher:
+    """MicroBatcher for asyncio servers: `await score(row)`, with `async score_fn(rows)`."""
+
+    def __init__(self, score_fn, max_batch=64, max_wait_ms=2.0, key=tuple, max_concurrent_batches=16):
+        self.score_fn = score_fn
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.key = key
+        self._queue = None
+        self._pending = {}
+        self._last_fill = 1
+        self._task = None
+        # The loop keeps only weak references to tasks; running batches are held here
+        self._tasks = set()
+        self._slots = None
+        self.max_concurrent_batches = max_concurrent_batches
+        self._stats = _BatchStats()
+
+    async def score(self, row):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self._task = asyncio.get_running_loop().create_task(self._collect())
+        key = self.key(row)
+        future = self._pending.get(key)
+        self._stats.record_request(future is not None)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            self._queue.put_nowait((key, row, time.monotonic()))
+        return await asyncio.shield(future)
+
+    async def _collect(self):
+        while True:
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            if self._last_fill > 1 or not self._queue.empty():
+                deadline = time.monotonic() + self.max_wait_ms / 1000
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                    except asyncio.TimeoutError:
+                        break
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self._last_fill = len(batch)
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        started = time.monotonic()
+        self._stats.record_batch(len(batch), [(started - queued) * 1000 for _, _, queued in batch])
+        futures = [self._pending.pop(key) for key, _, _ in batch]
+        try:
+            scores = await self.score_fn([row for _, row, _ in batch])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for future, score in zip(futures, scores):
+            future.set_result(score)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Let batches already sent finish so their callers get an answer
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self):
+        return self._stats.snapshot(self.max_batch, self.max_wait_ms)
@@ -0,0 +1,356 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+from txn_store import ROW_GROUP_SIZE, uuid_strings
+
+# Config-driven mock transaction generator behind generate_mock_data.py and
+# generate_new_data.py. A config holds the date range, the everyday merchant
+# table and the predatory scenarios; PRESETS has the two datasets those
+# scripts have always produced. Users are generated in fixed-size shards, each
+# from its own seed (seed, shard number), with vectorized NumPy sampling, so the
+# output depends only on the config, seed and shard size - never on the
+# number of worker processes. Shards are written out in order as they finish,
+# so memory stays at a few shards whatever the user count.
+
+COLUMNS = ['transaction_id', 'timestamp', 'user_id', 'merchant', 'amount', 'description', 'category', 'pattern_label']
+SECONDS_PER_DAY = 86400
+USERS_PER_SHARD = 10_000
+NORMAL = "normal"
+
+
+def _monthly(count, amount, description, label=NORMAL, every=30):
+    return [{"days": every * i, "amount": amount, "description": description, "label": label} for i in range(count)]
+
+
+# --- PRESETS ---
+# Everyday merchants: (merchant, category, min amount, max amount, descriptions).
+# Scenarios: with `probability` a user gets every charge in `charges`, dated
+# `days` (plus a random `seconds` [min, max] if given) after a start that is
+# start_date + a random whole number of days in `start` [min, max], or a
+# random moment of the date range for start "anytime".
+BASELINE = {
+    "start_date": "2023-01-01",
+    "end_date": "2024-06-30",
+    "users": 300,
+    "user_ids": "sequential",
+    "user_format": "user_%03d",
+    "txns_per_user": [40, 120],
+    "merchants": [
+        ["GroceryMart", "Groceries", 50, 200, ["Groceries", "Weekly Shop", "Store #402"]],
+        ["CoffeeSpot", "Dining", 4, 15, ["Coffee", "Latte", "Morning Brew"]],
+        ["MetroTransit", "Transport", 2, 10, ["Bus Fare", "Subway Token", "Ride Share"]],
+        ["TechStore", "Electronics", 20, 500, ["Gadget", "Cable", "Repair"]],
+        ["StreamFlix", "Entertainment", 12, 12, ["Monthly Sub", "Streaming Service"]],
+        ["GymBody", "Health", 40, 40, ["Gym Membership", "Monthly Dues"]],
+        ["CityPower", "Utilities", 80, 150, ["Electric Bill", "Power Usage"]],
+        ["MobileNet", "Utilities", 45, 60, ["Phone Bill", "Data Plan"]],
+        ["FastBurger", "Dining", 10, 30, ["Lunch", "Burger Combo", "Drive Thru"]],
+        ["BookWorm", "Shopping", 15, 60, ["Books", "Novel", "Stationery"]],
+        ["FashionHub", "Shopping", 30, 150, ["Clothing", "Shoes", "Accessory"]],
+        ["RideGo", "Transport", 15, 45, ["Ride to Work", "Trip", "RideGo Svc"]],
+    ],
+    "scenarios": [
+        # Price Jump (Recurring sub doubles)
+        {"name": "price_jump", "probability": 0.15, "merchant": "SneakyVPN", "category": "Software", "start": [0, 60],
+         "charges": _monthly(4, 9.99, "Monthly Access") + [
+             {"days": 120, "amount": 49.99, "description": "Monthly Access Premium", "label": "predatory_jump"}]},
+        # Inactivity Fee (Dormant then charged after 5 months silence)
+        {"name": "inactivity", "probability": 0.15, "merchant": "OldBank", "category": "Finance", "start": [0, 60],
+         "charges": [
+             {"days": 0, "amount": 200.00, "description": "Opening Deposit", "label": NORMAL},
+             {"days": 150, "amount": 25.00, "description": "Dormancy Fee", "label": "predatory_inactivity"}]},
+        # Hidden Subscription (Trap)
+        {"name": "hidden", "probability": 0.15, "merchant": "FreeGadget", "category": "Shopping", "start": [0, 150],
+         "charges": [
+             {"days": 0, "amount": 4.95, "description": "S&H for Trial", "label": "potential_trap"},
+             {"days": 14, "amount": 99.00, "description": "Quarterly Membership", "label": "predatory_hidden"}]},
+        # Creeping Fee (Slow boil, 8% increase each time)
+        {"name": "creeping", "probability": 0.10, "merchant": "StreamPlus", "category": "Entertainment", "start": [0, 30],
+         "charges": [{"days": 30 * i, "amount": round(12.00 * (1.08 ** i), 2), "description": "Streaming Plan",
+                      "label": "predatory_creeping" if i > 3 else NORMAL} for i in range(6)]},
+        # Double Billing (Accidental duplicate, same day, slightly different time)
+        {"name": "double", "probability": 0.10, "merchant": "GlitchyStore", "category": "Shopping", "start": "anytime",
+         "charges": [
+             {"days": 0, "amount": 45.50, "description": "Purchase #8821", "label": NORMAL},
+             {"days": 0, "seconds": [10, 300], "amount": 45.50, "description": "Purchase #8821",
+              "label": "predatory_double"}]},
+        # Zombie Subscription (User cancels, charged again 8 months later)
+        {"name": "zombie", "probability": 0.10, "merchant": "ZombieGym", "category": "Health", "start": [0, 0],
+         "charges": _monthly(3, 29.99, "Monthly Gym") + [
+             {"days": 240, "amount": 29.99, "description": "Monthly Gym", "label": "predatory_zombie"}]},
+    ],
+}
+
+
+def _shifted():
+    # mock_transactions-2.csv: six months later, renamed merchants, tweaked amounts, random user ids
+    config = json.loads(json.dumps(BASELINE))
+    config.update({
+        "start_date": "2023-07-01",
+        "end_date": "2024-12-30",
+        "user_ids": "random",
+        "user_id_range": [1000, 9999],
+        "user_format": "user_%d",
+        "merchants": [
+            ["FreshFoods", "Groceries", 55, 210, ["Groceries", "Weekly Shop", "Store #905"]],
+            ["JavaJoint", "Dining", 5, 18, ["Coffee", "Latte", "Morning Brew"]],
+            ["CityRail", "Transport", 2.50, 12, ["Bus Fare", "Subway Token", "Ride Share"]],
+            ["GadgetDepot", "Electronics", 25, 520, ["Gadget", "Cable", "Repair"]],
+            ["BingeWatch", "Entertainment", 13, 14, ["Monthly Sub", "Streaming Service"]],
+            ["FitPhysique", "Health", 45, 45, ["Gym Membership", "Monthly Dues"]],
+            ["UrbanElectric", "Utilities", 85, 160, ["Electric Bill", "Power Usage"]],
+            ["CellConnect", "Utilities", 48, 65, ["Phone Bill", "Data Plan"]],
+            ["QuickBite", "Dining", 12, 35, ["Lunch", "Burger Combo", "Drive Thru"]],
+            ["ReadAddict", "Shopping", 18, 65, ["Books", "Novel", "Stationery"]],
+            ["TrendSetter", "Shopping", 35, 160, ["Clothing", "Shoes", "Accessory"]],
+            ["TravelEasy", "Transport", 18, 50, ["Ride to Work", "Trip", "Travel Svc"]],
+        ],
+    })
+    renames = {
+        "SneakyVPN": "StealthNet", "OldBank": "AncientTrust", "FreeGadget": "BonusTech",
+        "StreamPlus": "ViewMax", "GlitchyStore": "BuggyShop", "ZombieGym": "UndeadFitness",
+    }
+    amounts = {9.99: 10.99, 49.99: 54.99, 200.00: 210.00, 25.00: 28.50, 4.95: 5.95, 99.00: 105.00,
+               45.50: 48.25, 29.99: 32.99}
+    for scenario in config["scenarios"]:
+        scenario["merchant"] = renames[scenario["merchant"]]
+        for i, charge in enumerate(scenario["charges"]):
+            if scenario["name"] == "creeping":
+                charge["amount"] = round(12.50 * (1.08 ** i), 2)
+            else:
+                charge["amount"] = amounts[charge["amount"]]
+            charge["description"] = charge["description"].replace("#8821", "#9921")
+    return config
+
+
+PRESETS = {"baseline": BASELINE, "shifted": _shifted()}
+
+
+def load_config(preset="baseline", path=None):
+    """A preset, or a JSON file with the same keys (missing keys come from the preset)."""
+    config = json.loads(json.dumps(PRESETS[preset]))
+    if path:
+        with open(path) as f:
+            config.update(json.load(f))
+    return config
+
+
+class _Vocabulary:
+    """Every string a config can produce, so shards share dictionary-encoded columns."""
+
+    def __init__(self, config):
+        merchants = [m[0] for m in config["merchants"]] + [s["merchant"] for s in config["scenarios"]]
+        categories = [m[1] for m in config["merchants"]] + [s["category"] for s in config["scenarios"]]
+        descriptions = [d for m in config["merchants"] for d in m[4]]
+        descriptions += [c["description"] for s in config["scenarios"] for c in s["charges"]]
+        labels = [NORMAL] + [c["label"] for s in config["scenarios"] for c in s["charges"]]
+        self.values = {}
+        self.codes = {}
+        for column, values in (("merchant", merchants), ("category", categories),
+                               ("description", descriptions), ("pattern_label", labels)):
+            unique = list(dict.fromkeys(values))
+            self.values[column] = pa.array(unique, type=pa.string())
+            self.codes[column] = {v: i for i, v in enumerate(unique)}
+
+    def code(self, column, value):
+        return self.codes[column][value]
+
+    def needs_quoting(self):
+        return any(any(c in v for c in ',"\r\n') for values in self.codes.values() for v in values)
+
+
+def user_ids(config, users, seed):
+    """The integer user ids (formatted with config["user_format"]) for `users` users."""
+    if config.get("user_ids", "sequential") == "sequential":
+        return np.arange(users, dtype=np.int64)
+    low, high = config.get("user_id_range", [0, 10 * users - 1])
+    # Widen a range that is too small to give every user a distinct id
+    high = max(high, low + 10 * users - 1)
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(2 ** 32 - 1,)))
+    return low + rng.choice(high - low + 1, size=users, replace=False)
+
+
+def generate_shard(config, ids, seed, shard):
+    """Arrow table of every transaction for the users `ids`, sorted by time (txn_store.py column types)."""
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(shard,)))
+    vocab = _Vocabulary(config)
+    start = np.datetime64(config["start_date"], "s").astype(np.int64)
+    span_days = int((np.datetime64(config["end_date"], "D") - np.datetime64(config["start_date"], "D")).astype(int))
+    n = len(ids)
+
+    def anytime(size):
+        return start + rng.integers(0, span_days, size) * SECONDS_PER_DAY + rng.integers(0, SECONDS_PER_DAY, size)
+
+    # 1. Normal background noise
+    low, high = config["txns_per_user"]
+    counts = rng.integers(low, high + 1, n)
+    rows = int(counts.sum())
+    merchants = config["merchants"]
+    pick = rng.integers(len(merchants), size=rows)
+    min_amt = np.array([m[2] for m in merchants], dtype=float)[pick]
+    max_amt = np.array([m[3] for m in merchants], dtype=float)[pick]
+    desc_count = np.array([len(m[4]) for m in merchants])[pick]
+    # (merchant, i) -> description code, padded to the longest description list
+    width = max(len(m[4]) for m in merchants)
+    desc_codes = np.array([[vocab.code("description", d) for d in m[4]] + [0] * (width - len(m[4])) for m in merchants])
+    parts = [{
+        "user": np.repeat(np.arange(n), counts),
+        "timestamp": anytime(rows),
+        "merchant": np.array([vocab.code("merchant", m[0]) for m in merchants])[pick],
+        "amount": np.round(rng.uniform(min_amt, max_amt), 2),
+        "description": desc_codes[pick, (rng.random(rows) * desc_count).astype(np.int64)],
+        "category": np.array([vocab.code("category", m[1]) for m in merchants])[pick],
+        "pattern_label": np.full(rows, vocab.code("pattern_label", NORMAL)),
+    }]
+
+    # 2. Predatory scenarios, each on its own random subset of users
+    for scenario in config["scenarios"]:
+        users = np.flatnonzero(rng.random(n) < scenario["probability"])
+        k = len(users)
+        if scenario["start"] == "anytime":
+            base = anytime(k)
+        else:
+            base = start + rng.integers(scenario["start"][0], scenario["start"][1] + 1, k) * SECONDS_PER_DAY
+        for charge in scenario["charges"]:
+            ts = base + charge["days"] * SECONDS_PER_DAY
+            if "seconds" in charge:
+                ts = ts + rng.integers(charge["seconds"][0], charge["seconds"][1] + 1, k)
+            parts.append({
+                "user": users,
+                "timestamp": ts,
+                "merchant": np.full(k, vocab.code("merchant", scenario["merchant"])),
+                "amount": np.full(k, float(charge["amount"])),
+                "description": np.full(k, vocab.code("description", charge["description"])),
+                "category": np.full(k, vocab.code("category", scenario["category"])),
+                "pattern_label": np.full(k, vocab.code("pattern_label", charge["label"])),
+            })
+
+    columns = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+    order = np.argsort(columns["timestamp"], kind="stable")
+    columns = {name: values[order] for name, values in columns.items()}
+    total = len(order)
+
+    # Random (version 4) UUIDs straight from the shard's generator, so they are reproducible too
+    raw = np.frombuffer(rng.bytes(16 * total), dtype=np.uint8).reshape(-1, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+    names = pa.array(np.char.mod(config["user_format"], ids), type=pa.string())
+    return pa.table({
+        "transaction_id": pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), total, [None, pa.py_buffer(raw.tobytes())]),
+        "timestamp": pa.array(columns["timestamp"] * 1_000_000, type=pa.timestamp("us")),
+        "user_id": pa.DictionaryArray.from_arrays(pa.array(columns["user"].astype(np.int32)), names),
+        **{name: pa.DictionaryArray.from_arrays(pa.array(columns[name].astype(np.int32)), vocab.values[name])
+           for name in ("merchant", "description", "category", "pattern_label")},
+        "amount": pa.array(columns["amount"]),
+    }).select(COLUMNS)
+
+
+def _to_csv_table(table):
+    """Plain-text columns for the CSV writer: UUID strings, whole-second timestamps, no dictionaries."""
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        if name == "transaction_id":
+            column = uuid_strings(column)
+        elif pa.types.is_timestamp(column.type):
+            column = column.cast(pa.timestamp("s"))
+        elif pa.types.is_dictionary(column.type):
+            column = column.cast(pa.string())
+        columns[name] = column
+    return pa.table(columns)
+
+
+def iter_shards(config, users, seed=42, workers=1, users_per_shard=USERS_PER_SHARD):
+    """Shard tables in order, at most `workers` + 1 of them generated ahead of the writer."""
+    ids = user_ids(config, users, seed)
+    bounds = list(range(0, users, users_per_shard)) + [users]
+    jobs = [(config, ids[bounds[i]:bounds[i + 1]], seed, i) for i in range(len(bounds) - 1)]
+    if workers <= 1:
+        for job in jobs:
+            yield generate_shard(*job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = [pool.submit(generate_shard, *job) for job in jobs[:workers + 1]]
+        submitted = len(pending)
+        while pending:
+            table = pending.pop(0).result()
+            if submitted < len(jobs):
+                pending.append(pool.submit(generate_shard, *jobs[submitted]))
+                submitted += 1
+            yield table
+
+
+def _tee(shards, fn):
+    for table in shards:
+        fn(table)
+        yield table
+
+
+def write_transactions(path, config, users, seed=42, workers=1, users_per_shard=USERS_PER_SHARD, on_shard=None):
+    """
+    Stream generated transactions to `path`: CSV (the mock_transactions.csv
+    layout), or a Parquet file with txn_store.py's column types when the path
+    ends in .parquet. on_shard(table), if given, also sees every shard (all
+    transactions of its users) as it is written. Returns the number of rows.
+    """
+    rows = 0
+    start = time.time()
+    shards = iter_shards(config, users, seed, workers, users_per_shard)
+    if on_shard is not None:
+        shards = _tee(shards, on_shard)
+    if path.endswith(".parquet"):
+        writer = None
+        for table in shards:
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+            rows += len(table)
+        if writer is not None:
+            writer.close()
+    else:
+        quoting = "needed" if _Vocabulary(config).needs_quoting() else "none"
+        options = pacsv.WriteOptions(include_header=False, quoting_style=quoting)
+        with open(path, "wb") as f:
+            f.write((",".join(COLUMNS) + "\n").encode())
+            writer = None
+            for table in shards:
+                table = _to_csv_table(table)
+                if writer is None:
+                    writer = pacsv.CSVWriter(f, table.schema, write_options=options)
+                writer.write_table(table)
+                rows += len(table)
+            if writer is not None:
+                writer.close()
+    elapsed = time.time() - start
+    print(f"Saved {rows:,} transactions for {users:,} users to {path} in {elapsed:.1f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate mock transactions (vectorized, sharded, streamed to disk)")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="baseline",
+                        help="baseline = mock_transactions.csv, shifted = mock_transactions-2.csv")
+    parser.add_argument("--config", default=None, help="JSON file overriding preset keys (merchants, scenarios, dates...)")
+    parser.add_argument("--users", type=int, default=None, help="Number of users (default: the preset's, 300)")
+    parser.add_argument("--seed", type=int, default=42, help="Same seed, config and shard size -> same output")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating shards (0 = all cores)")
+    parser.add_argument("--users-per-shard", type=int, default=USERS_PER_SHARD, help="Users generated together")
+    parser.add_argument("--output", default="mock_transactions.csv", help="Output path (.csv or .parquet)")
+    args = parser.parse_args()
+
+    config = load_config(args.preset, args.config)
+    workers = args.workers or os.cpu_count() or 1
+    write_transactions(args.output, config, args.users or config["users"], args.seed, workers, args.users_per_shard)
+
+
+if __name__ == "__main__":
+    main()
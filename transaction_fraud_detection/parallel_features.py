@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from features import engineer_features
+
+# Per-(user, merchant) feature steps (features.engineer_features(),
+# middleman.add_model_features()) on all cores.
+#
+# Users are cut into contiguous ranges of their sorted order, balanced by row
+# count. The parent writes the input once as an Arrow IPC file in shared
+# memory (/dev/shm), plus the shard row order as a .npy file; each worker
+# memory-maps both and takes out its own rows without pickling a DataFrame,
+# and writes its result back the same way. Because shards are sorted user
+# ranges, concatenating results in shard order gives exactly the serial
+# (user, merchant, timestamp) order.
+
+ROW_COLUMN = "__row"
+# More shards than workers so one slow shard does not idle the rest of the pool
+SHARDS_PER_WORKER = 4
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def _shared_dir():
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def user_shards(user_ids, shards):
+    """
+    (row order, row bounds): rows grouped by sorted user, original order kept
+    within a user, and cut into at most `shards` runs of whole users of about
+    equal row count. Shard i is order[bounds[i]:bounds[i + 1]].
+    """
+    ranks, uniques = pd.factorize(user_ids, sort=True)
+    order = np.argsort(ranks, kind="stable")
+    sorted_ranks = ranks[order]
+    rows_per_user = np.cumsum(np.bincount(ranks, minlength=len(uniques)))
+    targets = np.arange(1, shards) * len(ranks) / shards
+    user_cuts = np.unique(np.searchsorted(rows_per_user, targets, side="left") + 1)
+    user_cuts = user_cuts[(user_cuts > 0) & (user_cuts < len(uniques))]
+    bounds = np.concatenate([[0], np.searchsorted(sorted_ranks, user_cuts), [len(ranks)]])
+    return order, bounds
+
+
+def _write_ipc(table, path):
+    with pa.ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_ipc(path):
+    # Memory-mapped: the buffers stay in the page cache instead of being copied in
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _run_shard(fn, input_path, order_path, start, stop, output_path):
+    rows = np.load(order_path, mmap_mode="r")[start:stop]
+    shard = _read_ipc(input_path).take(rows).to_pandas()
+    result = fn(shard)
+    _write_ipc(pa.Table.from_pandas(result, preserve_index=False), output_path)
+    return len(result)
+
+
+def map_user_shards(df, fn, workers=None, shards=None, tmp_dir=None):
+    """
+    fn(df) on all cores, for an fn that only relates rows of the same user and
+    returns its rows sorted by user first (like engineer_features()).
+    The result is identical to fn(df), index included.
+    """
+    workers = workers or default_workers()
+    shards = shards or workers * SHARDS_PER_WORKER
+    if workers <= 1 or len(df) == 0:
+        return fn(df)
+
+    order, bounds = user_shards(df["user_id"], shards)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.append_column(ROW_COLUMN, pa.array(np.arange(len(df), dtype=np.int64)))
+
+    workdir = tempfile.mkdtemp(prefix="features-", dir=tmp_dir or _shared_dir())
+    try:
+        input_path = os.path.join(workdir, "input.arrow")
+        order_path = os.path.join(workdir, "order.npy")
+        _write_ipc(table, input_path)
+        np.save(order_path, order)
+        del table
+        outputs = [os.path.join(workdir, f"shard-{i:05d}.arrow") for i in range(len(bounds) - 1)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_run_shard, fn, input_path, order_path, int(bounds[i]), int(bounds[i + 1]), outputs[i])
+                for i in range(len(outputs))
+            ]
+            for future in futures:
+                future.result()
+        result = pa.concat_tables([_read_ipc(path) for path in outputs]).to_pandas()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    rows = result.pop(ROW_COLUMN).to_numpy()
+    result.index = df.index[rows]
+    return result
+
+
+def engineer_features_parallel(raw_df, workers=None):
+    """features.engineer_features() across `workers` processes (default: all cores)."""
+    return map_user_shards(raw_df, engineer_features, workers)
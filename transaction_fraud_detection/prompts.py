@@ -0,0 +1,87 @@
+import json
+
+SYSTEM_PROMPT = "You are a financial pattern detection AI."
+INSTRUCTION = "Analyze the transaction history for predatory patterns. Return JSON: {is_predatory, pattern_type, reason}."
+
+
+def prompt_prefix():
+    # Everything before the transaction context is identical for every prompt
+    return f"""<|system|>
+{SYSTEM_PROMPT}
+<|user|>
+{INSTRUCTION}
+
+CONTEXT:
+"""
+
+
+def build_prompt(transactions_context):
+    # Format as input sample for the model
+    clean_txns = []
+    for t in transactions_context:
+        clean_txns.append({
+            "date": str(t.get("timestamp"))[:10],
+            "amt": t.get("amount"),
+            "desc": t.get("description")
+        })
+        
+    return prompt_prefix() + f"""{json.dumps(clean_txns)}
+<|assistant|>
+"""
+
+
+def training_text(sample):
+    """The full text train_local.py trains on for one train.jsonl sample (prompt + answer)."""
+    return f"""<|system|>
+{SYSTEM_PROMPT}
+<|user|>
+{sample['instruction']}
+
+CONTEXT:
+{sample['input']}
+<|assistant|>
+{sample['output']}"""
+
+
+def json_closed(text):
+    """True once the first JSON object in text has been closed (braces inside strings ignored)."""
+    depth = 0
+    in_string = False
+    escaped = False
+    for ch in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = depth > 0
+        elif ch == "{":
+            depth += 1
+        elif ch == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return True
+    return False
+
+
+def parse_response(response_part):
+    """Pull the verdict JSON out of generated text."""
+    try:
+        # Find first { and last }
+        start = response_part.find("{")
+        end = response_part.rfind("}") + 1
+        if start != -1 and end != -1:
+            json_str = response_part[start:end]
+            return json.loads(json_str)
+        else:
+            return {"is_predatory": False, "pattern_type": "ParseError", "reason": "No JSON found"}
+
+    except Exception as e:
+        return {
+            "is_predatory": False, 
+            "pattern_type": "Error", 
+            "reason": str(e)
+        }
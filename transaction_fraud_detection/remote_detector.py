@@ -0,0 +1,64 @@
+import os
+import requests
+from iam_auth import IAMTokenManager
+from prompts import build_prompt, parse_response
+
+DEFAULT_MODEL_ID = "ibm/granite-3-8b-instruct"
+DEFAULT_URL = "https://ca-tor.ml.cloud.ibm.com"
+
+
+def remote_identity(model_id=None):
+    """Verdict cache identity for a watsonx.ai model (see verdict_cache.py)."""
+    return f"watsonx:{model_id or os.environ.get('WATSONX_MODEL_ID', DEFAULT_MODEL_ID)}|greedy:200"
+
+
+class RemoteDetector:
+    """
+    Same interface as PatternDetector, but generates on watsonx.ai text generation.
+    Expects WATSONX_API_KEY and WATSONX_PROJECT_ID env vars (see setup_env.sh).
+    Holds no model in memory, so many of these can run side by side in threads.
+    """
+
+    def __init__(self, api_key=None, project_id=None, model_id=None, base_url=None, timeout=60):
+        self.api_key = api_key or os.environ.get("WATSONX_API_KEY")
+        self.project_id = project_id or os.environ.get("WATSONX_PROJECT_ID")
+        self.model_id = model_id or os.environ.get("WATSONX_MODEL_ID", DEFAULT_MODEL_ID)
+        self.base_url = base_url or os.environ.get("WATSONX_URL", DEFAULT_URL)
+        self.timeout = timeout
+        if not self.api_key or not self.project_id:
+            raise ValueError("WATSONX_API_KEY and WATSONX_PROJECT_ID must be set")
+        self.tokens = IAMTokenManager()
+        # Keep-alive connections shared by every call from this detector
+        self.session = requests.Session()
+
+    def _build_prompt(self, transactions_context):
+        return build_prompt(transactions_context)
+
+    def analyze_sequence(self, transactions):
+        token = self.tokens.get_token(self.api_key)
+        if not token:
+            return {"is_predatory": False, "pattern_type": "Error", "reason": "Could not authenticate with Watsonx."}
+
+        body = {
+            "model_id": self.model_id,
+            "input": self._build_prompt(transactions),
+            "parameters": {
+                "decoding_method": "greedy",
+                "max_new_tokens": 200
+            },
+            "project_id": self.project_id
+        }
+        try:
+            response = self.session.post(
+                f"{self.base_url}/ml/v1/text/generation?version=2023-05-29",
+                headers={"Authorization": f"Bearer {token}", "Accept": "application/json"},
+                json=body,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            return parse_response(response.json()['results'][0]['generated_text'])
+        except Exception as e:
+            return {"is_predatory": False, "pattern_type": "Error", "reason": str(e)}
+
+    def analyze_batch(self, sequences, batch_size=None):
+        return [self.analyze_sequence(seq) for seq in sequences]
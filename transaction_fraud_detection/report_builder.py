@@ -0,0 +1,109 @@
+import argparse
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from features import FEATURES, engineer_features
+from guardrails import GuardrailEngine
+from txn_store import read_transactions
+
+# Same cut-off as the Veteran report in SentinelPlaybook.ipynb
+THRESHOLD = 0.40
+AI_REASON = "AI Probability Match"
+FLAGGED_PATTERN = "AI + Hybrid Logic"
+
+# Final_Report.csv layout
+REPORT_COLUMNS = [
+    'Verdict', 'User', 'Merchant', 'Category', 'Pattern_Detected',
+    'AI_Confidence', 'AI_Reason', 'Start_Date', 'Last_Txn'
+]
+# What build_report() needs from each scored transaction
+SCORED_COLUMNS = ['user_id', 'merchant', 'timestamp', 'category', 'final_verdict', 'ai_risk_score', 'reason']
+
+
+def score_transactions(df, model, threshold=THRESHOLD):
+    """The notebook's scoring step on engineered transactions: model probability, then guardrails."""
+    probs = model.predict_proba(df[FEATURES])[:, 1]
+    df['ai_risk_score'] = probs
+    df['final_verdict'] = probs >= threshold
+    df['reason'] = AI_REASON
+    GuardrailEngine().apply(df)
+    return df
+
+
+def build_report(scored):
+    """
+    One report row per (user, merchant) from scored transactions (sorted by
+    time within each pair, as engineer_features() leaves them). The verdict
+    comes from the pair's latest transaction and the dates from its first and
+    last one. Same rows and order as the notebook's per-group loop, but as a
+    single groupby with column-wise formatting.
+    """
+    # First and last row position of every pair; min/max over integers is far
+    # cheaper than first/last over each (string) column
+    rows = pd.Series(np.arange(len(scored)), index=scored.index)
+    bounds = rows.groupby([scored['user_id'], scored['merchant']], sort=True).agg(['min', 'max'])
+    latest = scored.iloc[bounds['max'].to_numpy()]
+    timestamps = pd.to_datetime(scored['timestamp'])
+    start = timestamps.iloc[bounds['min'].to_numpy()]
+    last = timestamps.iloc[bounds['max'].to_numpy()]
+
+    flagged = latest['final_verdict'].astype(bool).to_numpy()
+    confidence = (latest['ai_risk_score'].astype(float) * 100).round(1)
+    risk = confidence.astype(str).to_numpy(dtype=object)
+    safety = (100 - confidence).round(1).astype(str).to_numpy(dtype=object)
+    reason = latest['reason'].astype(str).to_numpy(dtype=object)
+
+    report = pd.DataFrame({
+        'Verdict': np.where(flagged, "FLAGGED", "Safe"),
+        'User': latest['user_id'].to_numpy(),
+        'Merchant': latest['merchant'].to_numpy(),
+        'Category': latest['category'].to_numpy(),
+        'Pattern_Detected': np.where(flagged, FLAGGED_PATTERN, "None"),
+        'AI_Confidence': np.where(flagged, "Risk Level: " + risk + "%", "Safety Score: " + safety + "%"),
+        'AI_Reason': np.where(flagged, reason + " (" + risk + "%).", "Safe (Confidence " + risk + "%)."),
+        'Start_Date': start.dt.strftime('%Y-%m-%d').to_numpy(),
+        'Last_Txn': last.dt.strftime('%Y-%m-%d').to_numpy(),
+    }, columns=REPORT_COLUMNS)
+    return report.sort_values(by='Verdict', ascending=True)
+
+
+def write_report(report, path):
+    """CSV, or Parquet when the path ends in .parquet."""
+    if path.endswith('.parquet'):
+        report.to_parquet(path, index=False)
+    else:
+        report.to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the per-(user, merchant) Veteran report")
+    parser.add_argument("input_file",
+                        help="Raw transactions CSV/Parquet (scored with --model), or transactions that already "
+                             "have final_verdict, ai_risk_score and reason columns")
+    parser.add_argument("--model", default=None, help="Pipeline from export_local_model.py, to score raw transactions")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Flag at this model probability or above")
+    parser.add_argument("--output", default="Final_Report_Veteran.csv", help="Report path (.csv or .parquet)")
+    args = parser.parse_args()
+
+    start = time.time()
+    df = read_transactions(args.input_file)
+    if not {'final_verdict', 'ai_risk_score', 'reason'} <= set(df.columns):
+        if not args.model:
+            parser.error("input is not scored yet; pass --model (see export_local_model.py)")
+        df = score_transactions(engineer_features(df), joblib.load(args.model), args.threshold)
+    loaded = time.time()
+
+    report = build_report(df[SCORED_COLUMNS])
+    write_report(report, args.output)
+    elapsed = time.time() - loaded
+    flagged = int((report['Verdict'] == "FLAGGED").sum())
+    print(f"Loaded and scored {len(df):,} transactions in {loaded - start:.1f}s")
+    print(f"SUCCESS! {len(report):,} pairs ({flagged:,} flagged) built in {elapsed:.2f}s "
+          f"({len(df) / max(elapsed, 1e-9):,.0f} rows/s) and saved as '{args.output}'.")
+
+
+if __name__ == "__main__":
+    main()
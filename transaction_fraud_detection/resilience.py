@@ -0,0 +1,236 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class TransientError(Exception):
+    """A failure worth retrying: connection error, timeout, 429 or 5xx."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens when, over the last `window` calls, the share of failures reaches
+    `error_rate` or the share slower than `slow_ms` reaches `slow_rate`
+    (once at least `min_calls` have been seen). While open every call is
+    rejected for `open_seconds`; then one probe call is let through, and
+    its outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, window=20, min_calls=10, error_rate=0.5, slow_ms=2000, slow_rate=0.5,
+                 open_seconds=30, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_ms = slow_ms
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def allow(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpenError("circuit open")
+
+    def record(self, ok, latency_ms):
+        with self._lock:
+            if self._current_state() == HALF_OPEN:
+                self._probing = False
+                if ok and latency_ms < self.slow_ms:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                return
+            self._outcomes.append((ok, latency_ms >= self.slow_ms))
+            n = len(self._outcomes)
+            if self._state == CLOSED and n >= self.min_calls:
+                failures = sum(1 for ok, _ in self._outcomes if not ok)
+                slow = sum(1 for _, is_slow in self._outcomes if is_slow)
+                if failures / n >= self.error_rate or slow / n >= self.slow_rate:
+                    self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self.opened += 1
+        print(f"Circuit breaker opened for {self.open_seconds}s")
+
+    def stats(self):
+        with self._lock:
+            n = len(self._outcomes)
+            return {
+                "state": self._current_state(),
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "error_rate": round(sum(1 for ok, _ in self._outcomes if not ok) / n, 3) if n else 0.0,
+                "slow_rate": round(sum(1 for _, s in self._outcomes if s) / n, 3) if n else 0.0,
+            }
+
+
+class RetryBudget:
+    """
+    Caps retries at `ratio` of calls (plus `min_per_second` so a quiet
+    service can still retry), so retries cannot multiply the load on an
+    upstream that is already struggling.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=10, clock=time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._clock = clock
+        self._tokens = float(max_tokens)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount):
+        now = self._clock()
+        self._tokens = min(self.max_tokens, self._tokens + amount + (now - self._last) * self.min_per_second)
+        self._last = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            self._refill(0)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class Resilience:
+    """
+    Retries and circuit breaking around calls to one upstream.
+
+    The wrapped function signals a retryable failure by raising
+    TransientError; that counts against the breaker and is retried up to
+    `attempts` times with full-jitter exponential backoff, as long as the
+    retry budget allows. Any other exception means the upstream did answer
+    (e.g. a 4xx), so it is passed straight through and the breaker counts
+    it as healthy. When the breaker is open, CircuitOpenError is raised
+    without calling the upstream. call() is for threads, acall() for asyncio.
+    """
+
+    def __init__(self, name, breaker=None, budget=None, attempts=3, backoff_ms=100, max_backoff_ms=2000):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.attempts = attempts
+        self.backoff_ms = backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.retries_denied = 0
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff_ms, self.backoff_ms * 2 ** attempt)) / 1000
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _retry_after(self, attempt):
+        """Backoff seconds before the next attempt, or None to give up."""
+        if attempt + 1 >= self.attempts:
+            return None
+        if not self.budget.withdraw():
+            self._count(retries_denied=1)
+            return None
+        self._count(retries=1)
+        return self._backoff(attempt)
+
+    def call(self, fn, *args, **kwargs):
+        self._count(calls=1)
+        self.budget.deposit()
+        for attempt in range(self.attempts):
+            self.breaker.allow()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except TransientError:
+                self.breaker.record(False, (time.monotonic() - start) * 1000)
+                self._count(failures=1)
+                delay = self._retry_after(attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record(True, (time.monotonic() - start) * 1000)
+                raise
+            self.breaker.record(True, (time.monotonic() - start) * 1000)
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        self._count(calls=1)
+        self.budget.deposit()
+        for attempt in range(self.attempts):
+            self.breaker.allow()
+            start = time.monotonic()
+            try:
+                result = await fn(*args, **kwargs)
+            except TransientError:
+                self.breaker.record(False, (time.monotonic() - start) * 1000)
+                self._count(failures=1)
+                delay = self._retry_after(attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record(True, (time.monotonic() - start) * 1000)
+                raise
+            self.breaker.record(True, (time.monotonic() - start) * 1000)
+            return result
+
+    def stats(self):
+        with self._lock:
+            counts = {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "retries_denied": self.retries_denied,
+            }
+        return dict(counts, breaker=self.breaker.stats())
@@ -1,90 +1,348 @@
-import pandas as pd
 import argparse
+import csv
 import sys
 import os
+import threading
 import time
-from detector import PatternDetector
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from triage import triage, summarize, PREDATORY, UNCERTAIN
+from prompts import build_prompt
+from verdict_cache import UNCACHEABLE_TYPES, VerdictCache
+from txn_store import parquet_path, read_transactions
+
+RESULT_FIELDS = ["user_id", "merchant", "pattern_type", "reason", "confidence"]
+# Columns triage and the prompts use; nothing else is read from the input
+SEQUENCE_COLUMNS = ["user_id", "merchant", "timestamp", "amount", "description", "category"]
+
+
+class TokenBucket:
+    """Allows `rate` sequences per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        n = min(n, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait_for = (n - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+def iter_sequences(df, skip=(), only=None):
+    """
+    Stream (user, merchant) timelines in time order.
+    Sorting once up front is much cheaper than sorting every group separately.
+    """
+    df = df.sort_values(['user_id', 'merchant', 'timestamp'], kind='stable')
+    # 1. Group data by User and Merchant
+    # This creates timelines of interaction: User A interacting with Netflix, User A with Spotify, etc.
+    for (user, merchant), group in df.groupby(['user_id', 'merchant'], sort=False):
+        # We only care about sequences with potential history (e.g. > 1 transaction)
+        # unless it's a known 'hit and run' type, but for this demo, history is key.
+        if len(group) >= 2 and (user, merchant) not in skip and (only is None or (user, merchant) in only):
+            yield {
+                "user": user,
+                "merchant": merchant,
+                "transactions": group.to_dict('records')
+            }
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# --- WORKERS ---
+# Each worker process loads its own detector once; with a merged checkpoint
+# (export_merged_model.py) the weights are memory-mapped and shared.
+_detector = None
+
+
+def _init_worker(backend, detector_kwargs):
+    global _detector
+    if backend == "local":
+        from detector import PatternDetector
+        _detector = PatternDetector(**detector_kwargs)
+    else:
+        from remote_detector import RemoteDetector
+        _detector = RemoteDetector()
+
+
+def _analyze_chunk(chunk, batch_size):
+    analyses = _detector.analyze_batch([seq['transactions'] for seq in chunk], batch_size=batch_size)
+    return [(seq['user'], seq['merchant'], analysis) for seq, analysis in zip(chunk, analyses)]
+
+
+class _RemotePool:
+    """Thread pool for network-bound backends; one shared detector holds the HTTP session."""
+
+    def __init__(self, workers):
+        _init_worker("remote", {})
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(self, fn, *args):
+        return self.executor.submit(fn, *args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+def load_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                user, _, merchant = line.rstrip("\n").partition("\t")
+                if merchant:
+                    done.add((user, merchant))
+    return done
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m{seconds % 60:02d}s"
+
 
 def main():
     parser = argparse.ArgumentParser(description="Flag predatory transactions using Watsonx.ai")
-    parser.add_argument("input_file", help="Path to input CSV file")
+    parser.add_argument("input_file", help="Path to input CSV file (its txn_store.py Parquet copy is used if present)")
     parser.add_argument("--output", default="flagged_report.csv", help="Path to output CSV")
-    parser.add_argument("--limit", type=int, default=10, help="Max number of sequences to analyze (for demo speed)")
+    parser.add_argument("--limit", type=int, default=None, help="Max number of sequences to analyze (default: all)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Sequences generated together per model call")
+    parser.add_argument("--backend", choices=["local", "remote"], default="local",
+                        help="local: Granite + LoRA in worker processes; remote: watsonx.ai text generation in threads")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (local, default 1) or threads (remote, default 8)")
+    parser.add_argument("--rate", type=float, default=None, help="Max sequences per second across all workers (default: unlimited)")
+    parser.add_argument("--merged-path", default=None, help="Merged checkpoint from export_merged_model.py (local backend)")
+    parser.add_argument("--quantize", choices=["int8"], default=None, help="Dynamic quantization for the local model")
+    parser.add_argument("--checkpoint", default=None, help="Progress file (default: <output>.checkpoint)")
+    parser.add_argument("--resume", action="store_true", help="Skip sequences already recorded in the checkpoint")
+    parser.add_argument("--no-triage", action="store_true",
+                        help="Send every sequence to the model instead of only those the rules cannot decide")
+    parser.add_argument("--cache", default="verdict_cache.db", help="Persistent verdict cache (SQLite)")
+    parser.add_argument("--cache-size", type=int, default=1_000_000, help="Max cached verdicts (least recently used evicted)")
+    parser.add_argument("--no-cache", action="store_true", help="Always generate, never read or write the verdict cache")
+    parser.add_argument("--users", default=None,
+                        help="Comma-separated user_ids to analyze (pushed down to the Parquet reader)")
     args = parser.parse_args()
 
-    if not os.path.exists(args.input_file):
+    if not os.path.exists(args.input_file) and not os.path.exists(parquet_path(args.input_file)):
         print(f"Error: File {args.input_file} not found.")
         sys.exit(1)
 
+    checkpoint_path = args.checkpoint or args.output + ".checkpoint"
+    done = load_checkpoint(checkpoint_path) if args.resume else set()
+    if done:
+        print(f"Resuming: {len(done)} sequences already analyzed.")
+
     print(f"Loading data from {args.input_file}...")
-    df = pd.read_csv(args.input_file)
-    
-    # 1. Group data by User and Merchant
-    # This creates timelines of interaction: User A interacting with Netflix, User A with Spotify, etc.
-    grouped = df.groupby(['user_id', 'merchant'])
-    
-    sequences_to_check = []
-    
-    for (user, merchant), group in grouped:
-        # We only care about sequences with potential history (e.g. > 1 transaction)
-        # unless it's a known 'hit and run' type, but for this demo, history is key.
-        if len(group) >= 2:
-            # Sort by time
-            sorted_txns = group.sort_values("timestamp").to_dict('records')
-            sequences_to_check.append({
-                "user": user,
-                "merchant": merchant,
-                "transactions": sorted_txns
-            })
-    
-    print(f"Found {len(sequences_to_check)} transaction sequences.")
-    
+    filters = [("user_id", "in", args.users.split(","))] if args.users else None
+    df = read_transactions(args.input_file, columns=SEQUENCE_COLUMNS, filters=filters)
+
+    sizes = df.groupby(['user_id', 'merchant']).size()
+    total = int((sizes >= 2).sum())
+    print(f"Found {total} transaction sequences.")
+
+    # Rule triage: clear-cut sequences are decided here, only uncertain ones reach the model
+    decisions = None
+    only = None
+    remaining = total - len(done)
+    if not args.no_triage:
+        triage_start = time.time()
+        decisions = triage(df)
+        decisions = decisions[[key not in done for key in zip(decisions['user_id'], decisions['merchant'])]]
+        stage = summarize(decisions)
+        print(f"Triage ({time.time() - triage_start:.1f}s): {stage['safe']} safe, "
+              f"{stage['predatory']} predatory by rule, {stage['uncertain']} sent to the model "
+              f"({stage['llm_avoided_pct']}% of model work avoided).")
+        uncertain = decisions[decisions['decision'] == UNCERTAIN]
+        only = set(zip(uncertain['user_id'], uncertain['merchant']))
+        remaining = len(only)
+    if args.limit is not None:
+        remaining = min(remaining, args.limit)
+
     # Initialize Model
-    # Note: Expects WATSONX_API_KEY and WATSONX_PROJECT_ID env vars
+    workers = args.workers or (1 if args.backend == "local" else 8)
     try:
-        detector = PatternDetector()
+        if args.backend == "local":
+            detector_kwargs = {"merged_path": args.merged_path, "quantize": args.quantize}
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=("local", detector_kwargs))
+        else:
+            pool = _RemotePool(workers)
     except Exception as e:
         print(f"Warning: Could not initialize Watsonx.ai client ({e}).")
         print("Ensure 'ibm-watsonx-ai' is installed and env vars are set.")
         sys.exit(1)
 
-    results = []
-    count = 0
-    
-    print(f"Analyzing top {args.limit} sequences...")
-    
-    for seq in sequences_to_check:
-        if count >= args.limit:
-            break
-            
-        print(f"Analyzing {seq['user']} @ {seq['merchant']}...")
-        
-        # Call the model
-        analysis = detector.analyze_sequence(seq['transactions'])
-        
+    limiter = TokenBucket(args.rate) if args.rate else None
+
+    cache = None
+    if not args.no_cache:
+        if args.backend == "local":
+            from detector import model_identity
+            identity = model_identity(merged_path=args.merged_path, quantize=args.quantize)
+        else:
+            from remote_detector import remote_identity
+            identity = remote_identity()
+        cache = VerdictCache(args.cache, identity=identity, max_entries=args.cache_size)
+        if cache.invalidated:
+            print(f"Verdict cache: model changed, dropped {cache.invalidated} stale verdicts.")
+
+    # Results stream to disk as they finish; the checkpoint records every analyzed sequence
+    # (failed calls are left out so --resume retries them)
+    write_header = not (args.resume and os.path.exists(args.output))
+    out_file = open(args.output, "a" if args.resume else "w", newline="")
+    writer = csv.DictWriter(out_file, fieldnames=RESULT_FIELDS)
+    if write_header:
+        writer.writeheader()
+    checkpoint = open(checkpoint_path, "a" if args.resume else "w")
+
+    rule_flagged = 0
+    if decisions is not None:
+        decided = decisions[decisions['decision'] != UNCERTAIN]
+        for row in decided.itertuples(index=False):
+            if row.decision == PREDATORY:
+                writer.writerow({
+                    "user_id": row.user_id,
+                    "merchant": row.merchant,
+                    "pattern_type": row.pattern_type,
+                    "reason": row.reason,
+                    "confidence": "High (rule)",
+                })
+                rule_flagged += 1
+            checkpoint.write(f"{row.user_id}\t{row.merchant}\n")
+        out_file.flush()
+        checkpoint.flush()
+
+    print(f"Analyzing {remaining} sequences with {workers} {args.backend} worker(s)...")
+    sequences = iter_sequences(df, skip=done, only=only)
+    if args.limit is not None:
+        sequences = (seq for i, seq in zip(range(args.limit), sequences))
+
+    start = time.time()
+    analyzed = 0
+    flagged = 0
+    failed = 0
+    last_report = 0.0
+    in_flight = set()
+    cache_keys = {}
+    max_in_flight = workers * 2
+
+    def record(user, merchant, analysis):
+        nonlocal analyzed, flagged, failed
+        if analysis.get("pattern_type") in UNCACHEABLE_TYPES:
+            # A failed call (rate limit, timeout, auth, unparseable reply) says nothing about the sequence
+            print(f"  [x] FAILED {user} @ {merchant}: {analysis.get('reason')}")
+            failed += 1
+            return
         if analysis.get("is_predatory"):
-            print(f"  [!] FLAGGED: {analysis.get('pattern_type')}")
-            results.append({
-                "user_id": seq['user'],
-                "merchant": seq['merchant'],
+            print(f"  [!] FLAGGED {user} @ {merchant}: {analysis.get('pattern_type')}")
+            writer.writerow({
+                "user_id": user,
+                "merchant": merchant,
                 "pattern_type": analysis.get("pattern_type"),
                 "reason": analysis.get("reason"),
                 "confidence": "High" # Granite doesn't give confidence score by default in this simple mode
             })
-        else:
-            print("  [OK] Clean")
-            
-        count += 1
-        # Rate limit protection for demo
-        time.sleep(0.5)
-
-    # Save results
-    if results:
-        res_df = pd.DataFrame(results)
-        res_df.to_csv(args.output, index=False)
-        print(f"\nAnalysis complete. Found {len(results)} flags. Saved to {args.output}.")
+            flagged += 1
+        checkpoint.write(f"{user}\t{merchant}\n")
+        analyzed += 1
+
+    def collect(finished):
+        nonlocal last_report
+        for future in finished:
+            results = future.result()
+            for user, merchant, analysis in results:
+                record(user, merchant, analysis)
+            if cache is not None:
+                cache.put_many(zip(cache_keys.pop(future), (analysis for _, _, analysis in results)))
+        out_file.flush()
+        checkpoint.flush()
+
+        now = time.time()
+        processed = analyzed + failed
+        if now - last_report >= 5 or processed == remaining:
+            last_report = now
+            rate = processed / max(now - start, 1e-9)
+            eta = (remaining - processed) / rate if rate > 0 else 0
+            print(f"Progress: {processed}/{remaining} ({rate:.2f} seq/s, ETA {format_eta(eta)}), "
+                  f"{flagged} flagged, {failed} failed")
+
+    try:
+        for chunk in chunked(sequences, args.batch_size):
+            keys = None
+            if cache is not None:
+                # Unchanged histories are answered from the cache without generating
+                keys = [cache.key(build_prompt(seq['transactions'])) for seq in chunk]
+                cached = cache.get_many(keys)
+                for seq, analysis in zip(chunk, cached):
+                    if analysis is not None:
+                        record(seq['user'], seq['merchant'], analysis)
+                if any(analysis is not None for analysis in cached):
+                    collect([])
+                chunk = [seq for seq, analysis in zip(chunk, cached) if analysis is None]
+                keys = [key for key, analysis in zip(keys, cached) if analysis is None]
+                if not chunk:
+                    continue
+            if limiter:
+                limiter.acquire(len(chunk))
+            future = pool.submit(_analyze_chunk, chunk, args.batch_size)
+            in_flight.add(future)
+            cache_keys[future] = keys
+            # Bounded queue: the producer only runs ahead of the workers by a little
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(finished)
+    except BrokenProcessPool as e:
+        print(f"Error: a model worker died ({e}). Re-run with --resume to continue.")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nInterrupted. Re-run with --resume to continue.")
+        sys.exit(1)
+    finally:
+        pool.shutdown()
+        out_file.close()
+        checkpoint.close()
+        if cache is not None:
+            cache.close()
+
+    elapsed = time.time() - start
+    flagged += rule_flagged
+    cache_hits = cache.hits if cache is not None else 0
+    if decisions is not None:
+        print(f"\nStages: {len(decisions)} triaged, {rule_flagged} flagged by rule, "
+              f"{cache_hits} answered from cache, {analyzed - cache_hits} analyzed by the model.")
+    if cache is not None:
+        print(f"Verdict cache: {cache.stats()}")
+    if flagged:
+        print(f"\nAnalysis complete. Analyzed {analyzed} sequences in {elapsed:.0f}s. "
+              f"Found {flagged} flags. Saved to {args.output}.")
     else:
-        print("\nAnalysis complete. No predatory patterns flagged in the sampled batch.")
+        print(f"\nAnalysis complete. Analyzed {analyzed} sequences in {elapsed:.0f}s. No predatory patterns flagged.")
+    if failed:
+        print(f"{failed} sequences failed and were not checkpointed. Re-run with --resume to retry them.")
 
 if __name__ == "__main__":
     main()
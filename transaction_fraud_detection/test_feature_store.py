@@ -0,0 +1,36 @@
+from feature_store import FeatureStateStore
+from guardrails import GuardrailEngine
+
+
+def charge(timestamp, amount=15.49):
+    return {"user_id": "user_1", "merchant": "StreamFlix", "amount": amount, "timestamp": timestamp}
+
+
+def test_in_order_repeat_is_double_billing(tmp_path):
+    store = FeatureStateStore(str(tmp_path / "state.db"))
+    store.observe(charge("2026-01-01T10:00:00"))
+    features = store.observe(charge("2026-01-01T10:05:00"))
+    store.close()
+
+    assert features["is_quick_charge"] and features["same_amount"]
+    rule = GuardrailEngine().evaluate(dict(features, category="Entertainment"))
+    assert rule is not None and rule.name == "double_billing"
+
+
+def test_out_of_order_charge_is_not_flagged(tmp_path):
+    store = FeatureStateStore(str(tmp_path / "state.db"))
+    store.observe(charge("2026-01-01T10:00:00"))
+    store.observe(charge("2026-03-01T10:00:00"))
+    # Arrives after the March charge but happened in February
+    late = store.observe(charge("2026-02-01T10:00:00"))
+    state = store.get_state("user_1", "StreamFlix")
+    store.close()
+
+    assert late["days_diff"] == 0.0
+    assert not late["is_quick_charge"]
+    assert not late["same_amount"]
+    assert late["price_change_pct"] == 0.0
+    assert GuardrailEngine().evaluate(dict(late, category="Entertainment")) is None
+    # The late charge is counted but does not rewind the state
+    assert state.txn_count == 3
+    assert state.last_ts > state.first_ts
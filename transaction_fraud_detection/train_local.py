@@ -1,137 +1,397 @@
+import argparse
+import bisect
+import glob
 import os
 import json
+import resource
+import time
 import torch
 from datasets import Dataset
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
+    TrainerCallback,
     TrainingArguments,
     Trainer,
-    DataCollatorForLanguageModeling
 )
+from transformers.trainer_pt_utils import LengthGroupedSampler
+from transformers.trainer_utils import PREFIX_CHECKPOINT_DIR
 from peft import LoraConfig, get_peft_model, TaskType
 
+from detector import resident_memory_mb
+from prompts import training_text
+
 # Configuration
 # Granite 3.1 MoE (3B params, 800M active)
 MODEL_NAME = "ibm-granite/granite-3.1-3b-a800m-instruct"
 OUTPUT_DIR = "predatory-patterns-lora"
 TRAIN_FILE = "train_micro.jsonl"
 NUM_EPOCHS = 1
-BATCH_SIZE = 1 # Small batch size for Mac memory safety
+# Samples (or packed blocks) per step; batches are only padded to their longest
+# sample, so this no longer costs max_length tokens per sample
+BATCH_SIZE = 4
+GRADIENT_ACCUMULATION_STEPS = 1
+MAX_LENGTH = 512
+
+# How samples are laid out in a batch:
+#   max_length - every sample padded to MAX_LENGTH (the old layout, kept to compare against)
+#   dynamic    - padded to the longest sample in the batch, batches grouped by length
+#   packed     - several samples per MAX_LENGTH row, each attending only to itself
+PADDING_MODES = ["max_length", "dynamic", "packed"]
+DEFAULT_PADDING = "dynamic"
+# Label of tokens that take no part in the loss (prompt and padding)
+IGNORE_INDEX = -100
+LOGGING_STEPS = 10
+# Checkpoints kept in OUTPUT_DIR when saving every --save-steps
+SAVE_TOTAL_LIMIT = 3
+# bf16 autocast: "auto" turns it on only where the CPU has native bf16 math
+BF16_MODES = ["auto", "on", "off"]
+BF16_CPU_FLAGS = {"avx512_bf16", "amx_bf16"}
+ADAPTER_WEIGHTS = ["adapter_model.safetensors", "adapter_model.bin"]
+
 
 def format_instruction(sample):
+    """Prompt + answer text for one train.jsonl sample (see prompts.training_text())."""
+    return training_text(sample)
+
+
+def training_files(path):
+    """path itself, or its training_set.py shards (path-00000.jsonl, ...)."""
+    if os.path.exists(path):
+        return [path]
+    root, ext = os.path.splitext(path)
+    shards = sorted(glob.glob(f"{glob.escape(root)}-[0-9][0-9][0-9][0-9][0-9]{ext}"))
+    if not shards:
+        raise FileNotFoundError(f"No training data at {path} (or {root}-00000{ext}, ...)")
+    return shards
+
+
+def tokenize_samples(examples, tokenizer):
+    """
+    datasets.map() function (batched): input_ids = prompt + answer + eos, with
+    labels only on the answer and eos so the loss covers just the JSON verdict.
+    """
+    samples = [dict(zip(examples, values)) for values in zip(*examples.values())]
+    prompts = [training_text(dict(sample, output="")) for sample in samples]
+    prompt_ids = tokenizer(prompts)["input_ids"]
+    answer_ids = tokenizer([sample["output"] for sample in samples], add_special_tokens=False)["input_ids"]
+
+    batch = {"input_ids": [], "labels": [], "length": []}
+    for prompt, answer in zip(prompt_ids, answer_ids):
+        answer = answer + [tokenizer.eos_token_id]
+        batch["input_ids"].append(prompt + answer)
+        batch["labels"].append([IGNORE_INDEX] * len(prompt) + answer)
+        batch["length"].append(len(prompt) + len(answer))
+    return batch
+
+
+def pack_samples(dataset, max_length):
+    """
+    Best-fit-decreasing packing of tokenized samples into rows of at most
+    max_length tokens. position_ids restart at 0 for every sample, which is
+    how the model tells packed samples apart: with no attention_mask, each
+    token only attends to earlier tokens of its own sample.
+    """
+    lengths = dataset["length"]
+    all_input_ids, all_labels = dataset["input_ids"], dataset["labels"]
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    blocks = []
+    # (free space, block number) of every block, sorted by free space
+    free = []
+    for i in order:
+        slot = bisect.bisect_left(free, (lengths[i], -1))
+        if slot < len(free):
+            space, b = free.pop(slot)
+        else:
+            space, b = max_length, len(blocks)
+            blocks.append([])
+        blocks[b].append(i)
+        bisect.insort(free, (space - lengths[i], b))
+
+    packed = {"input_ids": [], "labels": [], "position_ids": [], "length": []}
+    for block in blocks:
+        input_ids, labels, position_ids = [], [], []
+        for i in block:
+            input_ids += all_input_ids[i]
+            # The first token of a sample is prompt, so no label crosses a boundary
+            labels += [IGNORE_INDEX] + all_labels[i][1:]
+            position_ids += range(lengths[i])
+        packed["input_ids"].append(input_ids)
+        packed["labels"].append(labels)
+        packed["position_ids"].append(position_ids)
+        packed["length"].append(len(input_ids))
+    return Dataset.from_dict(packed)
+
+
+class PaddingCollator:
+    """
+    Pads a batch to its longest row (or to pad_to), right-aligned, with no
+    loss on padding. Rows from pack_samples() keep their position_ids and get
+    no attention_mask; their padding is numbered as one more sample so it
+    stays out of every real sample's attention. Counts real and padded
+    tokens for ThroughputCallback.
+    """
+
+    def __init__(self, pad_token_id, pad_to=None):
+        self.pad_token_id = pad_token_id
+        self.pad_to = pad_to
+        self.tokens = 0
+        self.padded_tokens = 0
+
+    def __call__(self, features):
+        width = self.pad_to or max(len(f["input_ids"]) for f in features)
+        packed = "position_ids" in features[0]
+        batch = {"input_ids": [], "labels": []}
+        batch["position_ids" if packed else "attention_mask"] = []
+        for f in features:
+            n = len(f["input_ids"])
+            pad = width - n
+            batch["input_ids"].append(f["input_ids"] + [self.pad_token_id] * pad)
+            batch["labels"].append(f["labels"] + [IGNORE_INDEX] * pad)
+            if packed:
+                batch["position_ids"].append(f["position_ids"] + list(range(pad)))
+            else:
+                batch["attention_mask"].append([1] * n + [0] * pad)
+            self.tokens += n
+        self.padded_tokens += width * len(features)
+        return {key: torch.tensor(value, dtype=torch.long) for key, value in batch.items()}
+
+
+def padding_ratio(row_lengths, batches):
+    """Share of padding when each batch (row indices) is padded to its longest row."""
+    real = sum(row_lengths)
+    total = sum(max(row_lengths[i] for i in batch) * len(batch) for batch in batches)
+    return 1 - real / total if total else 0.0
+
+
+def report_padding(lengths, packed_lengths, batch_size, max_length):
+    """Padding ratio of every layout for this dataset, printed before training."""
+    def batches(order):
+        return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+    shuffled = torch.randperm(len(lengths)).tolist()
+    grouped = list(LengthGroupedSampler(batch_size * GRADIENT_ACCUMULATION_STEPS, lengths=lengths))
+    old = 1 - sum(lengths) / (len(lengths) * max_length) if lengths else 0.0
+    print(f"Padding ratio with batches of {batch_size}:")
+    print(f"  max_length (old):         {old:.1%}")
+    print(f"  dynamic, random order:    {padding_ratio(lengths, batches(shuffled)):.1%}")
+    print(f"  dynamic, grouped:         {padding_ratio(lengths, batches(grouped)):.1%}")
+    if packed_lengths:
+        rows = torch.randperm(len(packed_lengths)).tolist()
+        print(f"  packed ({len(lengths)} samples in {len(packed_lengths)} rows): "
+              f"{padding_ratio(packed_lengths, batches(rows)):.1%}")
+
+
+def cpu_supports_bf16():
+    """True when the CPU does bf16 matmuls natively (AVX512-BF16 or AMX); elsewhere autocast only emulates it."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return bool(BF16_CPU_FLAGS & set(line.split()))
+    except OSError:
+        pass
+    return False
+
+
+def set_threads(threads=None, interop_threads=None):
+    """torch intra-op / inter-op thread counts (None keeps torch's default)."""
+    if threads:
+        torch.set_num_threads(threads)
+    if interop_threads:
+        # Only possible before torch starts any parallel work
+        torch.set_num_interop_threads(interop_threads)
+    print(f"torch threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op "
+          f"({os.cpu_count()} CPUs)")
+
+
+def latest_checkpoint(output_dir):
+    """
+    Newest checkpoint-N in output_dir that can be resumed from, or None.
+    Checkpoints without adapter weights (like a checkpoint committed without
+    its weights) are reported and skipped.
+    """
+    if not os.path.isdir(output_dir):
+        return None
+    steps = {}
+    for name in os.listdir(output_dir):
+        prefix, _, step = name.partition("-")
+        if prefix == PREFIX_CHECKPOINT_DIR and step.isdigit() and os.path.isdir(os.path.join(output_dir, name)):
+            steps[int(step)] = os.path.join(output_dir, name)
+    for step in sorted(steps, reverse=True):
+        path = steps[step]
+        if any(os.path.exists(os.path.join(path, weights)) for weights in ADAPTER_WEIGHTS):
+            return path
+        print(f"Warning: {path} has no adapter weights; not resuming from it.")
+    return None
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ThroughputCallback(TrainerCallback):
     """
-    Format the sample into a ChatML-like or Alpaca-like prompt.
-    TinyLlama Chat expects specific chat templates, but for simplicity
-    we will stick to a clear Input/Output structure.
+    Prints tokens/sec, the padding ratio and memory use since the start of
+    this run at every log step and at the end.
     """
-    return f"""<|system|>
-You are a financial pattern detection AI.
-<|user|>
-{sample['instruction']}
 
-CONTEXT:
-{sample['input']}
-<|assistant|>
-{sample['output']}"""
+    def __init__(self, collator):
+        self.collator = collator
+
+    def on_train_begin(self, args, state, control, **kwargs):
+        self.start = time.time()
+        # A resumed run starts past step 0
+        self.first_step = state.global_step
+
+    def _line(self, state):
+        elapsed = time.time() - self.start
+        tokens, padded = self.collator.tokens, self.collator.padded_tokens
+        steps = state.global_step - self.first_step
+        return (f"{tokens / elapsed:,.0f} tokens/s ({padded / elapsed:,.0f} incl. padding), "
+                f"padding {1 - tokens / max(padded, 1):.1%}, {elapsed / max(steps, 1):.2f}s/step, "
+                f"RSS {resident_memory_mb():,.0f} MB (peak {peak_memory_mb():,.0f} MB)")
+
+    def on_log(self, args, state, control, logs=None, **kwargs):
+        print(f"[step {state.global_step}/{state.max_steps}] {self._line(state)}")
+
+    def on_train_end(self, args, state, control, **kwargs):
+        print(f"Trained on {self.collator.tokens:,} tokens in {time.time() - self.start:.1f}s: "
+              f"{self._line(state)}")
+
 
 def main():
-    print(f"Loading data from {TRAIN_FILE}...")
+    parser = argparse.ArgumentParser(description="LoRA fine-tune Granite on the predatory-pattern training set")
+    parser.add_argument("--train-file", default=TRAIN_FILE,
+                        help="Training JSONL (or the prefix of its training_set.py shards)")
+    parser.add_argument("--model", default=MODEL_NAME, help="Base model name or path")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Where the adapter and checkpoints go")
+    parser.add_argument("--padding", choices=PADDING_MODES, default=DEFAULT_PADDING,
+                        help="Batch layout (max_length reproduces the old fixed-length batches)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Samples (packed: rows) per device step")
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH,
+                        help="Longest sample kept (and the packed row length)")
+    parser.add_argument("--epochs", type=float, default=NUM_EPOCHS,
+                        help="Total epochs (a resumed run continues towards this)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice)")
+    parser.add_argument("--interop-threads", type=int, default=None, help="torch inter-op threads")
+    parser.add_argument("--bf16", choices=BF16_MODES, default="auto",
+                        help="bf16 autocast (auto: only on CPUs with AVX512-BF16/AMX)")
+    parser.add_argument("--gradient-checkpointing", action="store_true",
+                        help="Recompute activations in the backward pass: less peak memory, about a third more compute")
+    parser.add_argument("--save-steps", type=int, default=None,
+                        help=f"Checkpoint every N steps, keeping the last {SAVE_TOTAL_LIMIT} (default: every epoch)")
+    parser.add_argument("--resume", action="store_true", help="Resume from the latest checkpoint in --output-dir")
+    parser.add_argument("--logging-steps", type=int, default=LOGGING_STEPS, help="Loss and throughput every N steps")
+    args = parser.parse_args()
+
+    set_threads(args.threads, args.interop_threads)
+    bf16 = args.bf16 == "on" or (args.bf16 == "auto" and cpu_supports_bf16())
+    resume_from = None
+    if args.resume:
+        resume_from = latest_checkpoint(args.output_dir)
+        print(f"Resuming from {resume_from}" if resume_from else
+              f"No checkpoint to resume from in {args.output_dir}; starting from scratch.")
+
+    files = training_files(args.train_file)
+    print(f"Loading data from {', '.join(files)}...")
     # Load JSONL
     data = []
-    with open(TRAIN_FILE, "r") as f:
-        for line in f:
-            data.append(json.loads(line))
-            
+    for path in files:
+        with open(path, "r") as f:
+            for line in f:
+                sample = json.loads(line)
+                # training_set.py's num_tokens is recomputed below, with the answer split off
+                sample.pop("num_tokens", None)
+                data.append(sample)
+
     # Convert to HF Dataset
     raw_dataset = Dataset.from_list(data)
-    
-    print(f"Loading tokenizer for {MODEL_NAME}...")
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+
+    print(f"Loading tokenizer for {args.model}...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
     tokenizer.pad_token = tokenizer.eos_token # Fix for padding
-    
-    def preprocess_function(examples):
-        texts = [format_instruction(ex) for ex in examples]
-        encodings = tokenizer(texts, padding="max_length", truncation=True, max_length=512)
-        # For Causal LM, labels are the same as input_ids
-        encodings["labels"] = encodings["input_ids"].copy()
-        return encodings
 
     print("Tokenizing dataset...")
-    # Using 'map' with batched=False for simplicity with list of dicts logic above, 
-    # but actually 'examples' in map is a dict of lists.
-    # Let's adjust preprocess to handle dict of lists
-    def preprocess_batched(examples):
-        # examples is a dict of lists: {'instruction': [...], 'input': [...], ...}
-        output_texts = []
-        for i in range(len(examples['instruction'])):
-            text = f"""<|system|>
-You are a financial pattern detection AI.
-<|user|>
-{examples['instruction'][i]}
-
-CONTEXT:
-{examples['input'][i]}
-<|assistant|>
-{examples['output'][i]}"""
-            output_texts.append(text)
-            
-        encodings = tokenizer(output_texts, padding="max_length", truncation=True, max_length=512)
-        encodings["labels"] = encodings["input_ids"].copy()
-        return encodings
-
-    tokenized_datasets = raw_dataset.map(preprocess_batched, batched=True)
-    
+    tokenized = raw_dataset.map(tokenize_samples, batched=True, remove_columns=raw_dataset.column_names,
+                                fn_kwargs={"tokenizer": tokenizer})
+    # Truncating would cut off the answer, the only part with a loss, so long samples are left out
+    kept = tokenized.filter(lambda length: length <= args.max_length, input_columns="length")
+    if len(kept) < len(tokenized):
+        print(f"Skipping {len(tokenized) - len(kept)} of {len(tokenized)} samples longer than "
+              f"{args.max_length} tokens.")
+    tokenized = kept
+
+    packed = pack_samples(tokenized, args.max_length) if args.padding == "packed" else None
+    report_padding(tokenized["length"], packed["length"] if packed else None, args.batch_size, args.max_length)
+    train_dataset = packed if packed else tokenized
+    collator = PaddingCollator(tokenizer.pad_token_id,
+                               pad_to=args.max_length if args.padding == "max_length" else None)
+
     print("Loading Model (This may take a while)...")
     device = "cpu"
-    print(f"Using device: {device}")
-    
+    print(f"Using device: {device}, bf16 autocast: {'on' if bf16 else 'off'}, "
+          f"gradient checkpointing: {'on' if args.gradient_checkpointing else 'off'}")
+
+    # Weights stay float32 (bf16 only inside autocast), so LoRA updates keep full precision
     model = AutoModelForCausalLM.from_pretrained(
-        MODEL_NAME, 
+        args.model,
         device_map=device,
-        torch_dtype=torch.float32
+        dtype=torch.float32
     )
-    
+
     # Configure LoRA
     print("Applying LoRA adapters...")
     peft_config = LoraConfig(
-        task_type=TaskType.CAUSAL_LM, 
-        inference_mode=False, 
-        r=8, 
-        lora_alpha=32, 
+        task_type=TaskType.CAUSAL_LM,
+        inference_mode=False,
+        r=8,
+        lora_alpha=32,
         lora_dropout=0.1,
         target_modules=["q_proj", "v_proj"]
     )
     model = get_peft_model(model, peft_config)
     model.print_trainable_parameters()
-    
+
     # Training Arguments
     training_args = TrainingArguments(
-        output_dir=OUTPUT_DIR,
-        num_train_epochs=NUM_EPOCHS,
-        per_device_train_batch_size=BATCH_SIZE,
-        gradient_accumulation_steps=4,
+        output_dir=args.output_dir,
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.batch_size,
+        gradient_accumulation_steps=GRADIENT_ACCUMULATION_STEPS,
         learning_rate=2e-4,
-        logging_steps=10,
-        save_strategy="epoch",
+        logging_steps=args.logging_steps,
+        save_strategy="steps" if args.save_steps else "epoch",
+        save_steps=args.save_steps or 500,
+        save_total_limit=SAVE_TOTAL_LIMIT if args.save_steps else None,
         fp16=False,
-        use_mps_device=True if device=="mps" else False,
+        use_cpu=device == "cpu",
+        bf16=bf16,
+        gradient_checkpointing=args.gradient_checkpointing,
+        # The non-reentrant variant needs no grad on the (frozen) embeddings' output
+        gradient_checkpointing_kwargs={"use_reentrant": False},
+        # Batches of similar length pad less; packed rows are already close to max_length
+        train_sampling_strategy="group_by_length" if args.padding == "dynamic" else "random",
+        # Keeps the "length" column for the sampler; the collator only passes on model inputs
+        remove_unused_columns=False,
         dataloader_num_workers=0, # Critical for Mac to prevent hangs
         dataloader_pin_memory=False # Fixes warning and potential MPS issues
     )
-    
+
     trainer = Trainer(
         model=model,
         args=training_args,
-        train_dataset=tokenized_datasets,
-        data_collator=DataCollatorForLanguageModeling(tokenizer, mlm=False),
+        train_dataset=train_dataset,
+        data_collator=collator,
+        callbacks=[ThroughputCallback(collator)],
     )
-    
+
     print("Starting Training...")
-    trainer.train()
-    
-    print(f"Training complete. Saving model to {OUTPUT_DIR}...")
-    trainer.save_model(OUTPUT_DIR)
-    
+    trainer.train(resume_from_checkpoint=resume_from)
+
+    print(f"Training complete. Saving model to {args.output_dir}...")
+    trainer.save_model(args.output_dir)
+
 if __name__ == "__main__":
     main()
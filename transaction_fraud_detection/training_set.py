@@ -0,0 +1,188 @@
+import argparse
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from prompts import INSTRUCTION, training_text
+from triage import PATTERNS
+from txn_store import read_transactions
+
+# train.jsonl for train_local.py: one sample per (user, merchant) history of at
+# least MIN_HISTORY charges, labelled with its highest-priority predatory pattern
+# (triage.PATTERNS order). Samples are written out as they are built, optionally
+# split over shard files, and each records num_tokens (its training_text()
+# length under the training tokenizer) so training can batch by length.
+
+SAMPLE_COLUMNS = ['user_id', 'merchant', 'timestamp', 'amount', 'description', 'pattern_label']
+NORMAL_REASON = "Transactions show normal consistent activity."
+MIN_HISTORY = 2
+# The tokenizer train_local.py fine-tunes with, saved next to the adapter
+DEFAULT_TOKENIZER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "predatory-patterns-lora")
+# Samples built and tokenized together
+BATCH_SAMPLES = 1024
+
+
+def token_counter(name_or_path=DEFAULT_TOKENIZER):
+    """texts -> token counts, or None (with a warning) if the tokenizer cannot be loaded."""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(name_or_path)
+    except (ImportError, OSError, ValueError) as e:
+        print(f"Warning: could not load tokenizer {name_or_path} ({e}); samples will have no num_tokens.")
+        return None
+
+    def count(texts):
+        return [len(ids) for ids in tokenizer(texts)["input_ids"]]
+    return count
+
+
+def _verdict_outputs():
+    """Output JSON for "no pattern" followed by each PATTERNS entry."""
+    verdicts = [(False, "None", NORMAL_REASON)] + [(True, name, reason) for _, name, reason in PATTERNS]
+    return [json.dumps({"is_predatory": p, "pattern_type": name, "reason": reason}) for p, name, reason in verdicts]
+
+
+OUTPUTS = _verdict_outputs()
+# A predatory label outside PATTERNS is still predatory, with the normal wording
+OTHER_PREDATORY = json.dumps({"is_predatory": True, "pattern_type": "None", "reason": NORMAL_REASON})
+
+
+def iter_samples(df):
+    """
+    Training samples for every (user, merchant) history in df, in (user,
+    merchant) order. df must hold each history in full.
+    """
+    df = df[SAMPLE_COLUMNS].sort_values(['user_id', 'merchant', 'timestamp'], kind='stable')
+    users = df['user_id'].to_numpy()
+    merchants = df['merchant'].to_numpy()
+    new_group = np.ones(len(df), dtype=bool)
+    new_group[1:] = (users[1:] != users[:-1]) | (merchants[1:] != merchants[:-1])
+    starts = np.flatnonzero(new_group)
+    stops = np.append(starts[1:], len(df))
+    if len(starts) == 0:
+        return
+
+    # {"date": ..., "amt": ..., "desc": ...} per charge, as json.dumps would write it
+    dates = np.datetime_as_string(pd.to_datetime(df['timestamp']).to_numpy().astype('datetime64[D]'))
+    codes, uniques = pd.factorize(df['description'])
+    descs = np.array([json.dumps(d) for d in uniques] + ["null"], dtype=object)[codes]
+    rows = ('{"date": "' + dates.astype(object) + '", "amt": ' + df['amount'].astype(str).to_numpy(dtype=object)
+            + ', "desc": ' + descs + '}')
+
+    # Highest-priority pattern per history: index into OUTPUTS (0 = none)
+    labels = df['pattern_label'].to_numpy(dtype=str)
+    predatory = np.logical_or.reduceat(np.char.startswith(labels, 'predatory'), starts)
+    verdict = np.zeros(len(starts), dtype=np.int64)
+    for i, (key, _, _) in enumerate(PATTERNS, start=1):
+        has = np.logical_or.reduceat(labels == f"predatory_{key}", starts)
+        verdict[(verdict == 0) & has] = i
+
+    for g in np.flatnonzero(stops - starts >= MIN_HISTORY):
+        start, stop = starts[g], stops[g]
+        if verdict[g]:
+            output = OUTPUTS[verdict[g]]
+        else:
+            output = OTHER_PREDATORY if predatory[g] else OUTPUTS[0]
+        yield {"instruction": INSTRUCTION, "input": "[" + ", ".join(rows[start:stop]) + "]", "output": output}
+
+
+class TrainingSetWriter:
+    """
+    Streams samples to `path`, or with shard_samples to path-00000.jsonl,
+    path-00001.jsonl, ... of at most that many samples each. Token counts come
+    from count_tokens (see token_counter()); without it num_tokens is left out.
+    """
+
+    def __init__(self, path, shard_samples=None, count_tokens=None):
+        self.path = path
+        self.shard_samples = shard_samples
+        self.count_tokens = count_tokens
+        self.samples = 0
+        self.files = []
+        self._file = None
+        self._in_file = 0
+        self._token_counts = []
+        if shard_samples:
+            # Shards left over from a bigger earlier run would silently join the set
+            root, ext = os.path.splitext(path)
+            for old in glob.glob(f"{glob.escape(root)}-*{ext}"):
+                if re.fullmatch(r"-\d{5}", old[len(root):len(old) - len(ext)]):
+                    os.remove(old)
+
+    def _next_file(self):
+        if self._file:
+            self._file.close()
+        path = self.path
+        if self.shard_samples:
+            root, ext = os.path.splitext(self.path)
+            path = f"{root}-{len(self.files):05d}{ext}"
+        self._file = open(path, "w")
+        self._in_file = 0
+        self.files.append(path)
+
+    def _write_batch(self, batch):
+        counts = self.count_tokens([training_text(s) for s in batch]) if self.count_tokens else None
+        for i, sample in enumerate(batch):
+            if self._file is None or (self.shard_samples and self._in_file >= self.shard_samples):
+                self._next_file()
+            if counts is not None:
+                sample["num_tokens"] = counts[i]
+            self._file.write(json.dumps(sample) + "\n")
+            self._in_file += 1
+        self.samples += len(batch)
+        if counts is not None:
+            self._token_counts.append(np.asarray(counts, dtype=np.int32))
+
+    def write_frame(self, df):
+        """Samples for every history in df (which must hold each history in full)."""
+        batch = []
+        for sample in iter_samples(df):
+            batch.append(sample)
+            if len(batch) >= BATCH_SAMPLES:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+
+    def close(self):
+        if self._file is None:
+            self._next_file()
+        self._file.close()
+        where = self.files[0] if len(self.files) == 1 else f"{len(self.files)} files ({self.files[0]}, ...)"
+        print(f"Saved {self.samples} training examples to {where}")
+        if self._token_counts:
+            counts = np.concatenate(self._token_counts)
+            p50, p95 = np.percentile(counts, [50, 95])
+            print(f"Tokens per sample: median {p50:.0f}, p95 {p95:.0f}, max {counts.max()} "
+                  f"({counts.sum():,} total)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the LoRA training set (JSONL) from mock transactions")
+    parser.add_argument("input_file", nargs="?", default="mock_transactions.csv",
+                        help="Transactions with pattern_label (CSV, or its txn_store.py Parquet copy)")
+    parser.add_argument("--output", default="train.jsonl", help="Training set path")
+    parser.add_argument("--shard-samples", type=int, default=None,
+                        help="Split into <output>-00000.jsonl, ... of this many samples each")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER, help="Tokenizer for num_tokens")
+    parser.add_argument("--no-token-counts", action="store_true", help="Skip num_tokens (no tokenizer needed)")
+    args = parser.parse_args()
+
+    count_tokens = None if args.no_token_counts else token_counter(args.tokenizer)
+    print(f"Generating training dataset ({args.output})...")
+    with TrainingSetWriter(args.output, args.shard_samples, count_tokens) as writer:
+        writer.write_frame(read_transactions(args.input_file, columns=SAMPLE_COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import numpy as np
+import pandas as pd
+from guardrails import DB_SAFE_CATEGORIES
+
+# Decisions
+SAFE = "safe"
+PREDATORY = "predatory"
+UNCERTAIN = "uncertain"
+
+# Same names and reasons the training data (generate_mock_data.py) teaches the LLM,
+# in the same priority order.
+PATTERNS = [
+    ("jump", "Price Jump", "Subscription price increased >50%."),
+    ("inactivity", "Inactivity Fee", "Fee charged after long period of inactivity."),
+    ("hidden", "Hidden Subscription", "Trial converted to high recurring fee."),
+    ("creeping", "Creeping Fee", "Subscription cost increased multiple times sequentially."),
+    ("double", "Double Billing", "Duplicate charge for same amount on same day."),
+    ("zombie", "Zombie Subscription", "Recurring charge resumed after >6 months of silence."),
+]
+
+MONTHLY_DAYS = (25, 35)
+DORMANT_DAYS = 90
+JUMP_RATIO = 1.5
+TRIAL_MAX_AMOUNT = 10.0
+TRIAL_RATIO = 5.0
+FEE_RATIO = 0.2
+CREEP_RANGE = (1.03, 1.20)
+CREEP_STEPS = 3
+DOUBLE_SECONDS = 3600
+
+
+def _row_signals(df):
+    """Per-transaction strong and weak pattern signals, all computed column-wise."""
+    keys = [df['user_id'], df['merchant']]
+    grouped = df.groupby(keys, sort=False)
+
+    ts = df['timestamp']
+    amount = df['amount']
+    prev = grouped['amount'].shift(1)
+    prev2 = grouped['amount'].shift(2)
+    gap = (ts - grouped['timestamp'].shift(1)).dt.total_seconds() / 86400
+    pos = grouped.cumcount()
+    size = grouped['amount'].transform('size')
+    risky_category = ~df['category'].isin(DB_SAFE_CATEGORIES)
+
+    ratio = amount / prev
+    same = (amount - prev).abs() < 0.01
+    stable_before = (prev - prev2).abs() < 0.01
+    monthly = gap.between(*MONTHLY_DAYS)
+    # A history where every earlier interval was a monthly one
+    irregular = (~monthly & gap.notna()).astype(int)
+    regular_history = (irregular.groupby(keys, sort=False).cumsum() - irregular == 0) & (pos >= 3)
+
+    # Creeping: a run of small, monthly, consecutive increases
+    creep_step = ratio.gt(CREEP_RANGE[0]) & ratio.le(CREEP_RANGE[1]) & monthly
+    block = (~creep_step).groupby(keys, sort=False).cumsum()
+    creep_run = creep_step.astype(int).groupby([df['user_id'], df['merchant'], block], sort=False).cumsum()
+
+    strong = pd.DataFrame({
+        "jump": stable_before & (ratio >= JUMP_RATIO) & monthly & regular_history,
+        "inactivity": (gap >= DORMANT_DAYS) & (ratio <= FEE_RATIO) & (size == 2) & risky_category,
+        "hidden": (pos == 1) & (size <= 3) & (prev < TRIAL_MAX_AMOUNT) & (ratio >= TRIAL_RATIO)
+                  & (gap <= MONTHLY_DAYS[1]) & risky_category,
+        "creeping": creep_run >= CREEP_STEPS,
+        "double": same & (gap * 86400 <= DOUBLE_SECONDS) & risky_category,
+        "zombie": same & (gap >= DORMANT_DAYS) & regular_history,
+    }, index=df.index)
+
+    # Weaker versions of the same shapes: worth a look, not worth a verdict
+    weak = (
+        (stable_before & (ratio >= JUMP_RATIO))
+        | ((gap >= DORMANT_DAYS) & (ratio < 0.5) & risky_category)
+        | (same & (gap < 1))
+        | (same & (gap > 60))
+        | (creep_run >= 2)
+    )
+    return strong, weak
+
+
+def triage(df):
+    """
+    Classify every (user, merchant) timeline with 2+ transactions as
+    predatory, safe or uncertain. Only uncertain ones need the LLM.
+    Returns one row per sequence: user_id, merchant, decision, pattern_type, reason.
+    """
+    df = df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values(['user_id', 'merchant', 'timestamp'], kind='stable')
+    strong, weak = _row_signals(df)
+
+    keys = [df['user_id'], df['merchant']]
+    per_seq = strong.groupby(keys, sort=False).any()
+    per_seq['weak'] = weak.groupby(keys, sort=False).any()
+    per_seq['n_txns'] = df.groupby(keys, sort=False).size()
+    per_seq = per_seq[per_seq['n_txns'] >= 2]
+
+    names = [name for name, _, _ in PATTERNS]
+    hits = per_seq[names].to_numpy()
+    first_hit = np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+    pattern_type = np.array([p for _, p, _ in PATTERNS] + ["None"], dtype=object)[first_hit]
+    reason = np.array([r for _, _, r in PATTERNS] + [""], dtype=object)[first_hit]
+    decision = np.where(first_hit >= 0, PREDATORY, np.where(per_seq['weak'], UNCERTAIN, SAFE))
+    reason = np.where(decision == SAFE, "Transactions show normal consistent activity.", reason)
+    reason = np.where(decision == UNCERTAIN, "", reason)
+
+    result = pd.DataFrame({
+        "decision": decision,
+        "pattern_type": np.where(decision == UNCERTAIN, "", pattern_type),
+        "reason": reason,
+        "n_txns": per_seq['n_txns'].to_numpy(),
+    }, index=per_seq.index)
+    result.index.names = ['user_id', 'merchant']
+    return result.reset_index()
+
+
+def summarize(result):
+    counts = result['decision'].value_counts()
+    total = len(result)
+    llm = int(counts.get(UNCERTAIN, 0))
+    return {
+        "sequences": total,
+        "predatory": int(counts.get(PREDATORY, 0)),
+        "safe": int(counts.get(SAFE, 0)),
+        "uncertain": llm,
+        "llm_avoided_pct": round(100 * (total - llm) / total, 1) if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule-based triage of (user, merchant) sequences")
+    parser.add_argument("input_file", help="Raw transactions CSV")
+    parser.add_argument("--output", default="triage.csv", help="Per-sequence decisions")
+    args = parser.parse_args()
+
+    result = triage(pd.read_csv(args.input_file))
+    result.to_csv(args.output, index=False)
+    print(f"Triage: {summarize(result)}")
+    print(f"Saved decisions to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+# Columnar copies of the transaction CSVs (mock_transactions*.csv,
+# live_model_input*.csv). Convert once with
+#   python txn_store.py ../data/mock_transactions.csv --partition-by user
+# and read_transactions("mock_transactions.csv", ...) picks up the
+# mock_transactions.parquet dataset next to it instead of re-parsing the CSV.
+#
+# On disk: UUIDs are 16-byte fixed_size_binary, timestamps int64 (timestamp[us]),
+# low-cardinality text (merchant, category, ...) dictionary encoded. Partitioned
+# by a stable user_id hash ("user_bucket=N/") or by month ("month=YYYY-MM/");
+# files are sorted by user, merchant and time so row-group statistics prune well.
+
+UUID_COLUMNS = ("transaction_id", "Transaction_ID")
+TIMESTAMP_COLUMNS = ("timestamp",)
+TEXT_DTYPES = {name: str for name in (
+    "transaction_id", "Transaction_ID", "user_id", "merchant", "description", "Description", "category", "Category"
+)}
+# Text columns with fewer distinct values than this fraction of rows become dictionaries
+DICTIONARY_MAX_RATIO = 0.5
+DEFAULT_BUCKETS = 16
+ROW_GROUP_SIZE = 64 * 1024
+PARTITION_COLUMNS = ("user_bucket", "month")
+
+_DASHES = (8, 13, 18, 23)
+_HEX_DIGITS = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+_HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+_HEX_VALUES[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+_HEX_VALUES[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+_HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def uuids_to_binary(values):
+    """UUID strings -> pa.binary(16) array, or None if any value is not a UUID."""
+    strings = pa.array(values, type=pa.string())
+    if strings.null_count or len(strings) == 0:
+        return None
+    if not pc.all(pc.equal(pc.binary_length(strings), 36)).as_py():
+        return None
+    # Every value is 36 bytes, so the data buffer is one (n, 36) block
+    start = np.frombuffer(strings.buffers()[1], dtype=np.int32)[strings.offset]
+    chars = np.frombuffer(strings.buffers()[2], dtype=np.uint8)[start:start + 36 * len(strings)].reshape(-1, 36)
+    if not (chars[:, _DASHES] == ord("-")).all():
+        return None
+    nibbles = _HEX_VALUES[np.delete(chars, _DASHES, axis=1)]
+    if (nibbles == 255).any():
+        return None
+    raw = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+    return pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(raw), [None, pa.py_buffer(raw.tobytes())])
+
+
+def uuid_strings(array):
+    """pa.binary(16) array -> pa.string() array of canonical lowercase UUIDs, without Python objects."""
+    array = array.combine_chunks() if isinstance(array, pa.ChunkedArray) else array
+    raw = np.frombuffer(array.buffers()[1], dtype=np.uint8)[array.offset * 16:][:16 * len(array)].reshape(-1, 16)
+    hexed = np.empty((len(raw), 32), dtype=np.uint8)
+    hexed[:, 0::2] = _HEX_DIGITS[raw >> 4]
+    hexed[:, 1::2] = _HEX_DIGITS[raw & 0x0F]
+    chars = np.full((len(raw), 36), ord("-"), dtype=np.uint8)
+    # 8-4-4-4-12 groups, each shifted right by the dashes before it
+    for dashes, (start, stop) in enumerate(((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))):
+        chars[:, start + dashes:stop + dashes] = hexed[:, start:stop]
+    offsets = np.arange(0, 36 * (len(raw) + 1), 36, dtype=np.int32)
+    return pa.StringArray.from_buffers(len(raw), pa.py_buffer(offsets), pa.py_buffer(chars))
+
+
+def binary_to_uuids(array):
+    """pa.binary(16) array -> canonical lowercase UUID strings (numpy object array)."""
+    return uuid_strings(array).to_numpy(zero_copy_only=False)
+
+
+def user_bucket(user_ids, buckets):
+    """Stable (crc32) hash bucket per user id, identical across runs and machines."""
+    codes, uniques = pd.factorize(pd.Series(user_ids).astype(str))
+    table = np.array([zlib.crc32(u.encode()) % buckets for u in uniques], dtype=np.int32)
+    return table[codes]
+
+
+def to_table(df):
+    """Typed Arrow table for a transactions DataFrame (see module comment)."""
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if name in UUID_COLUMNS:
+            binary = uuids_to_binary(series)
+            if binary is not None:
+                columns[name] = binary
+                continue
+        if name in TIMESTAMP_COLUMNS:
+            columns[name] = pa.array(pd.to_datetime(series).astype("datetime64[us]"), type=pa.timestamp("us"))
+            continue
+        if series.dtype == object or pd.api.types.is_string_dtype(series):
+            strings = pa.array(series, type=pa.string(), from_pandas=True)
+            if series.nunique() <= DICTIONARY_MAX_RATIO * len(series):
+                strings = pc.dictionary_encode(strings)
+            columns[name] = strings
+            continue
+        columns[name] = pa.array(series, from_pandas=True)
+    return pa.table(columns)
+
+
+def write_dataset(df, path, partition_by="user", buckets=DEFAULT_BUCKETS):
+    """
+    Write transactions as a Parquet dataset directory.
+    partition_by: "user" (user_id hash buckets), "month", or None for a single file.
+    """
+    sort_keys = [c for c in ("user_id", "merchant", "timestamp") if c in df.columns]
+    if sort_keys:
+        df = df.sort_values(sort_keys, kind="stable")
+    table = to_table(df.reset_index(drop=True))
+    meta = {"partition_by": partition_by, "buckets": buckets, "source_rows": len(df)}
+
+    partitioning = None
+    if partition_by == "user":
+        table = table.append_column("user_bucket", pa.array(user_bucket(df["user_id"], buckets), type=pa.int32()))
+        partitioning = ds.partitioning(pa.schema([("user_bucket", pa.int32())]), flavor="hive")
+    elif partition_by == "month":
+        months = pc.strftime(table.column("timestamp"), format="%Y-%m")
+        table = table.append_column("month", months)
+        partitioning = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+    elif partition_by is not None:
+        raise ValueError(f"partition_by must be 'user', 'month' or None, got {partition_by!r}")
+
+    if os.path.exists(path):
+        # Only ever replace a dataset this module wrote
+        if not _dataset_meta(path):
+            raise FileExistsError(f"{path} exists and is not a txn_store dataset")
+        shutil.rmtree(path)
+    ds.write_dataset(
+        table, path, format="parquet", partitioning=partitioning,
+        max_rows_per_group=ROW_GROUP_SIZE, min_rows_per_group=min(ROW_GROUP_SIZE, len(table)) or 1,
+    )
+    with open(os.path.join(path, "_sentinel.json"), "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def parquet_path(csv_path):
+    """Where the Parquet copy of a CSV lives: mock_transactions.csv -> mock_transactions.parquet"""
+    root, ext = os.path.splitext(csv_path)
+    return root + ".parquet" if ext.lower() == ".csv" else csv_path
+
+
+def resolve(path):
+    """The Parquet copy of `path` if one exists and is not older than the CSV, else `path`."""
+    candidate = parquet_path(path)
+    if candidate == path or not os.path.exists(candidate):
+        return path
+    if os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(candidate):
+        print(f"Warning: {candidate} is older than {path}; reading the CSV. Re-run txn_store.py to refresh it.")
+        return path
+    return candidate
+
+
+def _dataset_meta(path):
+    meta_path = os.path.join(path, "_sentinel.json")
+    if os.path.isdir(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            return json.load(f)
+    return {}
+
+
+def _typed_value(column, value):
+    if column in TIMESTAMP_COLUMNS:
+        return pd.Timestamp(value).to_datetime64()
+    return value
+
+
+def _expression(filters, meta):
+    """pyarrow.dataset expression for [(column, op, value), ...] (all must hold)."""
+    ops = {
+        "==": lambda f, v: f == v, "!=": lambda f, v: f != v,
+        "<": lambda f, v: f < v, "<=": lambda f, v: f <= v,
+        ">": lambda f, v: f > v, ">=": lambda f, v: f >= v,
+        "in": lambda f, v: f.isin(v), "not in": lambda f, v: ~f.isin(v),
+    }
+    expr = None
+    for column, op, value in filters:
+        if op not in ops:
+            raise ValueError(f"Unsupported filter operator {op!r}")
+        if column in UUID_COLUMNS:
+            value = [uuids_to_binary([v])[0].as_py() for v in value] if op in ("in", "not in") \
+                else uuids_to_binary([value])[0].as_py()
+        elif op in ("in", "not in"):
+            value = [_typed_value(column, v) for v in value]
+        else:
+            value = _typed_value(column, value)
+        term = ops[op](ds.field(column), value)
+        # A user_id filter only needs the partitions those users hash to
+        if column == "user_id" and op in ("==", "in") and meta.get("partition_by") == "user":
+            users = [value] if op == "==" else list(value)
+            buckets = sorted(set(user_bucket(users, meta["buckets"]).tolist())) if users else []
+            term = term & ds.field("user_bucket").isin(buckets)
+        expr = term if expr is None else expr & term
+    return expr
+
+
+def _filter_frame(df, filters):
+    """The same filters applied after the fact, for CSV input."""
+    keep = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        series = df[column]
+        if op in ("in", "not in"):
+            mask = series.isin([_typed_value(column, v) for v in value])
+            keep &= ~mask.to_numpy() if op == "not in" else mask.to_numpy()
+            continue
+        value = _typed_value(column, value)
+        mask = {"==": series == value, "!=": series != value, "<": series < value,
+                "<=": series <= value, ">": series > value, ">=": series >= value}.get(op)
+        if mask is None:
+            raise ValueError(f"Unsupported filter operator {op!r}")
+        keep &= mask.to_numpy()
+    return df[keep].reset_index(drop=True)
+
+
+def read_table(path, columns=None, filters=None):
+    """Arrow table from a Parquet dataset, reading only `columns` and the row groups `filters` can match."""
+    meta = _dataset_meta(path)
+    dataset = ds.dataset(path, format="parquet", partitioning="hive" if meta.get("partition_by") else None)
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c not in PARTITION_COLUMNS]
+    expr = _expression(filters, meta) if filters else None
+    return dataset.to_table(columns=list(columns), filter=expr)
+
+
+def to_frame(table, categorical=False):
+    """
+    DataFrame with the same column types read_csv + pd.to_datetime give:
+    UUIDs back as strings and dictionaries as plain strings. categorical=True
+    keeps dictionaries as pandas categoricals (much smaller, but groupby on
+    them needs observed=True).
+    """
+    data = {}
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_fixed_size_binary(column.type) and column.type.byte_width == 16:
+            data[name] = binary_to_uuids(column)
+        elif pa.types.is_dictionary(column.type) and not categorical:
+            data[name] = column.cast(pa.string()).to_pandas()
+        else:
+            data[name] = column.to_pandas()
+    return pd.DataFrame(data, columns=table.column_names)
+
+
+def read_transactions(path, columns=None, filters=None, categorical=False):
+    """
+    Transactions from a CSV path or its Parquet copy (see resolve()).
+
+    columns: only these columns are read (projection).
+    filters: [(column, op, value), ...], all of which must hold; op is one of
+      ==, !=, <, <=, >, >=, in, not in. On Parquet they are pushed down to
+      partition and row-group pruning; on CSV they are applied after loading.
+    Timestamp columns come back as datetime64.
+    """
+    source = resolve(path)
+    if source.lower().endswith(".csv"):
+        # Filter columns are read too, even when they are not in the projection
+        usecols = None
+        if columns is not None:
+            usecols = list(columns) + [c for c, _, _ in filters or [] if c not in columns]
+        df = pd.read_csv(source, usecols=usecols)
+        for name in TIMESTAMP_COLUMNS:
+            if name in df.columns:
+                df[name] = pd.to_datetime(df[name])
+        if filters:
+            df = _filter_frame(df, filters)
+        if columns is not None:
+            df = df[list(columns)]
+        return df
+    return to_frame(read_table(source, columns, filters), categorical=categorical)
+
+
+def iter_transactions(path, columns=None, chunk_rows=100_000):
+    """
+    read_transactions() in chunks of about chunk_rows rows, in file order,
+    for inputs too large to load at once.
+    """
+    source = resolve(path)
+    if source.lower().endswith(".csv"):
+        # Text columns stay text even when a chunk happens to hold only numbers or blanks
+        for chunk in pd.read_csv(source, usecols=columns, chunksize=chunk_rows, dtype=TEXT_DTYPES):
+            for name in TIMESTAMP_COLUMNS:
+                if name in chunk.columns:
+                    chunk[name] = pd.to_datetime(chunk[name])
+            yield chunk if columns is None else chunk[list(columns)]
+        return
+    meta = _dataset_meta(source)
+    dataset = ds.dataset(source, format="parquet", partitioning="hive" if meta.get("partition_by") else None)
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c not in PARTITION_COLUMNS]
+    for batch in dataset.to_batches(columns=list(columns), batch_size=chunk_rows):
+        if batch.num_rows:
+            yield to_frame(pa.Table.from_batches([batch]))
+
+
+def estimate_rows(path, sample_lines=10_000):
+    """Row count of a Parquet copy, or an estimate for a CSV from its size and first lines."""
+    source = resolve(path)
+    if not source.lower().endswith(".csv"):
+        return ds.dataset(source, format="parquet", partitioning="hive" if _dataset_meta(source) else None).count_rows()
+    with open(source, "rb") as f:
+        f.readline()
+        sample = [len(line) for _, line in zip(range(sample_lines), f)]
+    if not sample:
+        return 0
+    return int(os.path.getsize(source) / (sum(sample) / len(sample)))
+
+
+def _size_on_disk(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert transaction CSVs to partitioned, typed Parquet datasets")
+    parser.add_argument("input_files", nargs="+", help="CSV files (e.g. ../data/mock_transactions.csv)")
+    parser.add_argument("--partition-by", choices=["user", "month", "none"], default="user",
+                        help="user_id hash buckets (default), month, or a single unpartitioned dataset")
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS, help="Number of user_id hash buckets")
+    parser.add_argument("--output", default=None, help="Output directory (single input only; default: <input>.parquet)")
+    args = parser.parse_args()
+
+    if args.output and len(args.input_files) > 1:
+        parser.error("--output needs exactly one input file")
+    for csv_path in args.input_files:
+        out = args.output or parquet_path(csv_path)
+        df = pd.read_csv(csv_path)
+        partition_by = {"user": "user_id", "month": "timestamp"}.get(args.partition_by)
+        if partition_by not in df.columns:
+            # e.g. live_model_input*.csv has neither user_id nor timestamp
+            partition_by = None
+        else:
+            partition_by = args.partition_by
+        write_dataset(df, out, partition_by=partition_by, buckets=args.buckets)
+
+        start = time.time()
+        pd.read_csv(csv_path)
+        csv_s = time.time() - start
+        start = time.time()
+        back = read_transactions(out)
+        parquet_s = time.time() - start
+        arrow_mb = read_table(out).nbytes / 1e6
+        print(f"{csv_path} -> {out} (partitioned by {partition_by or 'nothing'}): {len(back)} rows, "
+              f"{_size_on_disk(csv_path) / 1e6:.1f} MB -> {_size_on_disk(out) / 1e6:.1f} MB on disk, "
+              f"{df.memory_usage(deep=True).sum() / 1e6:.1f} MB as CSV frame vs {arrow_mb:.1f} MB in Arrow, "
+              f"load {csv_s * 1000:.0f} ms -> {parquet_s * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
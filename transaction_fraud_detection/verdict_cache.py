@@ -0,0 +1,180 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+# Bump when prompt building or response parsing changes what a cached verdict means
+CACHE_VERSION = 1
+
+# Weight files bigger than this are fingerprinted by size and mtime instead of content
+CONTENT_HASH_LIMIT = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    identity TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    last_used INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)"
+
+# Verdicts that describe a failed call rather than the sequence are never cached
+UNCACHEABLE_TYPES = {"Error", "ParseError"}
+
+
+def fingerprint(path):
+    """Stable hash of a model/adapter file or directory (None if it does not exist)."""
+    if not path or not os.path.exists(path):
+        return None
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names
+    )
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        size = os.path.getsize(file)
+        if size > CONTENT_HASH_LIMIT:
+            digest.update(f"{size}:{os.stat(file).st_mtime_ns}".encode())
+            continue
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def cache_key(identity, prompt):
+    return hashlib.sha256(f"{identity}\0{prompt}".encode()).hexdigest()
+
+
+class VerdictCache:
+    """
+    Persistent prompt -> verdict cache for the pattern detectors.
+
+    Entries are keyed by sha256(model identity + exact prompt), so a history
+    that has not changed since the last run is answered without generating.
+    Opening the cache with a different identity (new adapter, merged
+    checkpoint, quantization or remote model) drops the old entries. Size is
+    bounded; the least recently used verdicts are evicted first.
+    """
+
+    def __init__(self, path="verdict_cache.db", identity="", max_entries=1_000_000):
+        self.path = path
+        self.identity = f"v{CACHE_VERSION}:{identity}"
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.execute(INDEX)
+        self._lock = threading.Lock()
+
+        self.invalidated = self._conn.execute(
+            "DELETE FROM verdicts WHERE identity != ?", (self.identity,)
+        ).rowcount
+        self._count, clock = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(last_used), 0) FROM verdicts"
+        ).fetchone()
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def key(self, prompt):
+        return cache_key(self.identity, prompt)
+
+    def get_many(self, keys):
+        """Cached verdict (dict) or None for each key, in order."""
+        if not keys:
+            return []
+        with self._lock:
+            found = {}
+            unique = list(dict.fromkeys(keys))
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, verdict FROM verdicts WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((k, json.loads(v)) for k, v in rows)
+            if found:
+                self._clock += 1
+                self._conn.executemany(
+                    "UPDATE verdicts SET last_used = ? WHERE key = ?",
+                    [(self._clock, k) for k in found]
+                )
+            hits = sum(k in found for k in keys)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return [found.get(k) for k in keys]
+
+    def put_many(self, items):
+        """Store (key, verdict) pairs, then evict down to max_entries."""
+        items = [(k, v) for k, v in items if v.get("pattern_type") not in UNCACHEABLE_TYPES]
+        if not items:
+            return
+        with self._lock:
+            self._clock += 1
+            self._conn.execute("BEGIN")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO verdicts VALUES (?, ?, ?, ?)",
+                    [(k, self.identity, json.dumps(v), self._clock) for k, v in items]
+                )
+                self._count += self._conn.total_changes - before
+                overflow = self._count - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM verdicts WHERE key IN "
+                        "(SELECT key FROM verdicts ORDER BY last_used LIMIT ?)", (overflow,)
+                    )
+                    self._count -= overflow
+                    self.evictions += overflow
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.writes += len(items)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "invalidated": self.invalidated,
+            "entries": self._count,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear the detector verdict cache")
+    parser.add_argument("path", nargs="?", default="verdict_cache.db", help="SQLite cache file")
+    parser.add_argument("--clear", action="store_true", help="Delete every cached verdict")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"No cache at {args.path}.")
+        return
+    conn = sqlite3.connect(args.path)
+    if args.clear:
+        conn.execute("DELETE FROM verdicts")
+        conn.commit()
+        print(f"Cleared {args.path}.")
+    for identity, count in conn.execute("SELECT identity, COUNT(*) FROM verdicts GROUP BY identity"):
+        print(f"{identity}: {count} verdicts")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()